@@ -13,6 +13,7 @@ import os
 import fitz # Importar PyMuPDF
 import pdfplumber
 import sys
+from contextlib import nullcontext
 
 def safe_print(texto):
     """Imprimir texto de forma segura en Windows"""
@@ -86,8 +87,11 @@ def limpiar_monto_credicoop_v3(monto_str):
         else:
             return "0"
 
-def extraer_datos_banco_credicoop(pdf_path, excel_path=None):
-    """Función principal para extraer datos de Banco Credicoop V3"""
+def extraer_datos_banco_credicoop(pdf_path, excel_path=None, progress_callback=None, medir_etapa=None):
+    """Función principal para extraer datos de Banco Credicoop V3.
+    Si se pasa progress_callback(pagina, total), Camelot se ejecuta página por página para informar el avance.
+    medir_etapa(nombre), si se pasa, es un context manager para medir el tiempo de cada etapa."""
+    medir_etapa = medir_etapa or (lambda nombre: nullcontext())
     try:
         print(f"Extrayendo datos del PDF: {pdf_path}")
         
@@ -107,18 +111,26 @@ def extraer_datos_banco_credicoop(pdf_path, excel_path=None):
         
         # Método 1: Camelot con parámetros específicos para Credicoop
         print("Intentando extracción con Camelot...")
+        parametros_camelot = dict(
+            flavor='stream',
+            table_areas=None,
+            columns=None,
+            split_text=True,
+            flag_size=True,
+            edge_tol=500,
+            row_tol=10
+        )
         try:
-            tables = camelot.read_pdf(
-                pdf_path, 
-                pages='all', 
-                flavor='stream',
-                table_areas=None,
-                columns=None,
-                split_text=True,
-                flag_size=True,
-                edge_tol=500,
-                row_tol=10
-            )
+            if progress_callback:
+                # Misma extracción, pero de a una página para poder reportar el progreso
+                tables = []
+                for pagina in range(1, total_paginas + 1):
+                    with medir_etapa('camelot'):
+                        tables.extend(camelot.read_pdf(pdf_path, pages=str(pagina), **parametros_camelot))
+                    progress_callback(pagina, total_paginas)
+            else:
+                with medir_etapa('camelot'):
+                    tables = camelot.read_pdf(pdf_path, pages='all', **parametros_camelot)
             if tables:
                 print(f"Camelot Stream: Se encontraron {len(tables)} tablas")
         except Exception as e:
@@ -129,7 +141,8 @@ def extraer_datos_banco_credicoop(pdf_path, excel_path=None):
         if not tables:
             print("Camelot no encontró tablas, intentando con PDFPlumber...")
             try:
-                tables = extraer_con_pdfplumber_fallback(pdf_path)
+                with medir_etapa('pdfplumber'):
+                    tables = extraer_con_pdfplumber_fallback(pdf_path)
                 if tables:
                     print(f"PDFPlumber: Se encontraron {len(tables)} tablas")
             except Exception as e:
@@ -153,7 +166,8 @@ def extraer_datos_banco_credicoop(pdf_path, excel_path=None):
             print(f"  Tabla {i+1}: {len(table.df)} filas, {len(table.df.columns)} columnas")
             
             # Procesar la tabla
-            df_procesado = procesar_tabla_credicoop_v3(table.df)
+            with medir_etapa('parseo'):
+                df_procesado = procesar_tabla_credicoop_v3(table.df)
             if not df_procesado.empty:
                 all_data.append(df_procesado)
                 print(f"  Tabla {i+1}: {len(df_procesado)} registros extraídos")
@@ -185,7 +199,8 @@ def extraer_datos_banco_credicoop(pdf_path, excel_path=None):
                 if excel_dir and not os.path.exists(excel_dir):
                     os.makedirs(excel_dir, exist_ok=True)
                 
-                guardar_excel_credicoop_v3(df_final, excel_path)
+                with medir_etapa('excel'):
+                    guardar_excel_credicoop_v3(df_final, excel_path)
                 print(f"Excel guardado exitosamente en: {excel_path}")
             except Exception as e:
                 print(f"Error guardando Excel: {e}")
@@ -9,6 +9,7 @@ import pdfplumber
 import pandas as pd
 import re
 import os
+from contextlib import nullcontext
 
 def safe_print(texto):
     """Imprimir de forma segura en Windows"""
@@ -17,19 +18,25 @@ def safe_print(texto):
     except UnicodeEncodeError:
         print(texto.encode('utf-8', errors='ignore').decode('utf-8'))
 
-def extraer_datos_mercado_pago_directo(pdf_path, excel_path=None, max_paginas=None):
-    """Función principal para extraer datos de Mercado Pago"""
+def extraer_datos_mercado_pago_directo(pdf_path, excel_path=None, max_paginas=None, progress_callback=None,
+                                       medir_etapa=None, log=None):
+    """Función principal para extraer datos de Mercado Pago.
+    medir_etapa(nombre), si se pasa, es un context manager para medir el tiempo de cada etapa.
+    log(mensaje, nivel='info', **campos), si se pasa, registra el mensaje en el log del servidor."""
+    medir_etapa = medir_etapa or (lambda nombre: nullcontext())
+    log = log or (lambda mensaje, nivel='info', **campos: safe_print(mensaje))
     try:
         safe_print(f"Extrayendo datos del PDF: {pdf_path}")
         
         # Extraer datos usando pdfplumber
-        df = extraer_con_pdfplumber_mercado_pago(pdf_path)
+        with medir_etapa('pdfplumber'):
+            df = extraer_con_pdfplumber_mercado_pago(pdf_path, progress_callback=progress_callback)
         
         if df is None or df.empty:
-            safe_print("No se encontraron datos para extraer")
+            log("No se encontraron datos para extraer", nivel='warning')
             return None
         
-        safe_print(f"Total de transacciones extraídas: {len(df)}")
+        log(f"Total de transacciones extraídas: {len(df)}", filas=len(df))
         
         # Calcular balance
         saldo_inicial = 0
@@ -42,20 +49,23 @@ def extraer_datos_mercado_pago_directo(pdf_path, excel_path=None, max_paginas=No
         else:
             saldo_final = saldo_inicial + total_creditos - total_debitos
         
-        safe_print(f"Balance: Saldo Inicial: ${saldo_inicial:,.2f}, Débitos: ${total_debitos:,.2f}, Créditos: ${total_creditos:,.2f}, Saldo Final: ${saldo_final:,.2f}")
+        log(f"Balance: Saldo Inicial: ${saldo_inicial:,.2f}, Débitos: ${total_debitos:,.2f}, Créditos: ${total_creditos:,.2f}, Saldo Final: ${saldo_final:,.2f}",
+            debitos=float(total_debitos), creditos=float(total_creditos), saldo_final=float(saldo_final))
         
         # Guardar Excel si se especifica
         if excel_path:
-            guardar_excel_mercado_pago(df, excel_path)
+            with medir_etapa('excel'):
+                guardar_excel_mercado_pago(df, excel_path)
         
         return df
         
     except Exception as e:
-        safe_print(f"Error en extracción: {e}")
+        log(f"Error en extracción: {e}", nivel='error')
         return None
 
-def extraer_con_pdfplumber_mercado_pago(pdf_path):
-    """Extraer datos usando pdfplumber - Mercado Pago optimizado"""
+def extraer_con_pdfplumber_mercado_pago(pdf_path, progress_callback=None):
+    """Extraer datos usando pdfplumber - Mercado Pago optimizado.
+    progress_callback(pagina, total) se llama después de procesar cada página."""
     try:
         transacciones = []
         
@@ -144,6 +154,9 @@ def extraer_con_pdfplumber_mercado_pago(pdf_path):
                             transaccion["Page"] = page_num
                             transaccion["Row"] = i
                             transacciones.append(transaccion)
+                
+                if progress_callback:
+                    progress_callback(page_num + 1, total_paginas)
         
         if not transacciones:
             safe_print("No se encontraron transacciones")
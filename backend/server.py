@@ -1,30 +1,270 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, send_file
+import time
+_inicio_arranque = time.perf_counter()
+
+from flask import Flask, Request, request, jsonify, send_file, Response, g, redirect
+from werkzeug.exceptions import RequestEntityTooLarge, ClientDisconnected
+from werkzeug.datastructures import FileStorage
 from flask_cors import CORS
 import os
 import tempfile
+import io
 import importlib.util
+import inspect
 from pathlib import Path
 import sys
 import requests
 import threading
 import uuid
-import pandas as pd
+import json
+import sqlite3
+import queue
+import atexit
+import gc
+import multiprocessing
+import shutil
+import subprocess
+import zipfile
+import hashlib
+import pickle
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import glob
+from urllib.parse import quote, urlsplit
 import re
+import random
+import unicodedata
+import functools
+try:
+    import fcntl  # No existe en Windows
+except ImportError:
+    fcntl = None
 
-# Logging para diagnóstico
+# ==================== LOGS ESTRUCTURADOS ====================
+# Los threads de los requests no escriben en stdout: dejan el registro en una cola y un thread
+# aparte (QueueListener) lo formatea y lo escribe. Si la cola se llena el registro se descarta
+# en lugar de frenar al request. Cada registro lleva el id de correlación del request que lo
+# generó (X-Request-ID), también dentro de los threads de jobs y los procesos del pool.
+# LOG_FORMATO=json emite una línea JSON por registro (Railway lee los campos level y message).
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO').upper()
+LOG_FORMATO = os.environ.get('LOG_FORMATO', 'json').lower()
+LOG_COLA_MAX = int(os.environ.get('LOG_COLA_MAX', '10000'))
+
+# Id de correlación y decisión de muestreo del request en curso (se heredan a los threads de jobs)
+_id_correlacion = contextvars.ContextVar('id_correlacion', default=None)
+_log_muestreado = contextvars.ContextVar('log_muestreado', default=True)
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro; los campos pasados con extra={'campos': {...}} van como claves propias"""
+    def format(self, record):
+        datos = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'pid': record.process
+        }
+        datos.update(getattr(record, 'campos', None) or {})
+        if record.exc_text:
+            datos['exc'] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+class FormatoTexto(logging.Formatter):
+    """El formato de texto de siempre, con el id de correlación"""
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+    
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = None
+        return super().format(record)
+
+class ManejadorCola(QueueHandler):
+    """QueueHandler que nunca bloquea: con la cola llena el registro se descarta y se cuenta"""
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+    
+    def filter(self, record):
+        # Los requests no muestreados solo dejan WARNING o más grave
+        if record.levelno < logging.WARNING and not _log_muestreado.get():
+            return False
+        record.request_id = _id_correlacion.get()
+        return super().filter(record)
+    
+    def prepare(self, record):
+        # El mensaje y la traza se resuelven acá: los argumentos pueden cambiar antes de que se escriba
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+def _manejador_salida():
+    manejador = logging.StreamHandler(sys.stdout)
+    manejador.setFormatter(FormatoJSON() if LOG_FORMATO == 'json' else FormatoTexto())
+    return manejador
+
+_manejador_logs = ManejadorCola(queue.Queue(LOG_COLA_MAX))
+_listener_logs = None
+
+def _iniciar_listener_logs():
+    """Arranca el thread que escribe los logs (de nuevo en cada proceso hijo después de un fork)"""
+    global _listener_logs
+    _listener_logs = QueueListener(_manejador_logs.queue, _manejador_salida())
+    _listener_logs.start()
+
+def _reiniciar_logs_en_hijo():
+    # El thread del listener no sobrevive al fork y la cola heredada pudo quedar con su lock tomado
+    _manejador_logs.queue = queue.Queue(LOG_COLA_MAX)
+    _manejador_logs.descartados = 0
+    _iniciar_listener_logs()
+
+def _detener_listener_logs():
+    if _listener_logs is not None and _listener_logs._thread is not None:
+        _listener_logs.stop()
+
+logging.basicConfig(level=LOG_NIVEL, handlers=[_manejador_logs], force=True)
+_iniciar_listener_logs()
+atexit.register(_detener_listener_logs)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_logs_en_hijo)
+
+# Nivel al que se registra lo que los extractores imprimen con print. Con INFO se conserva y el volumen
+# lo controla el muestreo por ruta (MUESTREO_LOGS); DEBUG lo descarta salvo con LOG_NIVEL=DEBUG
+LOG_NIVEL_PRINTS = logging.getLevelName(os.environ.get('LOG_NIVEL_PRINTS', 'INFO').upper())
+
+class _SalidaPorThread:
+    """Reemplazo de sys.stdout: lo que escribe un thread con una captura activa va al log,
+    el resto pasa a la salida original"""
+    def __init__(self, original):
+        self.original = original
+        self.local = threading.local()
+    
+    def write(self, texto):
+        captura = getattr(self.local, 'captura', None)
+        if captura is None:
+            return self.original.write(texto)
+        captura.escribir(texto)
+        return len(texto)
+    
+    def flush(self):
+        self.original.flush()
+    
+    def __getattr__(self, nombre):
+        return getattr(self.original, nombre)
+
+class _CapturaSalida:
+    """Junta lo impreso hasta cada salto de línea y lo registra como un log del extractor"""
+    def __init__(self, registrador):
+        self.registrador = registrador
+        self.pendiente = ''
+    
+    def escribir(self, texto):
+        if not self.registrador.isEnabledFor(LOG_NIVEL_PRINTS):
+            return
+        lineas = (self.pendiente + texto).split('\n')
+        self.pendiente = lineas.pop()
+        for linea in lineas:
+            if linea.strip():
+                self.registrador.log(LOG_NIVEL_PRINTS, linea, extra={'campos': {'origen': 'print'}})
+    
+    def cerrar(self):
+        self.escribir('\n')
+
+_salida_lock = threading.Lock()
+
+@contextmanager
+def capturar_salida(nombre_logger):
+    """Redirige los print del thread actual al logger indicado mientras dura el bloque"""
+    if not isinstance(sys.stdout, _SalidaPorThread):
+        with _salida_lock:
+            if not isinstance(sys.stdout, _SalidaPorThread):
+                sys.stdout = _SalidaPorThread(sys.stdout)
+    salida = sys.stdout
+    anterior = getattr(salida.local, 'captura', None)
+    captura = _CapturaSalida(logging.getLogger(nombre_logger))
+    salida.local.captura = captura
+    try:
+        yield
+    finally:
+        salida.local.captura = anterior
+        captura.cerrar()
+
+def iniciar_thread(target, *args, name=None):
+    """Lanza un thread daemon que conserva el id de correlación del request que lo crea"""
+    contexto = contextvars.copy_context()
+    thread = threading.Thread(target=contexto.run, args=(target, *args), name=name, daemon=True)
+    thread.start()
+    return thread
+
 logger = logging.getLogger(__name__)
 
+# ==================== FIN LOGS ESTRUCTURADOS ====================
+
+# ==================== IMPORTACIONES DIFERIDAS ====================
+# pandas, camelot, cv2, fitz y pdfplumber tardan segundos en importarse y ocupan memoria en cada
+# worker. Ninguno se importa al cargar el módulo: /health, /extractors y OAuth no los necesitan.
+# Se cargan la primera vez que se usan, o en el master de gunicorn con --preload y
+# PRECARGA_LIBRERIAS=1 (ver ARRANQUE al final del archivo) para compartirlos entre workers.
+TIEMPOS_IMPORTACION = {}  # módulo -> ms que tardó su primera importación en este proceso
+
+def importar_midiendo(nombre):
+    """Importa un módulo y registra cuánto tardó si no estaba cargado"""
+    if nombre in sys.modules:
+        return sys.modules[nombre]
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nombre)
+    TIEMPOS_IMPORTACION[nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+    logger.info(f"Importado {nombre} en {TIEMPOS_IMPORTACION[nombre]:.0f} ms")
+    return modulo
+
+class ModuloDiferido:
+    """Representa un módulo que se importa recién en el primer acceso a un atributo (ej: pd.DataFrame)"""
+    
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+        self._lock = threading.Lock()
+    
+    def _cargar(self):
+        if self._modulo is None:
+            with self._lock:
+                if self._modulo is None:
+                    self._modulo = importar_midiendo(self._nombre)
+        return self._modulo
+    
+    @property
+    def cargado(self):
+        return self._modulo is not None or self._nombre in sys.modules
+    
+    def __getattr__(self, atributo):
+        return getattr(self._cargar(), atributo)
+    
+    def __repr__(self):
+        return f"<ModuloDiferido {self._nombre} ({'cargado' if self.cargado else 'sin cargar'})>"
+
+pd = ModuloDiferido('pandas')
+
+# ==================== FIN IMPORTACIONES DIFERIDAS ====================
+
 # Información de inicio
 logger.info("=" * 60)
 logger.info("SERVIDOR DE EXTRACTORES DE BANCOS - INICIANDO")
@@ -42,29 +282,72 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {
     "origins": "*",
     "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type", "Authorization", "ngrok-skip-browser-warning", "User-Agent"],
-    "expose_headers": ["Content-Type"],
+    "allow_headers": ["Content-Type", "Authorization", "ngrok-skip-browser-warning", "User-Agent", "Range", "If-None-Match", "X-Request-ID", "Idempotency-Key", "Upload-Offset"],
+    "expose_headers": ["Content-Type", "Content-Disposition", "ETag", "Content-Range", "Accept-Ranges", "Server-Timing", "X-Request-ID", "Idempotent-Replayed", "X-Rows", "Upload-Offset", "Upload-Length"],
     "supports_credentials": True
 }})
 
 logger.info("Flask app creada correctamente")
 logger.info("CORS configurado para permitir todos los orígenes")
 
-# Middleware para logging de todas las peticiones
+# Muestreo de logs por ruta (regla de Flask -> fracción de requests que dejan logs INFO).
+# Los endpoints de polling se llaman cada pocos segundos y no aportan nada en cada request.
+# LOG_MUESTREO las ajusta, ej: "/health=0,/extract/status/<job_id>=0.1". Los errores se loguean siempre.
+MUESTREO_LOGS = {
+    '/health': 0.01,
+    '/ready': 0.01,
+    '/metrics': 0.0,
+    '/extract/status/<job_id>': 0.05,
+    '/jobs/<job_id>': 0.05,
+    '/extract/batch/status/<job_id>': 0.05,
+    '/vencimientos/status/<job_id>': 0.05,
+}
+for _regla in filter(None, os.environ.get('LOG_MUESTREO', '').split(',')):
+    _ruta, _, _tasa = _regla.rpartition('=')
+    try:
+        MUESTREO_LOGS[_ruta.strip()] = float(_tasa)
+    except ValueError:
+        logger.warning(f"Regla de LOG_MUESTREO inválida: {_regla}")
+
+_PATRON_ID_CORRELACION = re.compile(r'^[A-Za-z0-9._-]{8,64}$')
+
+# Middleware de logging: un solo registro estructurado por request, al responder
 @app.before_request
 def log_request_info():
-    logger.info(f"Request recibido: {request.method} {request.path}")
-    logger.info(f"Origin: {request.headers.get('Origin', 'No Origin')}")
-    if request.method == 'POST':
-        logger.info(f"Form data keys: {list(request.form.keys())}")
-        logger.info(f"Files: {list(request.files.keys())}")
+    g.inicio_request = time.perf_counter()
+    # Se respeta el id que mande el frontend o un proxy para poder seguir el request de punta a punta
+    recibido = request.headers.get('X-Request-ID', '')
+    id_correlacion = recibido if _PATRON_ID_CORRELACION.match(recibido) else uuid.uuid4().hex[:16]
+    regla = request.url_rule.rule if request.url_rule is not None else None
+    tasa = MUESTREO_LOGS.get(regla, 1.0)
+    g.tokens_log = (
+        _id_correlacion.set(id_correlacion),
+        _log_muestreado.set(tasa >= 1.0 or random.random() < tasa)
+    )
 
 @app.after_request
 def log_response_info(response):
-    logger.info(f"Response enviado: {response.status_code} para {request.path}")
+    response.headers['X-Request-ID'] = _id_correlacion.get() or ''
+    nivel = logging.WARNING if response.status_code >= 500 else logging.INFO
+    logger.log(nivel, f"{request.method} {request.path} {response.status_code}", extra={'campos': {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - g.get('inicio_request', time.perf_counter())) * 1000, 1),
+        'bytes': response.content_length,
+        'origin': request.headers.get('Origin')
+    }})
     # Flask-CORS ya maneja los headers CORS, no agregar manualmente para evitar duplicados
     return response
 
+@app.teardown_request
+def limpiar_contexto_log(error=None):
+    # El thread atiende otros requests después: no dejarle el id ni el muestreo de este
+    tokens = g.pop('tokens_log', None)
+    if tokens:
+        _id_correlacion.reset(tokens[0])
+        _log_muestreado.reset(tokens[1])
+
 @app.route('/', methods=['GET'])
 def root():
     """Endpoint raíz"""
@@ -135,6 +418,456 @@ logger.info(f"Directorio de extractores: {EXTRACTORES_DIR}")
 logger.info(f"Directorio temporal: {TEMP_DIR}")
 logger.info(f"Directorio de extractores existe: {EXTRACTORES_DIR.exists()}")
 
+# ==================== SUBIDA DE ARCHIVOS ====================
+# Los archivos subidos se hashean y validan a medida que llegan (sin esperar a tener todo el body):
+# los chicos quedan en memoria, los grandes se vuelcan a un temporal en disco que después se
+# renombra al destino final, y los que no tienen la firma esperada se descartan sin escribirse.
+UPLOAD_MAX_MB = int(os.environ.get('UPLOAD_MAX_MB', '100'))
+UPLOAD_MEMORIA_MAX_KB = int(os.environ.get('UPLOAD_MEMORIA_MAX_KB', '2048'))
+MAX_PAGINAS_PDF = int(os.environ.get('MAX_PAGINAS_PDF', '300'))
+UPLOADS_DIR = TEMP_DIR / 'uploads'
+
+# Werkzeug responde 413 antes de leer el body si el Content-Length supera el límite
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_MB * 1024 * 1024
+
+# Bytes iniciales válidos por extensión (los PDF pueden tener basura antes del header)
+FIRMAS_ARCHIVO = {
+    '.pdf': (b'%PDF-',),
+    '.xlsx': (b'PK\x03\x04', b'\xd0\xcf\x11\xe0'),
+    '.xls': (b'\xd0\xcf\x11\xe0', b'PK\x03\x04'),
+    '.zip': (b'PK\x03\x04',),
+}
+TAMANO_CABECERA = 1024
+
+class ErrorSubida(Exception):
+    """Archivo subido inválido (firma incorrecta, demasiadas páginas, PDF ilegible)"""
+    def __init__(self, mensaje, status_code=400):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.status_code = status_code
+
+def cabecera_valida(cabecera, extension):
+    """Indica si los primeros bytes corresponden al tipo de archivo (None si todavía no alcanzan)"""
+    firmas = FIRMAS_ARCHIVO.get(extension)
+    if not firmas:
+        return True
+    if extension == '.pdf':
+        if any(firma in cabecera for firma in firmas):
+            return True
+        return False if len(cabecera) >= TAMANO_CABECERA else None
+    if any(cabecera.startswith(firma) for firma in firmas):
+        return True
+    return False if len(cabecera) >= max(len(firma) for firma in firmas) else None
+
+class ArchivoSubida:
+    """Destino de un archivo del multipart: calcula el sha256 y verifica la firma mientras se escribe"""
+    
+    def __init__(self, filename):
+        self.extension = Path(filename or '').suffix.lower()
+        self.hash = hashlib.sha256()
+        self.bytes = 0
+        self.cabecera = b''
+        self.error = None
+        self.ruta_temporal = None
+        self._archivo = io.BytesIO()
+    
+    def write(self, datos):
+        if self.error is not None:
+            # Ya se descartó: no seguir ocupando memoria ni disco con el resto del archivo
+            return len(datos)
+        
+        if len(self.cabecera) < TAMANO_CABECERA:
+            self.cabecera += bytes(datos[:TAMANO_CABECERA - len(self.cabecera)])
+            if cabecera_valida(self.cabecera, self.extension) is False:
+                self.error = f'El contenido no corresponde a un archivo {self.extension}'
+                self._descartar()
+                return len(datos)
+        
+        self.hash.update(datos)
+        self.bytes += len(datos)
+        
+        if self.ruta_temporal is None and self.bytes > UPLOAD_MEMORIA_MAX_KB * 1024:
+            self._volcar_a_disco()
+        return self._archivo.write(datos)
+    
+    def _volcar_a_disco(self):
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+        temporal = tempfile.NamedTemporaryFile(dir=str(UPLOADS_DIR), suffix=self.extension, delete=False)
+        temporal.write(self._archivo.getbuffer())
+        self._archivo = temporal
+        self.ruta_temporal = Path(temporal.name)
+    
+    def _descartar(self):
+        self._archivo.close()
+        if self.ruta_temporal is not None:
+            self.ruta_temporal.unlink(missing_ok=True)
+            self.ruta_temporal = None
+        self._archivo = io.BytesIO()
+    
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+    
+    def contenido(self):
+        """Bytes del archivo si quedó en memoria (None si se volcó a disco)"""
+        return None if self.ruta_temporal is not None else self._archivo.getvalue()
+    
+    def guardar(self, destino):
+        """Deja el archivo en destino: rename si ya está en disco, escritura directa si está en memoria"""
+        if self.ruta_temporal is not None:
+            self._archivo.close()
+            try:
+                os.replace(self.ruta_temporal, destino)
+            except OSError:
+                shutil.move(str(self.ruta_temporal), str(destino))
+            self.ruta_temporal = None
+            self._archivo = io.BytesIO()
+        else:
+            with open(destino, 'wb') as salida:
+                salida.write(self._archivo.getbuffer())
+    
+    def close(self):
+        # Si el request no llegó a guardar el archivo, se borra el temporal
+        self._descartar()
+    
+    def __getattr__(self, nombre):
+        # read, seek, tell, readline... los resuelve el archivo subyacente
+        return getattr(self._archivo, nombre)
+
+class RequestConSubidas(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Se toma antes de leer el body para que las métricas incluyan el tiempo de subida
+        self.inicio = time.perf_counter()
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return ArchivoSubida(filename)
+
+app.request_class = RequestConSubidas
+
+@app.errorhandler(RequestEntityTooLarge)
+def archivo_demasiado_grande(e):
+    return jsonify({
+        'success': False,
+        'message': f'El archivo supera el tamaño máximo permitido ({UPLOAD_MAX_MB} MB)'
+    }), 413
+
+def validar_subida(archivo, extension):
+    """Verifica la firma del archivo subido y, si es PDF, que se pueda abrir y no exceda MAX_PAGINAS_PDF.
+    Devuelve la cantidad de páginas (None si no es PDF). Lanza ErrorSubida si no es válido"""
+    stream = archivo.stream
+    if not isinstance(stream, ArchivoSubida):
+        return None
+    
+    if stream.error is not None:
+        raise ErrorSubida(stream.error)
+    if stream.bytes == 0:
+        raise ErrorSubida('El archivo está vacío')
+    if not cabecera_valida(stream.cabecera, extension):
+        raise ErrorSubida(f'El contenido no corresponde a un archivo {extension}')
+    
+    if extension != '.pdf':
+        return None
+    
+    paginas = contar_paginas_pdf(stream.ruta_temporal or stream.contenido())
+    if paginas is None:
+        raise ErrorSubida('El PDF está dañado o no se puede leer')
+    if paginas > MAX_PAGINAS_PDF:
+        raise ErrorSubida(f'El PDF tiene {paginas} páginas; el máximo es {MAX_PAGINAS_PDF}', 413)
+    return paginas
+
+def guardar_subida(archivo, destino):
+    """Guarda el archivo subido en destino y devuelve su sha256 (None si no se pudo calcular al subir)"""
+    stream = archivo.stream
+    if not isinstance(stream, ArchivoSubida):
+        archivo.save(str(destino))
+        return None
+    stream.guardar(destino)
+    return stream.sha256
+
+# ==================== FIN SUBIDA DE ARCHIVOS ====================
+
+# ==================== TIEMPOS POR ETAPA ====================
+# Desglose de dónde se va el tiempo de un request (subida, validación, caché, espera del pool,
+# carga del extractor, Camelot, escritura del Excel...). Se devuelve en el header estándar
+# Server-Timing y, en las extracciones, como 'timings' (milisegundos) en el JSON.
+# Los extractores pueden recibir el parámetro opcional medir_etapa(nombre) y usarlo como
+# context manager para marcar sus propias etapas.
+
+class MedidorTiempos:
+    """Acumula la duración de cada etapa; si una etapa se repite, se suman sus tiempos"""
+    
+    def __init__(self):
+        self.etapas = {}
+        self.lock = threading.Lock()
+    
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.agregar(nombre, time.perf_counter() - inicio)
+    
+    def agregar(self, nombre, segundos):
+        with self.lock:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+    
+    def combinar(self, etapas, prefijo=''):
+        """Suma las etapas medidas en otro lado (ej: dentro del proceso del pool)"""
+        for nombre, segundos in (etapas or {}).items():
+            self.agregar(prefijo + nombre, segundos)
+    
+    def como_dict(self):
+        """Etapas en milisegundos, en el orden en que se midieron"""
+        with self.lock:
+            return {nombre: round(segundos * 1000, 1) for nombre, segundos in self.etapas.items()}
+    
+    def server_timing(self):
+        return ', '.join(
+            f"{re.sub(r'[^A-Za-z0-9_.-]', '_', nombre)};dur={ms}" for nombre, ms in self.como_dict().items()
+        )
+
+def medidor_request():
+    """Medidor del request actual (se crea la primera vez que se pide)"""
+    if 'medidor' not in g:
+        g.medidor = MedidorTiempos()
+        # Lo que pasó antes de entrar a la vista es, básicamente, la lectura del body
+        inicio = getattr(request, 'inicio', None)
+        if inicio is not None:
+            g.medidor.agregar('subida', time.perf_counter() - inicio)
+    return g.medidor
+
+@app.after_request
+def agregar_server_timing(response):
+    partes = []
+    medidor = g.get('medidor')
+    if medidor is not None and medidor.etapas:
+        partes.append(medidor.server_timing())
+    inicio = getattr(request, 'inicio', None)
+    if inicio is not None:
+        partes.append(f'total;dur={round((time.perf_counter() - inicio) * 1000, 1)}')
+    if partes:
+        response.headers['Server-Timing'] = ', '.join(partes)
+    return response
+
+# ==================== FIN TIEMPOS POR ETAPA ====================
+
+# ==================== I/O SALIENTE ====================
+# Los endpoints que solo esperan a otro servicio (Google OAuth, emails por Supabase) no deben
+# quedarse con los threads de gunicorn que atienden las extracciones. Cada worker gthread tiene
+# GUNICORN_THREADS threads (el mismo valor que Procfile y start.sh pasan a --threads) y cada request
+# ocupa uno de principio a fin, también mientras espera la respuesta externa: no hay una capa
+# asíncrona que lo libere. Por eso estos endpoints tienen un cupo de IO_MAX_REQUESTS threads por
+# worker y, pasado ese cupo, responden 503 con Retry-After en vez de hacer cola. Cuánto retiene un
+# thread cada llamada lo acotan post_http y HOSTS_HTTP: timeouts de conexión y lectura por intento,
+# y reintentos solo si todavía entran en IO_PLAZO_SEGUNDOS.
+# Los streams de /jobs/<id>/events también retienen un thread cada uno (JOBS_EVENTOS_MAX_CONEXIONES).
+# Los dos cupos se reparten juntos: entre ambos dejan siempre HILOS_RESERVADOS threads libres para
+# las extracciones sincrónicas, /ready y /health. Si la configuración no lo cumple se recortan al
+# arrancar y queda registrado en el log.
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))
+HILOS_RESERVADOS = 2
+IO_MAX_REQUESTS = int(os.environ.get('IO_MAX_REQUESTS', str(max(1, GUNICORN_THREADS // 4))))
+JOBS_EVENTOS_MAX_CONEXIONES = int(os.environ.get('JOBS_EVENTOS_MAX_CONEXIONES', str(max(1, GUNICORN_THREADS // 4))))
+
+def _repartir_hilos():
+    """Recorta los cupos de I/O y de eventos para que entre ambos no ocupen los threads reservados"""
+    global IO_MAX_REQUESTS, JOBS_EVENTOS_MAX_CONEXIONES
+    io_pedido, eventos_pedido = max(1, IO_MAX_REQUESTS), max(1, JOBS_EVENTOS_MAX_CONEXIONES)
+    disponibles = GUNICORN_THREADS - HILOS_RESERVADOS
+    IO_MAX_REQUESTS, JOBS_EVENTOS_MAX_CONEXIONES = io_pedido, eventos_pedido
+    # Se recortan primero los streams de eventos: sin cupo, el cliente sigue por polling
+    while IO_MAX_REQUESTS + JOBS_EVENTOS_MAX_CONEXIONES > disponibles and JOBS_EVENTOS_MAX_CONEXIONES > 1:
+        JOBS_EVENTOS_MAX_CONEXIONES -= 1
+    while IO_MAX_REQUESTS + JOBS_EVENTOS_MAX_CONEXIONES > disponibles and IO_MAX_REQUESTS > 1:
+        IO_MAX_REQUESTS -= 1
+    if (IO_MAX_REQUESTS, JOBS_EVENTOS_MAX_CONEXIONES) != (io_pedido, eventos_pedido):
+        logger.error(
+            f"IO_MAX_REQUESTS ({io_pedido}) + JOBS_EVENTOS_MAX_CONEXIONES ({eventos_pedido}) no dejan "
+            f"{HILOS_RESERVADOS} de los {GUNICORN_THREADS} threads libres; se usan {IO_MAX_REQUESTS} y "
+            f"{JOBS_EVENTOS_MAX_CONEXIONES}"
+        )
+    if IO_MAX_REQUESTS + JOBS_EVENTOS_MAX_CONEXIONES >= GUNICORN_THREADS:
+        logger.error(f"GUNICORN_THREADS={GUNICORN_THREADS} es demasiado chico: I/O saliente y eventos pueden ocupar todos los threads")
+
+_repartir_hilos()
+IO_ESPERA_CUPO_SEGUNDOS = float(os.environ.get('IO_ESPERA_CUPO_SEGUNDOS', '2'))
+IO_PLAZO_SEGUNDOS = float(os.environ.get('IO_PLAZO_SEGUNDOS', '35'))
+
+_cupo_io = threading.BoundedSemaphore(IO_MAX_REQUESTS)
+_io_en_curso = 0
+_io_lock = threading.Lock()
+
+def ruta_io(vista):
+    """Decorador para endpoints limitados por I/O saliente: solo IO_MAX_REQUESTS threads por worker pueden estar en ellos"""
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        global _io_en_curso
+        if not _cupo_io.acquire(timeout=IO_ESPERA_CUPO_SEGUNDOS):
+            endpoint = request.url_rule.rule if request.url_rule is not None else request.path
+            metrica_contador('extractores_io_rechazos_total', endpoint=endpoint)
+            logger.warning(f"Cupo de I/O saliente agotado ({IO_MAX_REQUESTS}), se rechaza {request.path}")
+            respuesta = jsonify({
+                'success': False,
+                'error': 'servidor_ocupado',
+                'message': 'Hay demasiadas operaciones externas en curso, intenta de nuevo en unos segundos'
+            })
+            respuesta.headers['Retry-After'] = str(max(1, round(IO_ESPERA_CUPO_SEGUNDOS)))
+            return respuesta, 503
+        with _io_lock:
+            _io_en_curso += 1
+        try:
+            return vista(*args, **kwargs)
+        finally:
+            with _io_lock:
+                _io_en_curso -= 1
+            _cupo_io.release()
+    return envoltura
+
+# ==================== FIN I/O SALIENTE ====================
+
+# ==================== CLIENTE HTTP SALIENTE ====================
+# Las llamadas a Google y a Supabase reutilizan conexiones keep-alive: cada proceso tiene un
+# HTTPAdapter (con su pool de urllib3) por host, en vez de un handshake TCP+TLS por llamada.
+# Los errores de conexión y los 5xx transitorios se reintentan con backoff exponencial y jitter
+# dentro de IO_PLAZO_SEGUNDOS. Los timeouts de lectura no se reintentan: el servicio pudo haber
+# procesado el pedido (un email ya enviado, un código de OAuth ya canjeado).
+# Como mucho IO_MAX_REQUESTS threads por worker hacen llamadas salientes a la vez
+HTTP_POOL_CONEXIONES = int(os.environ.get('HTTP_POOL_CONEXIONES', str(max(1, IO_MAX_REQUESTS))))
+HTTP_BACKOFF_SEGUNDOS = float(os.environ.get('HTTP_BACKOFF_SEGUNDOS', '0.5'))
+
+# host -> timeouts (conexión, lectura), reintentos y status que se reintentan
+HOSTS_HTTP = {
+    'oauth2.googleapis.com': {'timeout': (5, 20), 'reintentos': 3, 'status_reintentables': (500, 502, 503, 504)},
+}
+HOST_HTTP_DEFECTO = {'timeout': (5, 30), 'reintentos': 2, 'status_reintentables': (502, 503, 504)}
+
+_adaptadores_http = {}
+_adaptadores_http_pid = None
+_estadisticas_http = {}
+_http_lock = threading.Lock()
+
+def _adaptador_http(host):
+    """HTTPAdapter del host para el proceso actual (los pools heredados de un fork no se reutilizan)"""
+    global _adaptadores_http_pid
+    with _http_lock:
+        if _adaptadores_http_pid != os.getpid():
+            _adaptadores_http.clear()
+            _estadisticas_http.clear()
+            _adaptadores_http_pid = os.getpid()
+        adaptador = _adaptadores_http.get(host)
+        if adaptador is None:
+            adaptador = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_CONEXIONES)
+            _adaptadores_http[host] = adaptador
+        return adaptador
+
+def _registrar_llamada_http(host, segundos, resultado, reintentos):
+    with _http_lock:
+        estadistica = _estadisticas_http.setdefault(host, {
+            'llamadas': 0, 'errores': 0, 'reintentos': 0, 'segundos_total': 0.0, 'segundos_max': 0.0
+        })
+        estadistica['llamadas'] += 1
+        estadistica['reintentos'] += reintentos
+        estadistica['segundos_total'] += segundos
+        estadistica['segundos_max'] = max(estadistica['segundos_max'], segundos)
+        if resultado == 'error' or resultado.startswith('5'):
+            estadistica['errores'] += 1
+    metrica_contador('extractores_http_saliente_total', host=host, resultado=resultado)
+    metrica_histograma('extractores_http_saliente_duration_seconds', segundos, host=host)
+
+def _espera_reintento(intento, respuesta=None):
+    """Backoff exponencial con jitter completo; respeta Retry-After si el servicio lo manda"""
+    espera = random.uniform(0, HTTP_BACKOFF_SEGUNDOS * (2 ** intento))
+    retry_after = respuesta.headers.get('Retry-After') if respuesta is not None else None
+    if retry_after and retry_after.isdigit():
+        espera = max(espera, float(retry_after))
+    return espera
+
+def post_http(url, timeout=None, **kwargs):
+    """POST por el pool keep-alive del host, con sus timeouts y reintentos. Devuelve la requests.Response"""
+    host = urlsplit(url).hostname
+    config = HOSTS_HTTP.get(host, HOST_HTTP_DEFECTO)
+    timeout = timeout or config['timeout']
+    adaptador = _adaptador_http(host)
+    preparado = requests.Request('POST', url, **kwargs).prepare()
+    deadline = time.monotonic() + IO_PLAZO_SEGUNDOS
+    
+    inicio = time.perf_counter()
+    intento = 0
+    while True:
+        respuesta, error = None, None
+        try:
+            respuesta = adaptador.send(preparado, timeout=timeout)
+            # Leer el body devuelve la conexión al pool para el próximo request
+            respuesta.content
+        except requests.exceptions.ConnectionError as e:
+            # Incluye ConnectTimeout y conexiones keep-alive que el servidor ya había cerrado
+            error = e
+        except requests.exceptions.RequestException:
+            _registrar_llamada_http(host, time.perf_counter() - inicio, 'error', intento)
+            raise
+        
+        reintentable = error is not None or respuesta.status_code in config['status_reintentables']
+        if reintentable and intento < config['reintentos']:
+            espera = _espera_reintento(intento, respuesta)
+            conexion = timeout[0] if isinstance(timeout, tuple) else timeout
+            if time.monotonic() + espera + conexion < deadline:
+                motivo = f'status {respuesta.status_code}' if respuesta is not None else str(error)
+                logger.warning(f"POST a {host} falló ({motivo}), reintento {intento + 1} en {espera:.2f} s")
+                time.sleep(espera)
+                intento += 1
+                continue
+        
+        resultado = 'error' if respuesta is None else str(respuesta.status_code)
+        _registrar_llamada_http(host, time.perf_counter() - inicio, resultado, intento)
+        if error is not None:
+            raise error
+        return respuesta
+
+def estadisticas_http():
+    """Llamadas, reintentos, latencia y reutilización de conexiones por host en este proceso"""
+    with _http_lock:
+        adaptadores = dict(_adaptadores_http) if _adaptadores_http_pid == os.getpid() else {}
+        estadisticas = {host: dict(e) for host, e in _estadisticas_http.items()}
+    
+    hosts = {}
+    for host, adaptador in adaptadores.items():
+        pools = adaptador.poolmanager.pools
+        conexiones, enviados = 0, 0
+        for clave in pools.keys():
+            try:
+                pool = pools[clave]
+            except KeyError:
+                continue
+            conexiones += pool.num_connections
+            enviados += pool.num_requests
+        estadistica = estadisticas.get(host, {'llamadas': 0, 'errores': 0, 'reintentos': 0,
+                                              'segundos_total': 0.0, 'segundos_max': 0.0})
+        llamadas = estadistica['llamadas']
+        hosts[host] = {
+            'llamadas': llamadas,
+            'errores': estadistica['errores'],
+            'reintentos': estadistica['reintentos'],
+            'latencia_promedio_ms': round(estadistica['segundos_total'] / llamadas * 1000, 1) if llamadas else None,
+            'latencia_max_ms': round(estadistica['segundos_max'] * 1000, 1),
+            'conexiones_abiertas': conexiones,
+            'requests_enviados': enviados,
+            'conexiones_reutilizadas': max(0, enviados - conexiones)
+        }
+    return hosts
+
+@app.route('/admin/http', methods=['GET'])
+def admin_http():
+    """Estadísticas del cliente HTTP saliente de este worker (latencia, reintentos, conexiones reutilizadas)"""
+    try:
+        return jsonify({'success': True, 'pid': os.getpid(), 'hosts': estadisticas_http()}), 200
+    except Exception as e:
+        logger.error(f"Error consultando estadísticas HTTP: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN CLIENTE HTTP SALIENTE ====================
+
 # Mapeo de bancos a sus extractores
 logger.info("Cargando configuración de extractores...")
 BANCO_EXTRACTORS = {
@@ -192,7 +925,9 @@ BANCO_EXTRACTORS = {
     },
     'banco_bbva': {
         'script': 'extractor_bbva_mejorado.py',
-        'function': 'extraer_datos_bbva'
+        'function': 'extraer_datos_bbva',
+        # Escribe el Excel aunque no se pida: sin Excel se le pasa una ruta descartable
+        'excel_requerido': True
     },
     'banco_icbc': {
         'script': 'extractor_banco_icbc.py',
@@ -204,17 +939,215 @@ BANCO_EXTRACTORS = {
     },
     'banco_nacion': {
         'script': 'nacion.py',
-        'function': 'extraer_datos_banco_nacion'
+        'function': 'extraer_datos_banco_nacion',
+        # Escribe el Excel aunque no se pida: sin Excel se le pasa una ruta descartable
+        'excel_requerido': True
     },
     'colppy': {
         'script': 'Colppy.py',
-        'function': 'extraer_datos_colppy'
+        'function': 'extraer_datos_colppy',
+        # Escribe el Excel aunque no se pida: sin Excel se le pasa una ruta descartable
+        'excel_requerido': True
     },
 }
 
 logger.info(f"Extractores configurados: {len(BANCO_EXTRACTORS)}")
 logger.info("Aplicación Flask inicializada correctamente")
 
+# ==================== ALMACÉN DE JOBS COMPARTIDO ====================
+# Los jobs se guardan en un archivo SQLite para que todos los workers de gunicorn
+# (y otros nodos que compartan el volumen) vean el mismo estado. Otras secciones
+# agregan sus tablas a ESQUEMAS_ESTADO para compartir el mismo archivo.
+# La base vive fuera de TEMP_DIR: /download sirve archivos de TEMP_DIR y no debe poder entregarla.
+ESTADO_DIR = Path(os.environ.get('ESTADO_DIR', str(TEMP_DIR.with_name(f'{TEMP_DIR.name}_estado'))))
+JOBS_DB_PATH = Path(os.environ.get('JOBS_DB_PATH', str(ESTADO_DIR / 'jobs.db')))
+# Tiempo que se conservan los jobs terminados antes de borrarlos
+JOBS_TTL_SEGUNDOS = int(os.environ.get('JOBS_TTL_SEGUNDOS', str(6 * 3600)))
+# Un job activo sin actualizaciones durante este tiempo se considera abandonado (worker caído)
+JOBS_ABANDONO_SEGUNDOS = int(os.environ.get('JOBS_ABANDONO_SEGUNDOS', str(2 * 3600)))
+
+JOB_ESTADOS_ACTIVOS = ('pending', 'processing')
+JOB_ESTADOS_FINALES = ('completed', 'error')
+_JOB_COLUMNAS = ('id', 'tipo', 'status', 'progress', 'message', 'error', 'created_at', 'updated_at')
+
+_estado_db_local = threading.local()
+# Se avisa cada vez que este proceso actualiza un job (lo esperan los streams de eventos)
+_avisos_jobs = threading.Condition()
+
+ESQUEMAS_ESTADO = ['''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        tipo TEXT NOT NULL,
+        status TEXT NOT NULL,
+        progress INTEGER NOT NULL DEFAULT 0,
+        message TEXT,
+        error TEXT,
+        datos TEXT NOT NULL DEFAULT '{}',
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        updated_ts REAL NOT NULL,
+        expires_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_tipo_status ON jobs (tipo, status);
+    CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs (expires_at);
+    CREATE TABLE IF NOT EXISTS contadores (
+        nombre TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL DEFAULT 0
+    );
+''']
+
+logger.info(f"Base de datos de jobs: {JOBS_DB_PATH}")
+
+def _conexion_estado():
+    """Devuelve la conexión SQLite del thread actual a la base de estado compartido (se reabre después de un fork)"""
+    conn = getattr(_estado_db_local, 'conn', None)
+    if conn is not None and getattr(_estado_db_local, 'pid', None) == os.getpid():
+        return conn
+    
+    JOBS_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(JOBS_DB_PATH), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.executescript('\n'.join(ESQUEMAS_ESTADO))
+    _estado_db_local.conn = conn
+    _estado_db_local.pid = os.getpid()
+    return conn
+
+class _TransaccionEstado:
+    """Context manager para una transacción de escritura (BEGIN IMMEDIATE) sobre la base de estado"""
+    def __enter__(self):
+        self.conn = _conexion_estado()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+def _fila_a_job(fila):
+    """Convierte una fila de la tabla jobs al diccionario que devuelven los endpoints"""
+    if fila is None:
+        return None
+    job = json.loads(fila['datos'] or '{}')
+    for columna in _JOB_COLUMNAS:
+        job[columna] = fila[columna]
+    return job
+
+def purgar_jobs_expirados():
+    """Borra los jobs terminados cuyo TTL ya venció. Devuelve la cantidad borrada"""
+    with _TransaccionEstado() as conn:
+        cursor = conn.execute('DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),))
+        return cursor.rowcount
+
+def _marcar_jobs_abandonados(conn, tipo):
+    """Marca como error los jobs activos que dejaron de actualizarse (el worker que los corría murió)"""
+    limite = time.time() - JOBS_ABANDONO_SEGUNDOS
+    ahora = time.time()
+    conn.execute(
+        '''UPDATE jobs SET status = 'error', error = ?, message = ?, updated_at = ?, updated_ts = ?, expires_at = ?
+           WHERE tipo = ? AND status IN ('pending', 'processing') AND updated_ts < ?''',
+        ('Job abandonado', 'El job dejó de responder y fue marcado como error',
+         datetime.now().isoformat(), ahora, ahora + JOBS_TTL_SEGUNDOS, tipo, limite)
+    )
+
+def crear_job(tipo, exclusivo=False, message='Job creado, esperando inicio...', **datos):
+    """Crea un job nuevo en estado pending y lo devuelve.
+    Si exclusivo=True y ya hay un job activo del mismo tipo, no crea nada y devuelve (None, job_activo)."""
+    try:
+        purgar_jobs_expirados()
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudieron purgar jobs expirados: {e}")
+    
+    job_id = str(uuid.uuid4())
+    ahora = datetime.now().isoformat()
+    with _TransaccionEstado() as conn:
+        if exclusivo:
+            _marcar_jobs_abandonados(conn, tipo)
+            fila = conn.execute(
+                "SELECT * FROM jobs WHERE tipo = ? AND status IN ('pending', 'processing') ORDER BY created_at LIMIT 1",
+                (tipo,)
+            ).fetchone()
+            if fila is not None:
+                return None, _fila_a_job(fila)
+        
+        conn.execute(
+            '''INSERT INTO jobs (id, tipo, status, progress, message, error, datos, created_at, updated_at, updated_ts)
+               VALUES (?, ?, 'pending', 0, ?, NULL, ?, ?, ?, ?)''',
+            (job_id, tipo, message, json.dumps(datos, default=str), ahora, ahora, time.time())
+        )
+    return obtener_job(job_id), None
+
+def obtener_job(job_id, tipo=None):
+    """Obtiene un job por id (opcionalmente verificando el tipo). None si no existe o expiró"""
+    fila = _conexion_estado().execute(
+        'SELECT * FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at >= ?)',
+        (job_id, time.time())
+    ).fetchone()
+    job = _fila_a_job(fila)
+    if job and tipo and job['tipo'] != tipo:
+        return None
+    return job
+
+def actualizar_job(job_id, status, progress=0, message='', error=None, **datos):
+    """Actualiza el estado de un job y mezcla los campos extra en sus datos"""
+    ahora = time.time()
+    expires_at = ahora + JOBS_TTL_SEGUNDOS if status in JOB_ESTADOS_FINALES else None
+    with _TransaccionEstado() as conn:
+        fila = conn.execute('SELECT datos FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if fila is None:
+            return False
+        datos_actuales = json.loads(fila['datos'] or '{}')
+        datos_actuales.update(datos)
+        conn.execute(
+            '''UPDATE jobs SET status = ?, progress = ?, message = ?, error = ?, datos = ?,
+                              updated_at = ?, updated_ts = ?, expires_at = ?
+               WHERE id = ?''',
+            (status, progress, message, error, json.dumps(datos_actuales, default=str),
+             datetime.now().isoformat(), ahora, expires_at, job_id)
+        )
+    with _avisos_jobs:
+        _avisos_jobs.notify_all()
+    return True
+
+def incrementar_contador(nombre, cantidad=1):
+    """Suma al contador compartido (entre workers) indicado"""
+    _conexion_estado().execute(
+        'INSERT INTO contadores (nombre, valor) VALUES (?, ?) '
+        'ON CONFLICT(nombre) DO UPDATE SET valor = valor + excluded.valor',
+        (nombre, cantidad)
+    )
+
+def leer_contadores(prefijo):
+    """Devuelve los contadores compartidos cuyo nombre empieza con el prefijo"""
+    filas = _conexion_estado().execute(
+        'SELECT nombre, valor FROM contadores WHERE nombre LIKE ?', (prefijo + '%',)
+    ).fetchall()
+    return {fila['nombre'][len(prefijo):]: fila['valor'] for fila in filas}
+
+def listar_jobs(tipo=None, status=None):
+    """Lista los jobs vigentes filtrando por tipo y/o estado (usa el índice tipo+status)"""
+    condiciones = ['(expires_at IS NULL OR expires_at >= ?)']
+    parametros = [time.time()]
+    if tipo:
+        condiciones.append('tipo = ?')
+        parametros.append(tipo)
+    if status:
+        estados = [status] if isinstance(status, str) else list(status)
+        condiciones.append(f"status IN ({', '.join('?' for _ in estados)})")
+        parametros.extend(estados)
+    filas = _conexion_estado().execute(
+        f"SELECT * FROM jobs WHERE {' AND '.join(condiciones)} ORDER BY created_at",
+        parametros
+    ).fetchall()
+    return [_fila_a_job(fila) for fila in filas]
+
+# ==================== FIN ALMACÉN DE JOBS COMPARTIDO ====================
+
 # ==================== SISTEMA DE VENCIMIENTOS ====================
 # Usar ruta absoluta para evitar problemas con el directorio de trabajo
 VENCIMIENTOS_DIR = Path(__file__).parent.resolve() / 'vencimientos'
@@ -222,26 +1155,16 @@ VENCIMIENTOS_DIR.mkdir(parents=True, exist_ok=True)
 logger.info(f"Directorio de vencimientos: {VENCIMIENTOS_DIR}")
 logger.info(f"Directorio de vencimientos existe: {VENCIMIENTOS_DIR.exists()}")
 
-# Sistema de jobs asíncronos para vencimientos
-vencimientos_jobs = {}
-vencimientos_jobs_lock = threading.Lock()
+# Sistema de jobs asíncronos para vencimientos (guardados en el almacén compartido)
+JOB_TIPO_VENCIMIENTOS = 'vencimientos'
 
 def get_vencimientos_job(job_id):
     """Obtiene el estado de un job de vencimientos"""
-    with vencimientos_jobs_lock:
-        return vencimientos_jobs.get(job_id)
+    return obtener_job(job_id, tipo=JOB_TIPO_VENCIMIENTOS)
 
 def update_vencimientos_job(job_id, status, progress=0, message='', error=None):
     """Actualiza el estado de un job de vencimientos"""
-    with vencimientos_jobs_lock:
-        if job_id in vencimientos_jobs:
-            vencimientos_jobs[job_id].update({
-                'status': status,
-                'progress': progress,
-                'message': message,
-                'error': error,
-                'updated_at': datetime.now().isoformat()
-            })
+    actualizar_job(job_id, status, progress, message, error)
 
 def ejecutar_scraper_vencimientos(job_id):
     """Ejecuta el scraper de vencimientos en segundo plano"""
@@ -570,46 +1493,30 @@ def vencimientos_refrescar():
                 'message': f'Scraper no encontrado: {scraper_path}'
             }), 404
         
-        # Verificar si ya hay un job en proceso
-        with vencimientos_jobs_lock:
-            jobs_activos = [j for j in vencimientos_jobs.values() if j.get('status') in ['pending', 'processing']]
-            if jobs_activos:
-                job_activo = jobs_activos[0]
-                logger.info(f"Ya hay un job activo: {job_activo['id']}")
-                return jsonify({
-                    'success': False,
-                    'message': 'Ya hay una actualización en proceso. Espera a que finalice antes de iniciar otra.',
-                    'job_id': job_activo['id']
-                }), 409  # Conflict
-        
-        # Crear un nuevo job
-        job_id = str(uuid.uuid4())
+        # Crear un nuevo job, salvo que ya haya uno en proceso (el chequeo es atómico entre workers)
+        job, job_activo = crear_job(JOB_TIPO_VENCIMIENTOS, exclusivo=True, compartido=True)
+        if job_activo:
+            logger.info(f"Ya hay un job activo: {job_activo['id']}")
+            return jsonify({
+                'success': False,
+                'message': 'Ya hay una actualización en proceso. Espera a que finalice antes de iniciar otra.',
+                'job_id': job_activo['id']
+            }), 409  # Conflict
         
-        with vencimientos_jobs_lock:
-            vencimientos_jobs[job_id] = {
-                'id': job_id,
-                'status': 'pending',
-                'progress': 0,
-                'message': 'Job creado, esperando inicio...',
-                'error': None,
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat(),
-                'compartido': True  # Indica que los datos serán compartidos
-            }
+        job_id = job['id']
         
         logger.info(f"Iniciando scraper de vencimientos con job_id: {job_id}")
         logger.info(f"Los datos se guardarán en: {VENCIMIENTOS_DIR.resolve()} (compartido para todos los usuarios)")
         
         # Iniciar el scraper en un thread separado
-        thread = threading.Thread(target=ejecutar_scraper_vencimientos, args=(job_id,))
-        thread.daemon = True
-        thread.start()
+        iniciar_thread(ejecutar_scraper_vencimientos, job_id)
         
         return jsonify({
             'success': True,
             'job_id': job_id,
             'message': 'Scraper iniciado en segundo plano. Los datos generados serán compartidos para todos los usuarios.',
-            'compartido': True
+            'compartido': True,
+            'eventsUrl': f"{request.host_url.rstrip('/')}/jobs/{job_id}/events"
         }), 200
         
     except Exception as e:
@@ -624,16 +1531,16 @@ def vencimientos_status(job_id):
     """Consulta el estado de un job de refresco de vencimientos"""
     try:
         logger.info(f"Consultando estado de job: {job_id}")
-        logger.info(f"Jobs disponibles: {list(vencimientos_jobs.keys())}")
         
         job = get_vencimientos_job(job_id)
         
         if not job:
-            logger.warning(f"Job {job_id} no encontrado. Jobs disponibles: {list(vencimientos_jobs.keys())}")
+            jobs_disponibles = [j['id'] for j in listar_jobs(tipo=JOB_TIPO_VENCIMIENTOS)]
+            logger.warning(f"Job {job_id} no encontrado. Jobs disponibles: {jobs_disponibles}")
             return jsonify({
                 'success': False,
                 'message': f'Job no encontrado: {job_id}',
-                'available_jobs': list(vencimientos_jobs.keys())
+                'available_jobs': jobs_disponibles
             }), 404
         
         logger.info(f"Job encontrado: {job_id}, estado: {job.get('status')}")
@@ -676,9 +1583,14 @@ def vencimientos_filtrar_por_cuils():
                 'message': 'El archivo debe ser Excel (.xlsx o .xls)'
             }), 400
         
+        try:
+            validar_subida(archivo_cuils, ext)
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        
         # Guardar archivo temporalmente
         temp_file = TEMP_DIR / f'cuils_{int(datetime.now().timestamp())}{ext}'
-        archivo_cuils.save(str(temp_file))
+        guardar_subida(archivo_cuils, temp_file)
         
         try:
             # Leer archivo de CUILs
@@ -965,7 +1877,7 @@ def vencimientos_filtrar_por_cuils():
             df_resultado = pd.DataFrame(filas_resultado)
             
             # Guardar resultado en Excel con formato
-            resultado_filename = f'vencimientos_filtrados_{int(datetime.now().timestamp())}.xlsx'
+            resultado_filename = f'vencimientos_filtrados_{uuid.uuid4().hex}.xlsx'
             resultado_path = TEMP_DIR / resultado_filename
             
             with pd.ExcelWriter(resultado_path, engine='openpyxl') as writer:
@@ -1024,6 +1936,7 @@ def vencimientos_filtrar_por_cuils():
                 logger.warning(f"No se pudo aplicar formato al Excel: {e}")
             
             base_url = request.host_url.rstrip('/')
+            resultado_filename, download_url = publicar_resultado(resultado_path, base_url, medidor=medidor_request())
             
             return jsonify({
                 'success': True,
@@ -1032,7 +1945,7 @@ def vencimientos_filtrar_por_cuils():
                 'total_cuits': len(cuils),
                 'cuits_con_vencimientos': sum(1 for r in resultados if r['estado'] == 'Con vencimientos'),
                 'cuits_sin_vencimientos': sum(1 for r in resultados if r['estado'] == 'Sin vencimientos'),
-                'downloadUrl': f'{base_url}/download/{resultado_filename}'
+                'downloadUrl': download_url
             }), 200
             
         finally:
@@ -1051,6 +1964,7 @@ def vencimientos_filtrar_por_cuils():
         }), 500
 
 @app.route('/vencimientos/enviar-email', methods=['POST'])
+@ruta_io
 def vencimientos_enviar_email():
     """Envía un email con los vencimientos de un cliente"""
     try:
@@ -1469,14 +2383,13 @@ def vencimientos_enviar_email():
         }
         
         try:
-            response = requests.post(
+            response = post_http(
                 edge_function_url,
                 headers={
                     'Content-Type': 'application/json',
                     'Authorization': f'Bearer {supabase_anon_key}'
                 },
-                json=payload,
-                timeout=30
+                json=payload
             )
             
             if response.ok:
@@ -1531,161 +2444,2776 @@ def load_extractor_module(script_name):
         logger.error(f"Error cargando módulo {script_name}: {str(e)}", exc_info=True)
         raise
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Endpoint de salud"""
-    try:
-        logger.info("Health check recibido")
-        port = os.environ.get('PORT', os.environ.get('EXTRACTOR_PORT', 'NO DEFINIDA'))
-        response = jsonify({
-            'status': 'ok',
-            'message': 'Servidor funcionando correctamente',
-            'extractors_count': len(BANCO_EXTRACTORS),
-            'port': port,
-            'host': request.host,
-            'remote_addr': request.remote_addr
-        })
-        logger.info("Health check respondido exitosamente")
-        return response, 200
-    except Exception as e:
-        logger.error(f"Error en health check: {str(e)}", exc_info=True)
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+# ==================== REGISTRO DE EXTRACTORES ====================
+# Cada módulo extractor se carga una sola vez por proceso y se reutiliza entre requests.
+# Solo se vuelve a ejecutar el módulo cuando cambia el mtime de su archivo.
+extractores_cargados = {}
+extractores_lock = threading.Lock()
+extractores_locks_script = {}
 
-@app.route('/extractors', methods=['GET'])
-def list_extractors():
-    """Lista todos los extractores disponibles"""
-    return jsonify({
-        'extractors': list(BANCO_EXTRACTORS.keys()),
-        'count': len(BANCO_EXTRACTORS)
-    })
+def _lock_para_script(script_name):
+    """Devuelve el lock de carga de un script (uno por módulo para no bloquear a los demás)"""
+    with extractores_lock:
+        lock = extractores_locks_script.get(script_name)
+        if lock is None:
+            lock = threading.Lock()
+            extractores_locks_script[script_name] = lock
+        return lock
 
-@app.route('/extract', methods=['POST'])
-def extract():
-    """Endpoint principal para extraer datos"""
-    try:
-        # Validar que se recibió el archivo y el banco
-        if 'pdf' not in request.files:
-            return jsonify({'success': False, 'message': 'No se recibió ningún archivo PDF'}), 400
-        
-        if 'banco' not in request.form:
-            return jsonify({'success': False, 'message': 'No se especificó el banco'}), 400
-        
-        pdf_file = request.files['pdf']
-        banco_id = request.form['banco']
+def obtener_modulo_extractor(script_name):
+    """Devuelve el módulo extractor cargado, recargándolo solo si el archivo cambió"""
+    script_path = EXTRACTORES_DIR / script_name
+    if not script_path.exists():
+        raise FileNotFoundError(f"El archivo extractor no existe: {script_path}")
+    
+    mtime = script_path.stat().st_mtime
+    entrada = extractores_cargados.get(script_name)
+    if entrada and entrada['mtime'] == mtime:
+        return entrada['module']
+    
+    with _lock_para_script(script_name):
+        # Otro thread pudo haberlo cargado mientras esperábamos el lock
+        entrada = extractores_cargados.get(script_name)
+        if entrada and entrada['mtime'] == mtime:
+            return entrada['module']
         
-        # Validar que el banco existe
-        if banco_id not in BANCO_EXTRACTORS:
-            return jsonify({'success': False, 'message': f'Banco no soportado: {banco_id}'}), 400
+        inicio = time.perf_counter()
+        module = load_extractor_module(script_name)
+        duracion = time.perf_counter() - inicio
+        ahora = datetime.now().isoformat()
         
-        # Guardar el PDF temporalmente
-        pdf_filename = f"{banco_id}_{pdf_file.filename}"
-        # Limpiar nombre de archivo (remover caracteres problemáticos)
-        pdf_filename = pdf_filename.replace(' ', '_').replace('/', '_').replace('\\', '_')
-        pdf_path = TEMP_DIR / pdf_filename
+        with extractores_lock:
+            anterior = extractores_cargados.get(script_name)
+            extractores_cargados[script_name] = {
+                'module': module,
+                'mtime': mtime,
+                'funciones': {},
+                'tiempo_carga_ms': round(duracion * 1000, 1),
+                'cargado_en': anterior['cargado_en'] if anterior else ahora,
+                'ultima_recarga': ahora if anterior else None,
+                'recargas': anterior['recargas'] + 1 if anterior else 0
+            }
         
-        # Asegurar que el directorio existe
-        TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        if entrada:
+            logger.info(f"Módulo {script_name} recargado (cambió el archivo) en {duracion * 1000:.0f} ms")
+        else:
+            logger.info(f"Módulo {script_name} registrado en {duracion * 1000:.0f} ms")
+        return module
+
+def obtener_extractor(banco_id):
+    """Devuelve la función extractora de un banco desde el registro de módulos cargados"""
+    extractor_info = BANCO_EXTRACTORS[banco_id]
+    script_name = extractor_info['script']
+    function_name = extractor_info['function']
+    
+    module = obtener_modulo_extractor(script_name)
+    entrada = extractores_cargados[script_name]
+    funcion = entrada['funciones'].get(function_name)
+    if funcion is None or entrada['module'] is not module:
+        funcion = getattr(module, function_name)
+        entrada['funciones'][function_name] = funcion
+    return funcion
+
+def estado_registro_extractores():
+    """Resumen del registro de extractores para el endpoint de administración"""
+    with extractores_lock:
+        cargados = dict(extractores_cargados)
+    
+    modulos = []
+    for banco_id, extractor_info in BANCO_EXTRACTORS.items():
+        script_name = extractor_info['script']
+        entrada = cargados.get(script_name)
+        modulos.append({
+            'banco': banco_id,
+            'script': script_name,
+            'cargado': entrada is not None,
+            'tiempo_carga_ms': entrada['tiempo_carga_ms'] if entrada else None,
+            'cargado_en': entrada['cargado_en'] if entrada else None,
+            'ultima_recarga': entrada['ultima_recarga'] if entrada else None,
+            'recargas': entrada['recargas'] if entrada else 0,
+            'mtime': datetime.fromtimestamp(entrada['mtime']).isoformat() if entrada else None
+        })
+    return modulos
+
+@app.route('/admin/extractores', methods=['GET'])
+def admin_extractores():
+    """Muestra qué módulos extractores están cargados y cuánto tardaron en cargar, en este worker y
+    (con el pool habilitado) en cada proceso del pool, que es donde corren y se recargan"""
+    try:
+        modulos = estado_registro_extractores()
+        respuesta = {
+            'success': True,
+            'pid': os.getpid(),
+            'cargados': sum(1 for m in modulos if m['cargado']),
+            'total': len(modulos),
+            'modulos': modulos,
+            'pool': {'habilitado': False}
+        }
+        if EXTRACTOR_POOL_HABILITADO:
+            pool = obtener_pool_extraccion()
+            procesos = pool.estado_registros()
+            respuesta['pool'] = {
+                'habilitado': True,
+                'procesos': procesos,
+                'ocupados': pool.estado()['en_uso']
+            }
+        return jsonify(respuesta), 200
+    except Exception as e:
+        logger.error(f"Error consultando registro de extractores: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN REGISTRO DE EXTRACTORES ====================
+
+# ==================== POOL DE PROCESOS DE EXTRACCIÓN ====================
+# Los extractores (Camelot, OpenCV, Ghostscript) corren en procesos separados, con
+# las librerías pesadas ya importadas. Cada job tiene un tiempo máximo y un techo de
+# memoria; si un PDF cuelga o rompe el proceso, se mata y se reemplaza sin afectar a Flask.
+# El techo es sobre la memoria residente (RSS): el worker la lee de /proc mientras espera el
+# resultado. Un RLIMIT_AS limitaba el espacio de direcciones, que numpy/OpenBLAS reservan de
+# sobra, y fallaba con PDFs chicos mientras no frenaba a uno que de verdad ocupaba la RAM.
+# Los procesos se crean desde un forkserver: el worker de gunicorn tiene varios threads y
+# hacer fork desde ahí puede dejar al hijo con locks tomados por threads que ya no existen.
+# El forkserver importa este módulo y las librerías pesadas una vez; los reemplazos salen de
+# ahí ya cargados y sin el estado de los threads de Flask.
+EXTRACTOR_POOL_HABILITADO = os.environ.get('EXTRACTOR_POOL', 'true').lower() in ('1', 'true', 'yes', 'si')
+# Por defecto los núcleos se reparten entre los workers de gunicorn (WEB_CONCURRENCY)
+EXTRACTOR_POOL_SIZE = int(os.environ.get(
+    'EXTRACTOR_POOL_SIZE',
+    str(max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))))
+))
+EXTRACTOR_TIMEOUT_SEGUNDOS = int(os.environ.get('EXTRACTOR_TIMEOUT_SEGUNDOS', '240'))
+EXTRACTOR_MEMORIA_MAX_MB = int(os.environ.get('EXTRACTOR_MEMORIA_MAX_MB', '2048'))
+EXTRACTOR_JOBS_POR_PROCESO = int(os.environ.get('EXTRACTOR_JOBS_POR_PROCESO', '25'))
+# Cuánto puede esperar un job a que se libere un proceso antes de responder 503
+EXTRACTOR_ESPERA_MAX_SEGUNDOS = int(os.environ.get('EXTRACTOR_ESPERA_MAX_SEGUNDOS', '120'))
+
+# Librerías que se importan al arrancar cada proceso del pool
+LIBRERIAS_PESADAS = ['pandas', 'camelot', 'cv2', 'pdfplumber', 'fitz', 'openpyxl']
+
+class ErrorExtraccion(Exception):
+    """Error de extracción con el mensaje listo para devolver al cliente"""
+    def __init__(self, mensaje, tipo='error', status_code=500):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.tipo = tipo
+        self.status_code = status_code
+
+def ejecutar_extraccion_local(banco_id, pdf_path, excel_path, progress_callback=None, medidor=None):
+    """Carga el extractor del registro y lo ejecuta en el proceso actual"""
+    extractor_info = BANCO_EXTRACTORS[banco_id]
+    medidor = medidor or MedidorTiempos()
+    try:
+        with medidor.etapa('carga_extractor'):
+            extractor_function = obtener_extractor(banco_id)
+    except AttributeError as attr_error:
+        logger.error(f"Función {extractor_info['function']} no encontrada en {extractor_info['script']}: {str(attr_error)}")
+        raise ErrorExtraccion(f'Función {extractor_info["function"]} no encontrada en el extractor', 'funcion')
+    except Exception as load_error:
+        logger.error(f"Error cargando módulo {extractor_info['script']}: {str(load_error)}", exc_info=True)
+        raise ErrorExtraccion(f'Error al cargar el extractor: {str(load_error)}', 'carga')
+    
+    try:
+        return ejecutar_extractor(banco_id, extractor_function, Path(pdf_path),
+                                  Path(excel_path) if excel_path else None, progress_callback, medidor)
+    except RuntimeError as e:
+        raise ErrorExtraccion(str(e), 'excel')
+
+def precargar_librerias_pesadas():
+    """Importa las librerías pesadas que usan los extractores (las que falten se ignoran)"""
+    for nombre in LIBRERIAS_PESADAS:
+        try:
+            importar_midiendo(nombre)
+        except Exception as e:
+            logger.warning(f"No se pudo precargar {nombre}: {e}")
+
+def _bucle_proceso_extraccion(conn):
+    """Loop principal de un proceso del pool: recibe tareas por el pipe y devuelve resultados"""
+    _id_correlacion.set(None)
+    _log_muestreado.set(True)
+    # Con forkserver ya vienen importadas; con spawn (Windows) se cargan acá
+    precargar_librerias_pesadas()
+    
+    while True:
+        try:
+            tarea = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if tarea is None:
+            break
+        if tarea == 'estado':
+            # Lo pide /admin/extractores: los extractores se cargan y recargan acá, no en el worker
+            conn.send(('estado', estado_registro_extractores()))
+            continue
         
-        # Guardar archivo
-        pdf_file.save(str(pdf_path))
-        logger.info(f"PDF guardado temporalmente en: {pdf_path}")
+        banco_id, pdf_path, excel_path, reportar_progreso, id_correlacion, muestreado = tarea
+        # Los logs del proceso del pool quedan asociados al request que pidió la extracción y siguen
+        # su muestreo (los print de los extractores se registran en INFO)
+        _id_correlacion.set(id_correlacion)
+        _log_muestreado.set(muestreado)
+        progress_callback = None
+        if reportar_progreso:
+            progress_callback = lambda pagina, total: conn.send(('progreso', pagina, total))
         
-        # Generar nombre del archivo Excel de salida
-        excel_filename = pdf_filename.replace('.pdf', '_extraido.xlsx')
-        excel_path = TEMP_DIR / excel_filename
+        try:
+            medidor = MedidorTiempos()
+            df = ejecutar_extraccion_local(banco_id, pdf_path, excel_path, progress_callback, medidor)
+            conn.send(('resultado', df, medidor.etapas))
+        except ErrorExtraccion as e:
+            conn.send(('error', e.mensaje, e.tipo))
+        except MemoryError:
+            conn.send(('error', 'La extracción superó el límite de memoria permitido', 'memoria'))
+            break
+        except Exception as e:
+            conn.send(('error', f'Error al procesar el PDF: {str(e)}', 'error'))
+
+def _memoria_residente_mb(pid):
+    """RSS actual de un proceso en MB (None si no se puede leer, ej: fuera de Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class _ProcesoExtraccion:
+    """Un proceso del pool junto con su extremo del pipe"""
+    def __init__(self, contexto):
+        self.conn, conn_hijo = contexto.Pipe()
+        self.process = contexto.Process(
+            target=_bucle_proceso_extraccion,
+            args=(conn_hijo,),
+            daemon=True
+        )
+        self.process.start()
+        conn_hijo.close()
+        self.jobs = 0
+        self.iniciado = time.time()
+    
+    def matar(self):
+        """Termina el proceso de inmediato (timeout o estado corrupto)"""
+        try:
+            self.process.kill()
+            self.process.join(5)
+        except Exception as e:
+            logger.warning(f"Error terminando proceso de extracción {self.process.pid}: {e}")
+        self.conn.close()
+    
+    def cerrar(self):
+        """Pide al proceso que termine cuando esté libre"""
+        try:
+            self.conn.send(None)
+            self.process.join(5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.matar()
+        else:
+            self.conn.close()
+
+class PoolExtraccion:
+    """Pool de procesos pre-arrancados para ejecutar extractores con timeout y reciclado"""
+    def __init__(self, tamano, timeout, memoria_max_mb, jobs_por_proceso, espera_max):
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.contexto = multiprocessing.get_context('forkserver')
+            # Los módulos que no se puedan importar los ignora el propio forkserver
+            self.contexto.set_forkserver_preload([__name__] + LIBRERIAS_PESADAS)
+        else:
+            self.contexto = multiprocessing.get_context('spawn')
+        self.tamano = max(1, tamano)
+        self.timeout = timeout
+        self.memoria_max_mb = memoria_max_mb
+        self.jobs_por_proceso = max(1, jobs_por_proceso)
+        self.espera_max = espera_max
+        self.libres = queue.Queue()
+        self.lock = threading.Lock()
+        self.en_uso = 0
+        self.esperando = 0
+        self.estadisticas = {
+            'completados': 0,
+            'errores': 0,
+            'timeouts': 0,
+            'caidas': 0,
+            'memoria_excedida': 0,
+            'reciclados': 0,
+            'sin_proceso_libre': 0,
+            'reemplazos_fallidos': 0
+        }
+        for _ in range(self.tamano):
+            self.libres.put(self._nuevo_proceso())
+        logger.info(f"Pool de extracción iniciado: {self.tamano} procesos, timeout {timeout}s, "
+                    f"memoria máx. {memoria_max_mb} MB, reciclado cada {self.jobs_por_proceso} jobs")
+    
+    def _nuevo_proceso(self):
+        return _ProcesoExtraccion(self.contexto)
+    
+    def _contar(self, clave):
+        with self.lock:
+            self.estadisticas[clave] += 1
+    
+    def ejecutar(self, banco_id, pdf_path, excel_path, progress_callback=None, timeout=None, medidor=None):
+        """Ejecuta un extractor en un proceso libre y devuelve el DataFrame resultante"""
+        timeout = timeout or self.timeout
+        with self.lock:
+            self.esperando += 1
+        inicio_espera = time.perf_counter()
+        try:
+            proceso = self.libres.get(timeout=self.espera_max)
+        except queue.Empty:
+            proceso = None
+        if medidor is not None:
+            medidor.agregar('espera_pool', time.perf_counter() - inicio_espera)
+        with self.lock:
+            self.esperando -= 1
+            if proceso is not None:
+                self.en_uso += 1
+        if proceso is None:
+            self._contar('sin_proceso_libre')
+            logger.warning(f"Extracción de {banco_id} rechazada: sin procesos libres tras {self.espera_max}s")
+            raise ErrorExtraccion(
+                'Todos los procesos de extracción están ocupados, intentá de nuevo en unos minutos',
+                'ocupado', 503
+            )
         
+        # El tiempo máximo empieza a contar cuando el job consigue un proceso
+        deadline = time.monotonic() + timeout
+        reemplazar = False
         try:
-            # Cargar el módulo extractor
-            extractor_info = BANCO_EXTRACTORS[banco_id]
-            logger.info(f"Cargando extractor: {extractor_info['script']}")
+            if not proceso.process.is_alive():
+                # Murió mientras estaba libre, o quedó así porque falló su reemplazo
+                proceso.conn.close()
+                try:
+                    proceso = self._nuevo_proceso()
+                except Exception as e:
+                    self._contar('reemplazos_fallidos')
+                    logger.error(f"No se pudo iniciar un proceso de extracción: {e}", exc_info=True)
+                    raise ErrorExtraccion('No se pudo iniciar un proceso de extracción', 'pool', 503)
             
-            try:
-                module = load_extractor_module(extractor_info['script'])
-            except Exception as load_error:
-                logger.error(f"Error cargando módulo {extractor_info['script']}: {str(load_error)}", exc_info=True)
-                return jsonify({
-                    'success': False,
-                    'message': f'Error al cargar el extractor: {str(load_error)}'
-                }), 500
+            proceso.conn.send((banco_id, str(pdf_path), str(excel_path) if excel_path else None,
+                               progress_callback is not None,
+                               _id_correlacion.get(), _log_muestreado.get()))
             
+            while True:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    reemplazar = True
+                    self._contar('timeouts')
+                    logger.error(f"Extracción de {banco_id} superó {timeout}s, terminando proceso {proceso.process.pid}")
+                    raise ErrorExtraccion(
+                        f'La extracción superó el tiempo máximo de {timeout} segundos',
+                        'timeout', 504
+                    )
+                
+                rss_mb = _memoria_residente_mb(proceso.process.pid) if self.memoria_max_mb else None
+                if rss_mb is not None and rss_mb > self.memoria_max_mb:
+                    reemplazar = True
+                    self._contar('memoria_excedida')
+                    logger.error(f"Extracción de {banco_id} usa {rss_mb:.0f} MB (máx. {self.memoria_max_mb} MB), "
+                                 f"terminando proceso {proceso.process.pid}")
+                    raise ErrorExtraccion(
+                        f'La extracción superó el límite de memoria de {self.memoria_max_mb} MB',
+                        'memoria'
+                    )
+                
+                try:
+                    hay_mensaje = proceso.conn.poll(min(restante, 1.0))
+                    if not hay_mensaje:
+                        if not proceso.process.is_alive():
+                            raise EOFError()
+                        continue
+                    mensaje = proceso.conn.recv()
+                except (EOFError, OSError):
+                    reemplazar = True
+                    self._contar('caidas')
+                    logger.error(f"El proceso de extracción {proceso.process.pid} terminó inesperadamente "
+                                 f"(exitcode {proceso.process.exitcode}) procesando {banco_id}")
+                    raise ErrorExtraccion(
+                        'El proceso de extracción terminó inesperadamente (PDF dañado o falta de memoria)',
+                        'caida'
+                    )
+                
+                if mensaje[0] == 'estado':
+                    # Respuesta tardía a un estado_registros que ya dejó de esperarla
+                    continue
+                if mensaje[0] == 'progreso':
+                    if progress_callback:
+                        try:
+                            progress_callback(mensaje[1], mensaje[2])
+                        except Exception as e:
+                            logger.warning(f"Error reportando progreso: {e}")
+                    continue
+                
+                proceso.jobs += 1
+                if mensaje[0] == 'resultado':
+                    self._contar('completados')
+                    if medidor is not None:
+                        medidor.combinar(mensaje[2])
+                    return mensaje[1]
+                
+                self._contar('errores')
+                if mensaje[2] == 'memoria':
+                    reemplazar = True
+                raise ErrorExtraccion(mensaje[1], mensaje[2])
+        finally:
             try:
-                extractor_function = getattr(module, extractor_info['function'])
-            except AttributeError as attr_error:
-                logger.error(f"Función {extractor_info['function']} no encontrada en {extractor_info['script']}: {str(attr_error)}")
-                return jsonify({
-                    'success': False,
-                    'message': f'Función {extractor_info["function"]} no encontrada en el extractor'
-                }), 500
-            
-            # Ejecutar la extracción
-            logger.info(f"Extrayendo datos de {banco_id}...")
-            df = None
+                if reemplazar:
+                    proceso.matar()
+                    proceso = self._nuevo_proceso()
+                elif proceso.jobs >= self.jobs_por_proceso:
+                    # Reciclar el proceso para liberar memoria que hayan dejado los extractores
+                    self._contar('reciclados')
+                    proceso.cerrar()
+                    proceso = self._nuevo_proceso()
+            except Exception as e:
+                # El proceso terminado vuelve a la cola igual: el próximo job que lo tome reintenta
+                # el reemplazo y el pool no pierde el lugar
+                self._contar('reemplazos_fallidos')
+                logger.error(f"No se pudo reemplazar el proceso de extracción: {e}", exc_info=True)
+            with self.lock:
+                self.en_uso -= 1
+            self.libres.put(proceso)
+    
+    def estado(self):
+        """Estado actual del pool para los endpoints de administración"""
+        with self.lock:
+            return {
+                'procesos': self.tamano,
+                'en_uso': self.en_uso,
+                'esperando': self.esperando,
+                'timeout_segundos': self.timeout,
+                'memoria_max_mb': self.memoria_max_mb,
+                'jobs_por_proceso': self.jobs_por_proceso,
+                'espera_max_segundos': self.espera_max,
+                'metodo_inicio': self.contexto.get_start_method(),
+                **self.estadisticas
+            }
+    
+    def estado_registros(self, timeout=2):
+        """Registro de extractores de cada proceso libre del pool. Los procesos ocupados no se
+        interrumpen (se cuentan en 'en_uso'); los libres se retienen como mucho timeout segundos"""
+        procesos = []
+        while True:
             try:
-                # Llamar a la función extractora
-                result = extractor_function(str(pdf_path), str(excel_path))
-                
-                # Verificar el resultado
-                if result is None:
-                    logger.warning(f"El extractor retornó None para {banco_id}")
-                    df = pd.DataFrame()
-                elif isinstance(result, pd.DataFrame):
-                    df = result
-                else:
-                    logger.warning(f"El extractor retornó un tipo inesperado: {type(result)}")
-                    df = pd.DataFrame()
-                    
-            except Exception as extract_error:
-                logger.error(f"Error durante la extracción: {str(extract_error)}", exc_info=True)
-                # Crear un DataFrame vacío para evitar que el servidor falle completamente
-                df = pd.DataFrame()
-                # Intentar crear un Excel vacío
+                procesos.append(self.libres.get_nowait())
+            except queue.Empty:
+                break
+        
+        registros = []
+        try:
+            pedidos = []
+            for proceso in procesos:
                 try:
-                    if not excel_path.exists():
-                        df_vacio = pd.DataFrame(columns=['Fecha', 'Origen', 'Descripcion', 'Debito', 'Credito', 'Saldo', 'Movimiento'])
-                        df_vacio.to_excel(str(excel_path), index=False)
-                        logger.info(f"Excel vacío creado debido al error")
-                except Exception as e:
-                    logger.error(f"Error creando Excel vacío: {str(e)}")
+                    if proceso.process.is_alive():
+                        proceso.conn.send('estado')
+                        pedidos.append(proceso)
+                        continue
+                except OSError:
+                    pass
+                registros.append({'pid': proceso.process.pid, 'vivo': False, 'jobs': proceso.jobs})
             
-            # Verificar que se generó el archivo Excel
-            if not excel_path.exists():
-                logger.warning(f"El archivo Excel no se generó en: {excel_path}")
-                # Intentar crear un Excel vacío
+            limite = time.monotonic() + timeout
+            for proceso in pedidos:
+                registro = {'pid': proceso.process.pid, 'vivo': True, 'jobs': proceso.jobs,
+                            'iniciado': datetime.fromtimestamp(proceso.iniciado).isoformat(), 'modulos': None}
                 try:
-                    df_vacio = pd.DataFrame(columns=['Fecha', 'Origen', 'Descripcion', 'Debito', 'Credito', 'Saldo', 'Movimiento'])
-                    df_vacio.to_excel(str(excel_path), index=False)
-                    logger.info(f"Excel vacío creado como fallback")
-                except Exception as e:
-                    logger.error(f"Error creando Excel vacío: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'message': 'No se pudo generar el archivo Excel'
-                    }), 500
+                    if proceso.conn.poll(max(0, limite - time.monotonic())):
+                        mensaje = proceso.conn.recv()
+                        if mensaje[0] == 'estado':
+                            registro['modulos'] = mensaje[1]
+                            registro['cargados'] = sum(1 for m in mensaje[1] if m['cargado'])
+                except (EOFError, OSError) as e:
+                    logger.warning(f"No se pudo leer el registro del proceso {proceso.process.pid}: {e}")
+                registros.append(registro)
+        finally:
+            for proceso in procesos:
+                self.libres.put(proceso)
+        return registros
+    
+    def cerrar(self):
+        """Termina todos los procesos libres del pool"""
+        while True:
+            try:
+                proceso = self.libres.get_nowait()
+            except queue.Empty:
+                break
+            proceso.cerrar()
+
+_pool_extraccion = None
+_pool_extraccion_pid = None
+_pool_extraccion_lock = threading.Lock()
+
+def obtener_pool_extraccion():
+    """Devuelve el pool del proceso actual, creándolo la primera vez (seguro con gunicorn --preload)"""
+    global _pool_extraccion, _pool_extraccion_pid
+    if _pool_extraccion is not None and _pool_extraccion_pid == os.getpid():
+        return _pool_extraccion
+    with _pool_extraccion_lock:
+        if _pool_extraccion is None or _pool_extraccion_pid != os.getpid():
+            _pool_extraccion = PoolExtraccion(
+                EXTRACTOR_POOL_SIZE,
+                EXTRACTOR_TIMEOUT_SEGUNDOS,
+                EXTRACTOR_MEMORIA_MAX_MB,
+                EXTRACTOR_JOBS_POR_PROCESO,
+                EXTRACTOR_ESPERA_MAX_SEGUNDOS
+            )
+            _pool_extraccion_pid = os.getpid()
+            atexit.register(_pool_extraccion.cerrar)
+    return _pool_extraccion
+
+def ejecutar_extraccion(banco_id, pdf_path, excel_path, progress_callback=None, medidor=None, total_paginas=None):
+    """Ejecuta una extracción en el pool de procesos (o en el proceso actual si el pool está deshabilitado).
+    total_paginas (si ya se contó al validar la subida) solo se usa para las métricas"""
+    inicio = time.perf_counter()
+    try:
+        if EXTRACTOR_POOL_HABILITADO:
+            df = obtener_pool_extraccion().ejecutar(banco_id, pdf_path, excel_path, progress_callback, medidor=medidor)
+        else:
+            df = ejecutar_extraccion_local(banco_id, pdf_path, excel_path, progress_callback, medidor)
+    except Exception:
+        registrar_metricas_extraccion(banco_id, 'error', time.perf_counter() - inicio)
+        raise
+    resultado = 'ok' if df is not None and not df.empty else 'vacio'
+    registrar_metricas_extraccion(banco_id, resultado, time.perf_counter() - inicio, df, total_paginas)
+    return df
+
+@app.route('/admin/pool', methods=['GET'])
+def admin_pool():
+    """Estado del pool de procesos de extracción de este worker"""
+    if not EXTRACTOR_POOL_HABILITADO:
+        return jsonify({'success': True, 'habilitado': False}), 200
+    return jsonify({
+        'success': True,
+        'habilitado': True,
+        'pid': os.getpid(),
+        'pool': obtener_pool_extraccion().estado()
+    }), 200
+
+# ==================== FIN POOL DE PROCESOS DE EXTRACCIÓN ====================
+
+# ==================== CACHÉ DE RESULTADOS ====================
+# Resultados de extracción direccionados por contenido: la clave combina el SHA-256
+# del PDF, el banco y un hash del código del extractor, así que un cambio en el
+# extractor invalida solo sus propias entradas. Se desalojan por LRU al superar el tamaño máximo.
+CACHE_DIR = Path(os.environ.get('CACHE_DIR', str(TEMP_DIR / 'cache')))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', '500')) * 1024 * 1024
+CACHE_HABILITADA = os.environ.get('CACHE_EXTRACCIONES', 'true').lower() in ('1', 'true', 'yes', 'si')
+
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS cache_resultados (
+        clave TEXT PRIMARY KEY,
+        banco TEXT NOT NULL,
+        pdf_sha256 TEXT NOT NULL,
+        version_extractor TEXT NOT NULL,
+        filas INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        creado REAL NOT NULL,
+        ultimo_acceso REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cache_ultimo_acceso ON cache_resultados (ultimo_acceso);
+''')
+
+_versiones_extractores = {}
+_versiones_extractores_lock = threading.Lock()
+
+def calcular_sha256(ruta, tamano_bloque=1024 * 1024):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def version_extractor(banco_id):
+    """Hash corto del código fuente del extractor (se recalcula solo si cambia el mtime)"""
+    script_path = EXTRACTORES_DIR / BANCO_EXTRACTORS[banco_id]['script']
+    mtime = script_path.stat().st_mtime
+    with _versiones_extractores_lock:
+        version = _versiones_extractores.get(script_path.name)
+        if version and version[0] == mtime:
+            return version[1]
+    digest = calcular_sha256(script_path)[:16]
+    with _versiones_extractores_lock:
+        _versiones_extractores[script_path.name] = (mtime, digest)
+    return digest
+
+def clave_cache(pdf_sha256, banco_id):
+    """Clave de caché para un PDF ya hasheado y un banco"""
+    base = f'{pdf_sha256}:{banco_id}:{version_extractor(banco_id)}'
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+def _rutas_cache(clave):
+    return CACHE_DIR / f'{clave}.xlsx', CACHE_DIR / f'{clave}.pkl'
+
+def _copiar_resultado(origen, destino):
+    """Copia el Excel de la caché (o de otro request) a destino. Nunca un hard link: el destino es un
+    archivo de trabajo que se puede volver a escribir, y con un link eso pisaría la entrada de origen"""
+    destino = Path(destino)
+    if destino.exists() and os.path.samefile(origen, destino):
+        return
+    # Copia a un temporal y rename: si destino ya es un link a otro archivo, ese archivo no se toca
+    temporal = destino.with_name(f'.{destino.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        shutil.copy2(origen, temporal)
+        os.replace(temporal, destino)
+    finally:
+        temporal.unlink(missing_ok=True)
+
+def buscar_en_cache(clave, excel_path, contar_miss=True):
+    """Si la clave está en caché, deja el Excel en excel_path y devuelve el DataFrame. None si no está.
+    Con excel_path=None alcanza con el DataFrame; si se pide Excel y la entrada se guardó sin él, es un miss"""
+    fila = _conexion_estado().execute(
+        'SELECT filas FROM cache_resultados WHERE clave = ?', (clave,)
+    ).fetchone()
+    xlsx_cache, pkl_cache = _rutas_cache(clave)
+    if fila is None or (excel_path is not None and not xlsx_cache.exists()):
+        if contar_miss:
+            incrementar_contador('cache.misses')
+        return None
+    
+    try:
+        df = pd.read_pickle(pkl_cache)
+        if excel_path is not None:
+            _copiar_resultado(xlsx_cache, excel_path)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+        # Entrada rota (archivo borrado a mano, disco lleno, etc.): se descarta
+        logger.warning(f"Entrada de caché {clave[:12]} inválida, se descarta: {e}")
+        eliminar_de_cache([clave])
+        incrementar_contador('cache.misses')
+        return None
+    
+    _conexion_estado().execute(
+        'UPDATE cache_resultados SET hits = hits + 1, ultimo_acceso = ? WHERE clave = ?',
+        (time.time(), clave)
+    )
+    incrementar_contador('cache.hits')
+    return df
+
+def eliminar_de_cache(claves):
+    """Borra entradas de la caché (índice y archivos)"""
+    with _TransaccionEstado() as conn:
+        conn.executemany('DELETE FROM cache_resultados WHERE clave = ?', [(c,) for c in claves])
+    for clave in claves:
+        for ruta in _rutas_cache(clave):
+            try:
+                ruta.unlink()
+            except FileNotFoundError:
+                pass
+
+def guardar_en_cache(clave, banco_id, pdf_sha256, df, excel_path):
+    """Guarda un resultado exitoso en la caché y desaloja las entradas menos usadas si se excede el tamaño.
+    Sin excel_path se guarda solo el DataFrame (alcanza para json, csv y parquet)"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    xlsx_cache, pkl_cache = _rutas_cache(clave)
+    try:
+        if excel_path is not None:
+            shutil.copy2(excel_path, xlsx_cache)
+        else:
+            xlsx_cache.unlink(missing_ok=True)
+        df.to_pickle(pkl_cache)
+    except Exception as e:
+        logger.warning(f"No se pudo guardar el resultado en caché: {e}")
+        return
+    
+    tamano = pkl_cache.stat().st_size + (xlsx_cache.stat().st_size if excel_path is not None else 0)
+    ahora = time.time()
+    desalojadas = []
+    with _TransaccionEstado() as conn:
+        conn.execute(
+            '''INSERT OR REPLACE INTO cache_resultados
+               (clave, banco, pdf_sha256, version_extractor, filas, bytes, hits, creado, ultimo_acceso)
+               VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+            (clave, banco_id, pdf_sha256, version_extractor(banco_id), len(df), tamano, ahora, ahora)
+        )
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM cache_resultados').fetchone()[0]
+        if total > CACHE_MAX_BYTES:
+            for fila in conn.execute('SELECT clave, bytes FROM cache_resultados ORDER BY ultimo_acceso'):
+                if total <= CACHE_MAX_BYTES:
+                    break
+                if fila['clave'] == clave:
+                    continue
+                desalojadas.append(fila['clave'])
+                total -= fila['bytes']
+    
+    if desalojadas:
+        eliminar_de_cache(desalojadas)
+        incrementar_contador('cache.desalojos', len(desalojadas))
+        logger.info(f"Caché: {len(desalojadas)} entradas desalojadas por tamaño")
+
+def extraer_con_cache(banco_id, pdf_path, excel_path, progress_callback=None, pdf_sha256=None, medidor=None,
+                      total_paginas=None):
+    """Devuelve (df, desde_cache). Busca el resultado en caché y si no está ejecuta la extracción"""
+    if not CACHE_HABILITADA:
+        return ejecutar_extraccion(banco_id, pdf_path, excel_path, progress_callback, medidor, total_paginas), False
+    
+    medidor = medidor or MedidorTiempos()
+    with medidor.etapa('cache'):
+        pdf_sha256 = pdf_sha256 or calcular_sha256(pdf_path)
+        clave = clave_cache(pdf_sha256, banco_id)
+        df = buscar_en_cache(clave, excel_path)
+    if df is not None:
+        logger.info(f"Resultado de {banco_id} obtenido de caché ({clave[:12]})")
+        registrar_metricas_extraccion(banco_id, 'cache', df=df)
+        return df, True
+    
+    # Si ya hay una extracción idéntica corriendo (en este u otro worker) se espera su resultado
+    return extraer_vuelo_unico(clave, banco_id, pdf_sha256, pdf_path, excel_path, progress_callback, medidor,
+                               total_paginas)
+
+def estadisticas_cache():
+    """Contadores de aciertos/fallos y ocupación de la caché"""
+    contadores = leer_contadores('cache.')
+    fila = _conexion_estado().execute(
+        'SELECT COUNT(*) AS entradas, COALESCE(SUM(bytes), 0) AS bytes FROM cache_resultados'
+    ).fetchone()
+    hits = contadores.get('hits', 0)
+    misses = contadores.get('misses', 0)
+    return {
+        'habilitada': CACHE_HABILITADA,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        'desalojos': contadores.get('desalojos', 0),
+        'coalescidos': contadores.get('coalescidos', 0),
+        'entradas': fila['entradas'],
+        'bytes': fila['bytes'],
+        'max_bytes': CACHE_MAX_BYTES
+    }
+
+@app.route('/admin/cache', methods=['GET'])
+def admin_cache():
+    """Estadísticas de la caché de resultados de extracción"""
+    try:
+        return jsonify({'success': True, 'cache': estadisticas_cache()}), 200
+    except Exception as e:
+        logger.error(f"Error consultando estadísticas de caché: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN CACHÉ DE RESULTADOS ====================
+
+# ==================== COALESCENCIA DE EXTRACCIONES IDÉNTICAS ====================
+# Si llegan dos requests con el mismo PDF y banco al mismo tiempo, solo el primero
+# ejecuta el extractor: entre threads se comparte el resultado en memoria y entre
+# procesos se usa un lock de archivo (el segundo proceso encuentra el resultado en la caché).
+LOCKS_DIR = TEMP_DIR / 'locks'
+
+class _VueloExtraccion:
+    """Extracción en curso compartida por los threads que piden la misma clave"""
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+_vuelos_en_curso = {}
+_vuelos_lock = threading.Lock()
+
+@contextmanager
+def lock_entre_procesos(nombre, timeout):
+    """Lock exclusivo por nombre usando flock sobre un archivo en LOCKS_DIR.
+    Si no se consigue dentro del timeout se sigue sin lock (se prefiere duplicar trabajo a colgar el request)."""
+    if fcntl is None:
+        # Windows (desarrollo local): solo hay coalescencia entre threads
+        yield False
+        return
+    
+    LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+    ruta = LOCKS_DIR / f'{nombre}.lock'
+    deadline = time.monotonic() + timeout
+    fd = None
+    while True:
+        fd = os.open(str(ruta), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            fd = None
+            if time.monotonic() >= deadline:
+                if timeout > 0:
+                    logger.warning(f"Timeout esperando el lock {nombre[:12]}, se continúa sin lock")
+                break
+            time.sleep(0.2)
+            continue
+        # El dueño anterior pudo borrar el archivo justo antes de que lo bloqueáramos
+        try:
+            mismo_archivo = os.fstat(fd).st_ino == os.stat(str(ruta)).st_ino
+        except FileNotFoundError:
+            mismo_archivo = False
+        if mismo_archivo:
+            break
+        os.close(fd)
+        fd = None
+    
+    try:
+        yield fd is not None
+    finally:
+        if fd is not None:
+            try:
+                ruta.unlink()
+            except FileNotFoundError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+def extraer_vuelo_unico(clave, banco_id, pdf_sha256, pdf_path, excel_path, progress_callback=None, medidor=None,
+                        total_paginas=None):
+    """Ejecuta la extracción una sola vez por clave aunque lleguen varios requests iguales a la vez.
+    Devuelve (df, compartido) donde compartido indica que el resultado lo calculó otro request."""
+    with _vuelos_lock:
+        vuelo = _vuelos_en_curso.get(clave)
+        lider = vuelo is None
+        if lider:
+            vuelo = _VueloExtraccion()
+            _vuelos_en_curso[clave] = vuelo
+    
+    espera_maxima = EXTRACTOR_TIMEOUT_SEGUNDOS + 60
+    medidor = medidor or MedidorTiempos()
+    
+    if not lider:
+        logger.info(f"Extracción idéntica en curso ({clave[:12]}), esperando su resultado")
+        incrementar_contador('cache.coalescidos')
+        with medidor.etapa('espera_coalescida'):
+            terminado = vuelo.terminado.wait(espera_maxima)
+        if not terminado:
+            raise ErrorExtraccion('Tiempo de espera agotado aguardando una extracción idéntica en curso', 'timeout', 504)
+        if vuelo.error is not None:
+            raise vuelo.error
+        if excel_path is None or vuelo.resultado is None or vuelo.resultado.empty:
+            return vuelo.resultado, True
+        # El Excel del líder es suyo: cuando se marca terminado ya lo pudo haber movido al almacén,
+        # borrado (?download=1) o perdido con la limpieza. Este request lo toma de la entrada de caché
+        # que el líder acaba de guardar; si no está (no se guardó, o se guardó sin Excel) se vuelve a
+        # intentar como líder (caché o extracción)
+        df = buscar_en_cache(clave, excel_path, contar_miss=False)
+        if df is not None:
+            return df, True
+        return extraer_vuelo_unico(clave, banco_id, pdf_sha256, pdf_path, excel_path, progress_callback, medidor,
+                                   total_paginas)
+    
+    try:
+        inicio_lock = time.perf_counter()
+        with lock_entre_procesos(clave, espera_maxima):
+            medidor.agregar('espera_lock', time.perf_counter() - inicio_lock)
+            # Otro proceso pudo haber terminado la misma extracción mientras esperábamos el lock
+            df = buscar_en_cache(clave, excel_path, contar_miss=False)
+            if df is not None:
+                incrementar_contador('cache.coalescidos')
+                vuelo.resultado = df
+                return df, True
             
-            # Obtener información del resultado
-            rows = len(df) if df is not None and hasattr(df, '__len__') and not df.empty else 0
-            logger.info(f"Extracción completada: {rows} filas extraídas")
+            df = ejecutar_extraccion(banco_id, pdf_path, excel_path, progress_callback, medidor, total_paginas)
+            # Solo se guardan resultados con datos: un resultado vacío puede deberse a un error transitorio
+            if df is not None and not df.empty and (excel_path is None or Path(excel_path).exists()):
+                with medidor.etapa('guardado_cache'):
+                    guardar_en_cache(clave, banco_id, pdf_sha256, df, excel_path)
+            vuelo.resultado = df
+            return df, False
+    except Exception as e:
+        vuelo.error = e
+        raise
+    finally:
+        with _vuelos_lock:
+            _vuelos_en_curso.pop(clave, None)
+        vuelo.terminado.set()
+
+# ==================== FIN COALESCENCIA DE EXTRACCIONES IDÉNTICAS ====================
+
+# ==================== TRABAJO EN MEMORIA ====================
+# TEMP_DIR está en el disco efímero del contenedor: guardar el PDF, que el extractor lo relea varias
+# veces y escribir el Excel para volver a leerlo es I/O puro. Los archivos de trabajo de una
+# extracción (el PDF subido y, con ?download=1, el resultado) van a un directorio en tmpfs
+# (/dev/shm): los extractores siguen recibiendo una ruta, que Camelot y Ghostscript necesitan, pero
+# el disco no se toca. La validación, el conteo de páginas y la detección de banco abren el PDF
+# directo desde el buffer de la subida. Si no hay tmpfs o no le queda lugar se usa TEMP_DIR.
+TRABAJO_EN_MEMORIA = os.environ.get('TRABAJO_EN_MEMORIA', 'true').lower() in ('1', 'true', 'yes', 'si')
+DIRECTORIO_MEMORIA = Path(os.environ.get('DIRECTORIO_MEMORIA', '/dev/shm')) / 'extractores'
+# El tmpfs comparte la RAM del contenedor (y en Docker suele tener 64 MB): siempre se deja este margen
+MEMORIA_RESERVA_BYTES = int(os.environ.get('MEMORIA_RESERVA_MB', '32')) * 1024 * 1024
+# Archivos de trabajo más viejos que esto son de un worker que murió a mitad de una extracción
+MEMORIA_HUERFANOS_SEGUNDOS = EXTRACTOR_TIMEOUT_SEGUNDOS + 600
+
+_directorio_memoria_pid = None
+
+def _directorio_memoria_listo():
+    """Crea el directorio en tmpfs la primera vez en cada proceso. False si no se puede usar"""
+    global _directorio_memoria_pid
+    if _directorio_memoria_pid == os.getpid():
+        return True
+    try:
+        DIRECTORIO_MEMORIA.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return False
+    if not os.access(DIRECTORIO_MEMORIA, os.W_OK):
+        return False
+    _directorio_memoria_pid = os.getpid()
+    return True
+
+def directorio_trabajo(tamano=0):
+    """Directorio para los archivos de trabajo de una extracción: tmpfs si entra (PDF, resultado y
+    margen), TEMP_DIR si no"""
+    if TRABAJO_EN_MEMORIA and _directorio_memoria_listo():
+        try:
+            libre = shutil.disk_usage(DIRECTORIO_MEMORIA).free
+        except OSError:
+            libre = 0
+        if libre - 3 * (tamano or 0) > MEMORIA_RESERVA_BYTES:
+            return DIRECTORIO_MEMORIA
+    return TEMP_DIR
+
+def purgar_directorio_memoria(ahora=None):
+    """Borra los archivos de trabajo huérfanos del tmpfs. Devuelve {'archivos', 'bytes'} liberados"""
+    liberados = {'archivos': 0, 'bytes': 0}
+    if not DIRECTORIO_MEMORIA.is_dir():
+        return liberados
+    ahora = ahora or time.time()
+    with os.scandir(DIRECTORIO_MEMORIA) as entradas:
+        for entrada in entradas:
+            try:
+                info = entrada.stat()
+                if entrada.is_file() and ahora - info.st_mtime > MEMORIA_HUERFANOS_SEGUNDOS:
+                    os.unlink(entrada.path)
+                    liberados['archivos'] += 1
+                    liberados['bytes'] += info.st_size
+            except OSError:
+                continue
+    if liberados['archivos']:
+        logger.info(f"Limpieza de {DIRECTORIO_MEMORIA}: {liberados['archivos']} archivos huérfanos eliminados")
+    return liberados
+
+def estadisticas_memoria():
+    """Ocupación del directorio de trabajo en tmpfs"""
+    datos = {'habilitado': TRABAJO_EN_MEMORIA, 'directorio': str(DIRECTORIO_MEMORIA), 'disponible': False}
+    if not TRABAJO_EN_MEMORIA or not DIRECTORIO_MEMORIA.is_dir():
+        return datos
+    uso = shutil.disk_usage(DIRECTORIO_MEMORIA)
+    archivos = [e.stat().st_size for e in os.scandir(DIRECTORIO_MEMORIA) if e.is_file()]
+    datos.update({
+        'disponible': True,
+        'libre_bytes': uso.free,
+        'total_bytes': uso.total,
+        'reserva_bytes': MEMORIA_RESERVA_BYTES,
+        'archivos': len(archivos),
+        'bytes': sum(archivos)
+    })
+    return datos
+
+# ==================== FIN TRABAJO EN MEMORIA ====================
+
+# ==================== LIMPIEZA AUTOMÁTICA DE TEMP_DIR ====================
+# Un thread por worker borra los resultados publicados (Excel, PDFs con OCR, ZIPs de lotes,
+# comparaciones) que superan el TTL y, si lo publicado pasa la cuota, desaloja los menos usados (LRU).
+# Solo se consideran los archivos registrados con registrar_artefacto en la tabla compartida
+# artefactos, donde también se guarda el último acceso: lo demás que haya en TEMP_DIR (PDFs esperando
+# el pool, subidas reanudables enlazadas, directorios de lotes en curso) es trabajo de algún request y
+# lo borra quien lo creó. El atime no sirve para esto (relatime/noatime en la mayoría de los montajes).
+LIMPIEZA_AUTOMATICA = os.environ.get('LIMPIEZA_AUTOMATICA', '1').lower() not in ('0', 'false', 'no')
+TEMP_MAX_MB = int(os.environ.get('TEMP_MAX_MB', '2048'))
+TEMP_MAX_BYTES = TEMP_MAX_MB * 1024 * 1024
+ARTEFACTOS_TTL_SEGUNDOS = int(os.environ.get('ARTEFACTOS_TTL_SEGUNDOS', '3600'))
+# Por cuota nunca se desaloja algo usado hace menos de esto (puede estar descargándose)
+ARTEFACTOS_EDAD_MINIMA_SEGUNDOS = int(os.environ.get('ARTEFACTOS_EDAD_MINIMA_SEGUNDOS', '300'))
+LIMPIEZA_INTERVALO_SEGUNDOS = int(os.environ.get('LIMPIEZA_INTERVALO_SEGUNDOS', '60'))
+
+# Resultados publicados (compartido entre workers): /download solo entrega archivos que estén acá
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS artefactos (
+        nombre TEXT PRIMARY KEY,
+        bytes INTEGER NOT NULL,
+        ultimo_acceso REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_artefactos_ultimo_acceso ON artefactos (ultimo_acceso);
+''')
+_limpieza_thread_pid = None
+_limpieza_thread_lock = threading.Lock()
+
+def _tamano_artefacto(ruta):
+    """Bytes de un archivo o directorio. Lanza FileNotFoundError si ya no existe"""
+    if not os.path.isdir(ruta):
+        return os.stat(ruta).st_size
+    total = 0
+    for raiz, _, nombres in os.walk(ruta):
+        for nombre in nombres:
+            try:
+                total += os.stat(os.path.join(raiz, nombre)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+def registrar_artefacto(ruta):
+    """Agrega (o actualiza) un archivo generado en el índice de limpieza"""
+    try:
+        tamano = _tamano_artefacto(ruta)
+    except FileNotFoundError:
+        return
+    _conexion_estado().execute(
+        'INSERT OR REPLACE INTO artefactos (nombre, bytes, ultimo_acceso) VALUES (?, ?, ?)',
+        (Path(ruta).name, tamano, time.time())
+    )
+
+def artefacto_publicado(nombre):
+    """Indica si nombre es un resultado registrado (y no la base de estado, un lock o una subida)"""
+    return _conexion_estado().execute('SELECT 1 FROM artefactos WHERE nombre = ?', (nombre,)).fetchone() is not None
+
+def tocar_artefacto(ruta):
+    """Marca un artefacto como recién usado (ej: al descargarlo) para que el LRU no lo desaloje"""
+    _conexion_estado().execute(
+        'UPDATE artefactos SET ultimo_acceso = ? WHERE nombre = ?', (time.time(), Path(ruta).name)
+    )
+
+def _borrar_artefacto(ruta):
+    if os.path.isdir(ruta):
+        shutil.rmtree(ruta, ignore_errors=True)
+    else:
+        os.unlink(ruta)
+
+def ejecutar_limpieza(espera_lock=0):
+    """Una pasada de limpieza: TTL + cuota LRU. Devuelve {'archivos', 'bytes'} liberados (None si otro worker
+    está limpiando en este momento)"""
+    with lock_entre_procesos('limpieza_temp', espera_lock) as adquirido:
+        if not adquirido and fcntl is not None:
+            return None
+        
+        ahora = time.time()
+        conn = _conexion_estado()
+        candidatos = conn.execute(
+            'SELECT nombre, bytes, ultimo_acceso FROM artefactos ORDER BY ultimo_acceso'
+        ).fetchall()
+        total = sum(fila['bytes'] for fila in candidatos)
+        
+        liberados = {'archivos': 0, 'bytes': 0}
+        for fila in candidatos:
+            expirado = ahora - fila['ultimo_acceso'] > ARTEFACTOS_TTL_SEGUNDOS
+            sobre_cuota = total > TEMP_MAX_BYTES and ahora - fila['ultimo_acceso'] > ARTEFACTOS_EDAD_MINIMA_SEGUNDOS
+            if not expirado and not sobre_cuota:
+                continue
             
-            # Si no se extrajeron datos, informar al usuario
-            if rows == 0:
-                logger.warning(f"No se extrajeron datos del PDF de {banco_id}")
-                return jsonify({
-                    'success': False,
-                    'message': 'No se pudieron extraer datos del PDF. Verifica que el formato sea correcto.'
-                }), 200
+            # Se saca del índice solo si nadie lo usó desde la lectura (una descarga lo actualiza).
+            # Primero el índice: desde acá /download ya no lo entrega aunque el borrado tarde
+            if conn.execute('DELETE FROM artefactos WHERE nombre = ? AND ultimo_acceso = ?',
+                            (fila['nombre'], fila['ultimo_acceso'])).rowcount == 0:
+                continue
+            total -= fila['bytes']
+            
+            ruta = TEMP_DIR / fila['nombre']
+            try:
+                _borrar_artefacto(ruta)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar {ruta}: {e}")
+                continue
+            liberados['archivos'] += 1
+            liberados['bytes'] += fila['bytes']
+            incrementar_contador('limpieza.expirados' if expirado else 'limpieza.desalojos')
+        
+        # Los archivos de trabajo en tmpfs no son artefactos: solo se borran los que quedaron huérfanos
+        purgar_directorio_memoria(ahora)
+        # Las subidas reanudables están en UPLOADS_DIR y tienen su propio vencimiento
+        purgar_subidas_reanudables(ahora)
+        
+        incrementar_contador('limpieza.pasadas')
+        if liberados['archivos']:
+            incrementar_contador('limpieza.archivos_eliminados', liberados['archivos'])
+            incrementar_contador('limpieza.bytes_liberados', liberados['bytes'])
+            logger.info(f"Limpieza de TEMP_DIR: {liberados['archivos']} archivos, {liberados['bytes'] / 1024 / 1024:.1f} MB liberados")
+        return liberados
 
-            base_url = request.host_url.rstrip('/')
+def _bucle_limpieza():
+    while True:
+        time.sleep(LIMPIEZA_INTERVALO_SEGUNDOS)
+        try:
+            ejecutar_limpieza()
+        except Exception as e:
+            logger.error(f"Error en la limpieza automática de TEMP_DIR: {str(e)}", exc_info=True)
+
+def asegurar_limpieza_automatica():
+    """Arranca el thread de limpieza del proceso actual la primera vez que se necesita"""
+    global _limpieza_thread_pid
+    if not LIMPIEZA_AUTOMATICA or _limpieza_thread_pid == os.getpid():
+        return
+    with _limpieza_thread_lock:
+        if _limpieza_thread_pid != os.getpid():
+            thread = threading.Thread(target=_bucle_limpieza, name='limpieza-temp')
+            thread.daemon = True
+            thread.start()
+            _limpieza_thread_pid = os.getpid()
+
+@app.before_request
+def iniciar_limpieza_automatica():
+    asegurar_limpieza_automatica()
+
+def estadisticas_limpieza():
+    """Ocupación de TEMP_DIR según el índice y bytes liberados por la limpieza"""
+    contadores = leer_contadores('limpieza.')
+    fila = _conexion_estado().execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM artefactos').fetchone()
+    return {
+        'habilitada': LIMPIEZA_AUTOMATICA,
+        'artefactos': fila[0],
+        'bytes': fila[1],
+        'max_bytes': TEMP_MAX_BYTES,
+        'ttl_segundos': ARTEFACTOS_TTL_SEGUNDOS,
+        'pasadas': contadores.get('pasadas', 0),
+        'archivos_eliminados': contadores.get('archivos_eliminados', 0),
+        'bytes_liberados': contadores.get('bytes_liberados', 0),
+        'expirados': contadores.get('expirados', 0),
+        'desalojos': contadores.get('desalojos', 0)
+    }
+
+@app.route('/admin/temp', methods=['GET'])
+def admin_temp():
+    """Estado de la limpieza automática de archivos temporales"""
+    try:
+        return jsonify({'success': True, 'temp': estadisticas_limpieza(), 'memoria': estadisticas_memoria()}), 200
+    except Exception as e:
+        logger.error(f"Error consultando estado de TEMP_DIR: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN LIMPIEZA AUTOMÁTICA DE TEMP_DIR ====================
+
+# ==================== MÉTRICAS (PROMETHEUS) ====================
+# Cada worker acumula sus métricas en memoria (un dict y un lock, sin I/O en el camino del request)
+# y un thread las vuelca cada METRICAS_INTERVALO_SEGUNDOS a METRICAS_DIR/<pid>.json.
+# /metrics suma los archivos de todos los workers; los de procesos que ya terminaron se
+# compactan en historico.json para que los contadores no retrocedan al reciclar workers.
+METRICAS_DIR = Path(os.environ.get('METRICAS_DIR', str(TEMP_DIR / 'metricas')))
+METRICAS_INTERVALO_SEGUNDOS = int(os.environ.get('METRICAS_INTERVALO_SEGUNDOS', '5'))
+BUCKETS_SEGUNDOS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# nombre -> (tipo, descripción)
+METRICAS_DEFINIDAS = {
+    'extractores_http_requests_total': ('counter', 'Requests HTTP atendidos por endpoint, método y status'),
+    'extractores_http_request_duration_seconds': ('histogram', 'Duración de los requests HTTP (incluye la subida del body)'),
+    'extractores_bytes_subidos_total': ('counter', 'Bytes recibidos en uploads multipart por endpoint'),
+    'extractores_extracciones_total': ('counter', 'Extracciones por banco y resultado (ok, vacio, error, cache)'),
+    'extractores_extraccion_duration_seconds': ('histogram', 'Duración de la ejecución del extractor por banco'),
+    'extractores_filas_extraidas_total': ('counter', 'Filas extraídas por banco'),
+    'extractores_paginas_procesadas_total': ('counter', 'Páginas de PDF procesadas por banco'),
+    'extractores_pool_procesos_en_uso': ('gauge', 'Procesos del pool de extracción ocupados'),
+    'extractores_pool_en_espera': ('gauge', 'Extracciones esperando un proceso libre del pool'),
+    'extractores_jobs_activos': ('gauge', 'Jobs pendientes o en proceso por tipo'),
+    'extractores_temp_bytes': ('gauge', 'Bytes ocupados por artefactos en TEMP_DIR'),
+    'extractores_temp_max_bytes': ('gauge', 'Cuota de bytes de TEMP_DIR'),
+    'extractores_temp_bytes_liberados_total': ('counter', 'Bytes liberados por la limpieza automática de TEMP_DIR'),
+    'extractores_io_requests_en_curso': ('gauge', 'Requests esperando I/O saliente (OAuth, emails)'),
+    'extractores_io_rechazos_total': ('counter', 'Requests rechazados con 503 por cupo de I/O saliente agotado'),
+    'extractores_http_saliente_total': ('counter', 'Llamadas HTTP salientes por host y status final (error si no hubo respuesta)'),
+    'extractores_http_saliente_duration_seconds': ('histogram', 'Duración de las llamadas HTTP salientes por host, con reintentos'),
+    'extractores_admision_costo_en_curso': ('gauge', 'Costo estimado (páginas × motor) de los trabajos admitidos en curso'),
+    'extractores_admision_capacidad': ('gauge', 'Capacidad del control de admisión en unidades de costo'),
+    'extractores_admision_rechazos_total': ('counter', 'Requests rechazados con 429 por el control de admisión'),
+    'extractores_deteccion_total': ('counter', 'Detecciones de banco por resultado (detectado, dudoso, cache)'),
+    'extractores_subidas_reanudables_total': ('counter', 'Eventos de subidas reanudables (iniciada, fragmento, cortada, completada, checksum_invalido, expirada...)'),
+    'extractores_idempotencia_total': ('counter', 'Requests con Idempotency-Key por endpoint y resultado (nueva, repetida, en_curso, conflicto)'),
+    'extractores_logs_en_cola': ('gauge', 'Registros de log esperando ser escritos'),
+    'extractores_logs_descartados': ('gauge', 'Registros de log descartados por cola llena desde que arrancó el worker'),
+}
+
+_metricas = {'contadores': {}, 'histogramas': {}}
+_metricas_lock = threading.Lock()
+_metricas_pid = None
+_metricas_thread_lock = threading.Lock()
+
+def _clave_metrica(nombre, etiquetas):
+    return json.dumps([nombre, sorted(etiquetas.items())])
+
+def metrica_contador(nombre, valor=1, **etiquetas):
+    """Suma valor a un contador etiquetado"""
+    clave = _clave_metrica(nombre, etiquetas)
+    with _metricas_lock:
+        _metricas['contadores'][clave] = _metricas['contadores'].get(clave, 0) + valor
+
+def metrica_histograma(nombre, valor, **etiquetas):
+    """Registra una observación (en segundos) en un histograma etiquetado"""
+    clave = _clave_metrica(nombre, etiquetas)
+    with _metricas_lock:
+        serie = _metricas['histogramas'].get(clave)
+        if serie is None:
+            # Un casillero por bucket más el +Inf, y al final suma y cantidad
+            serie = _metricas['histogramas'][clave] = [0] * (len(BUCKETS_SEGUNDOS) + 3)
+        for indice, limite in enumerate(BUCKETS_SEGUNDOS):
+            if valor <= limite:
+                serie[indice] += 1
+                break
+        else:
+            serie[len(BUCKETS_SEGUNDOS)] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+def _gauges_proceso():
+    """Gauges propios de este worker (se suman entre los workers vivos)"""
+    gauges = {}
+    if EXTRACTOR_POOL_HABILITADO and _pool_extraccion is not None and _pool_extraccion_pid == os.getpid():
+        estado = _pool_extraccion.estado()
+        gauges[_clave_metrica('extractores_pool_procesos_en_uso', {})] = estado['en_uso']
+        gauges[_clave_metrica('extractores_pool_en_espera', {})] = estado['esperando']
+    gauges[_clave_metrica('extractores_io_requests_en_curso', {})] = _io_en_curso
+    gauges[_clave_metrica('extractores_logs_en_cola', {})] = _manejador_logs.queue.qsize()
+    gauges[_clave_metrica('extractores_logs_descartados', {})] = _manejador_logs.descartados
+    return gauges
+
+def _escribir_json_atomico(ruta, datos):
+    temporal = ruta.with_name(f'.{ruta.name}.{os.getpid()}.tmp')
+    with open(temporal, 'w') as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+def volcar_metricas():
+    """Escribe la instantánea de este worker en METRICAS_DIR/<pid>.json"""
+    if _metricas_pid != os.getpid():
+        return
+    with _metricas_lock:
+        instantanea = {
+            'pid': os.getpid(),
+            'contadores': dict(_metricas['contadores']),
+            'histogramas': {clave: list(serie) for clave, serie in _metricas['histogramas'].items()}
+        }
+    instantanea['gauges'] = _gauges_proceso()
+    _escribir_json_atomico(METRICAS_DIR / f'{os.getpid()}.json', instantanea)
+
+def _sumar_metricas(destino, origen):
+    for clave, valor in origen.get('contadores', {}).items():
+        destino['contadores'][clave] = destino['contadores'].get(clave, 0) + valor
+    for clave, serie in origen.get('histogramas', {}).items():
+        acumulada = destino['histogramas'].get(clave)
+        if acumulada is None:
+            destino['histogramas'][clave] = list(serie)
+        else:
+            destino['histogramas'][clave] = [a + b for a, b in zip(acumulada, serie)]
+
+def _leer_json(ruta):
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _compactar_metricas(pids_muertos):
+    """Pasa las métricas de workers terminados a historico.json y borra sus archivos"""
+    with lock_entre_procesos('metricas', 5) as adquirido:
+        if not adquirido and fcntl is not None:
+            return
+        historico_path = METRICAS_DIR / 'historico.json'
+        historico = _leer_json(historico_path) or {'contadores': {}, 'histogramas': {}}
+        for pid in pids_muertos:
+            ruta = METRICAS_DIR / f'{pid}.json'
+            datos = _leer_json(ruta)
+            if datos is None:
+                continue
+            _sumar_metricas(historico, datos)
+            _escribir_json_atomico(historico_path, historico)
+            ruta.unlink(missing_ok=True)
+
+def _bucle_metricas():
+    while True:
+        time.sleep(METRICAS_INTERVALO_SEGUNDOS)
+        try:
+            volcar_metricas()
+        except Exception as e:
+            logger.warning(f"No se pudieron volcar las métricas: {e}")
+
+def asegurar_metricas():
+    """Inicializa las métricas del proceso actual (después de un fork arrancan vacías)"""
+    global _metricas_pid
+    if _metricas_pid == os.getpid():
+        return
+    with _metricas_thread_lock:
+        if _metricas_pid == os.getpid():
+            return
+        with _metricas_lock:
+            _metricas['contadores'].clear()
+            _metricas['histogramas'].clear()
+        METRICAS_DIR.mkdir(parents=True, exist_ok=True)
+        # Un archivo con nuestro pid es de un proceso anterior que reutilizó el número
+        if (METRICAS_DIR / f'{os.getpid()}.json').exists():
+            _compactar_metricas([os.getpid()])
+        _metricas_pid = os.getpid()
+        thread = threading.Thread(target=_bucle_metricas, name='metricas')
+        thread.daemon = True
+        thread.start()
+        atexit.register(volcar_metricas)
+
+@app.before_request
+def iniciar_metricas():
+    asegurar_metricas()
+
+@app.after_request
+def registrar_metricas_request(response):
+    try:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+        metrica_contador('extractores_http_requests_total', endpoint=endpoint,
+                         metodo=request.method, status=str(response.status_code))
+        inicio = getattr(request, 'inicio', None)
+        if inicio is not None:
+            metrica_histograma('extractores_http_request_duration_seconds',
+                               time.perf_counter() - inicio, endpoint=endpoint)
+        if request.content_length and request.mimetype == 'multipart/form-data':
+            metrica_contador('extractores_bytes_subidos_total', request.content_length, endpoint=endpoint)
+    except Exception as e:
+        logger.warning(f"No se pudieron registrar métricas del request: {e}")
+    return response
+
+def registrar_metricas_extraccion(banco_id, resultado, segundos=None, df=None, paginas=None):
+    """Registra una extracción terminada (resultado: ok, vacio, error, cache). paginas es la cantidad ya
+    conocida al validar la subida: el PDF no se vuelve a abrir solo para la métrica"""
+    metrica_contador('extractores_extracciones_total', banco=banco_id, resultado=resultado)
+    if segundos is not None:
+        metrica_histograma('extractores_extraccion_duration_seconds', segundos, banco=banco_id)
+    if df is not None and not df.empty:
+        metrica_contador('extractores_filas_extraidas_total', len(df), banco=banco_id)
+    if paginas and resultado != 'error':
+        metrica_contador('extractores_paginas_procesadas_total', paginas, banco=banco_id)
+
+def _formatear_etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas) + (extra or [])
+    if not pares:
+        return ''
+    valores = []
+    for nombre, valor in pares:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        valores.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(valores) + '}'
+
+def _formatear_numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def exportar_metricas():
+    """Arma el texto en formato de exposición de Prometheus con las métricas de todos los workers"""
+    asegurar_metricas()
+    volcar_metricas()
+    
+    total = {'contadores': {}, 'histogramas': {}}
+    gauges = {}
+    pids_muertos = []
+    for ruta in METRICAS_DIR.glob('*.json'):
+        datos = _leer_json(ruta)
+        if datos is None:
+            continue
+        pid = datos.get('pid')
+        if pid is not None and not _proceso_vivo(pid):
+            pids_muertos.append(pid)
+        elif pid is not None:
+            for clave, valor in datos.get('gauges', {}).items():
+                gauges[clave] = gauges.get(clave, 0) + valor
+        _sumar_metricas(total, datos)
+    if pids_muertos:
+        _compactar_metricas(pids_muertos)
+    
+    # Gauges compartidos: se leen del almacén de estado en el momento del scrape
+    for fila in _conexion_estado().execute(
+        'SELECT tipo, COUNT(*) AS cantidad FROM jobs WHERE status IN (?, ?) GROUP BY tipo',
+        JOB_ESTADOS_ACTIVOS
+    ):
+        gauges[_clave_metrica('extractores_jobs_activos', {'tipo': fila['tipo']})] = fila['cantidad']
+    admision = estado_admision()
+    gauges[_clave_metrica('extractores_admision_costo_en_curso', {})] = admision['costo_en_curso']
+    gauges[_clave_metrica('extractores_admision_capacidad', {})] = admision['capacidad']
+    limpieza = estadisticas_limpieza()
+    gauges[_clave_metrica('extractores_temp_bytes', {})] = limpieza['bytes']
+    gauges[_clave_metrica('extractores_temp_max_bytes', {})] = limpieza['max_bytes']
+    total['contadores'][_clave_metrica('extractores_temp_bytes_liberados_total', {})] = limpieza['bytes_liberados']
+    
+    series = {}
+    for origen in (total['contadores'], gauges, total['histogramas']):
+        for clave, valor in origen.items():
+            nombre, etiquetas = json.loads(clave)
+            series.setdefault(nombre, []).append((etiquetas, valor))
+    
+    lineas = []
+    for nombre in sorted(series):
+        tipo, descripcion = METRICAS_DEFINIDAS.get(nombre, ('untyped', nombre))
+        lineas.append(f'# HELP {nombre} {descripcion}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for etiquetas, valor in sorted(series[nombre], key=lambda item: str(item[0])):
+            if tipo != 'histogram':
+                lineas.append(f'{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_numero(valor)}')
+                continue
+            acumulado = 0
+            for limite, cantidad in zip(list(BUCKETS_SEGUNDOS) + ['+Inf'], valor[:-2]):
+                acumulado += cantidad
+                le = limite if limite == '+Inf' else repr(float(limite))
+                lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas, [("le", le)])} {acumulado}')
+            lineas.append(f'{nombre}_sum{_formatear_etiquetas(etiquetas)} {_formatear_numero(float(valor[-2]))}')
+            lineas.append(f'{nombre}_count{_formatear_etiquetas(etiquetas)} {valor[-1]}')
+    return '\n'.join(lineas) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato Prometheus (sumadas entre todos los workers)"""
+    try:
+        return Response(exportar_metricas(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        logger.error(f"Error exportando métricas: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN MÉTRICAS (PROMETHEUS) ====================
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Endpoint de salud"""
+    try:
+        logger.info("Health check recibido")
+        port = os.environ.get('PORT', os.environ.get('EXTRACTOR_PORT', 'NO DEFINIDA'))
+        response = jsonify({
+            'status': 'ok',
+            'message': 'Servidor funcionando correctamente',
+            'extractors_count': len(BANCO_EXTRACTORS),
+            'port': port,
+            'host': request.host,
+            'remote_addr': request.remote_addr
+        })
+        logger.info("Health check respondido exitosamente")
+        return response, 200
+    except Exception as e:
+        logger.error(f"Error en health check: {str(e)}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/extractors', methods=['GET'])
+def list_extractors():
+    """Lista todos los extractores disponibles"""
+    return jsonify({
+        'extractors': list(BANCO_EXTRACTORS.keys()),
+        'count': len(BANCO_EXTRACTORS)
+    })
+
+# ==================== CONTROL DE ADMISIÓN ====================
+# /extract, /pdf-to-ocr y /consilador/comparar piden permiso antes de trabajar. Cada trabajo tiene
+# un costo estimado (páginas × costo del motor) y se anota en la tabla admision del almacén
+# compartido, así que el total en curso se ve desde todos los workers. Si aceptar el trabajo
+# supera ADMISION_CAPACIDAD se responde 429 con un Retry-After calculado a partir del costo que
+# el servidor terminó de procesar en los últimos ADMISION_VENTANA_SEGUNDOS. Un trabajo solo
+# siempre se acepta aunque supere la capacidad (si no, nunca se procesaría).
+ADMISION_HABILITADA = os.environ.get('ADMISION', 'true').lower() in ('1', 'true', 'yes', 'si')
+# En unidades de costo: ~150 páginas de pdfplumber por núcleo
+ADMISION_CAPACIDAD = float(os.environ.get('ADMISION_CAPACIDAD', str(150 * (os.cpu_count() or 1))))
+ADMISION_VENTANA_SEGUNDOS = int(os.environ.get('ADMISION_VENTANA_SEGUNDOS', '300'))
+ADMISION_RETRY_DEFECTO_SEGUNDOS = 30
+ADMISION_RETRY_MAX_SEGUNDOS = 300
+
+# Costo por página (o por MB para los Excel del consilador) según el motor que lo procesa
+COSTOS_MOTOR = {
+    'pdfplumber': 1.0,
+    'camelot': 3.0,
+    'ocr': 8.0,
+    'excel': 2.0,
+}
+
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS admision (
+        id TEXT PRIMARY KEY,
+        tipo TEXT NOT NULL,
+        costo REAL NOT NULL,
+        pid INTEGER NOT NULL,
+        inicio REAL NOT NULL,
+        fin REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_admision_fin ON admision (fin);
+''')
+
+_motores_extractores = {}
+
+class ErrorAdmision(Exception):
+    """El servidor no tiene capacidad para aceptar el trabajo ahora"""
+    def __init__(self, retry_after, ocupado, costo):
+        super().__init__(f'Capacidad agotada ({ocupado:.0f} + {costo:.0f} > {ADMISION_CAPACIDAD:.0f})')
+        self.retry_after = retry_after
+        self.ocupado = ocupado
+        self.costo = costo
+
+def motor_extractor(banco_id):
+    """'camelot' si el extractor usa Camelot (más caro por página), 'pdfplumber' si no"""
+    script_path = EXTRACTORES_DIR / BANCO_EXTRACTORS[banco_id]['script']
+    mtime = script_path.stat().st_mtime
+    guardado = _motores_extractores.get(script_path.name)
+    if guardado and guardado[0] == mtime:
+        return guardado[1]
+    codigo = script_path.read_text(encoding='utf-8', errors='ignore')
+    motor = 'camelot' if re.search(r'^\s*(import|from)\s+camelot', codigo, re.MULTILINE) else 'pdfplumber'
+    _motores_extractores[script_path.name] = (mtime, motor)
+    return motor
+
+def costo_extraccion(banco_id, paginas, pdf_sha256=None):
+    """Costo estimado de extraer un PDF (0 si el resultado ya está en la caché)"""
+    if CACHE_HABILITADA and pdf_sha256:
+        fila = _conexion_estado().execute(
+            'SELECT 1 FROM cache_resultados WHERE clave = ?', (clave_cache(pdf_sha256, banco_id),)
+        ).fetchone()
+        if fila is not None:
+            return 0.0
+    return max(1, paginas or 1) * COSTOS_MOTOR[motor_extractor(banco_id)]
+
+def _throughput_admision(conn, ahora):
+    """Unidades de costo terminadas por segundo en la ventana reciente (None si no hay datos)"""
+    terminado = conn.execute(
+        'SELECT COALESCE(SUM(costo), 0) FROM admision WHERE fin IS NOT NULL AND fin >= ?',
+        (ahora - ADMISION_VENTANA_SEGUNDOS,)
+    ).fetchone()[0]
+    return terminado / ADMISION_VENTANA_SEGUNDOS if terminado else None
+
+def _purgar_admision(conn, ahora):
+    """Borra lo terminado fuera de la ventana y los trabajos de workers que ya no existen"""
+    conn.execute('DELETE FROM admision WHERE fin IS NOT NULL AND fin < ?', (ahora - ADMISION_VENTANA_SEGUNDOS,))
+    conn.execute('DELETE FROM admision WHERE fin IS NULL AND inicio < ?', (ahora - JOBS_ABANDONO_SEGUNDOS,))
+    pids = [fila['pid'] for fila in conn.execute('SELECT DISTINCT pid FROM admision WHERE fin IS NULL')]
+    muertos = [pid for pid in pids if pid != os.getpid() and not _proceso_vivo(pid)]
+    if muertos:
+        conn.executemany('DELETE FROM admision WHERE fin IS NULL AND pid = ?', [(pid,) for pid in muertos])
+
+def admitir_trabajo(tipo, costo):
+    """Reserva capacidad para un trabajo. Devuelve el ticket a liberar con liberar_admision
+    (None si no hace falta) o lanza ErrorAdmision con el Retry-After sugerido"""
+    if not ADMISION_HABILITADA or costo <= 0:
+        return None
+    ahora = time.time()
+    with _TransaccionEstado() as conn:
+        _purgar_admision(conn, ahora)
+        ocupado = conn.execute('SELECT COALESCE(SUM(costo), 0) FROM admision WHERE fin IS NULL').fetchone()[0]
+        if ocupado > 0 and ocupado + costo > ADMISION_CAPACIDAD:
+            throughput = _throughput_admision(conn, ahora)
+            if throughput:
+                espera = (ocupado + costo - ADMISION_CAPACIDAD) / throughput
+            else:
+                espera = ADMISION_RETRY_DEFECTO_SEGUNDOS
+            retry_after = int(min(ADMISION_RETRY_MAX_SEGUNDOS, max(1, round(espera))))
+            raise ErrorAdmision(retry_after, ocupado, costo)
+        
+        ticket = uuid.uuid4().hex
+        conn.execute(
+            'INSERT INTO admision (id, tipo, costo, pid, inicio) VALUES (?, ?, ?, ?, ?)',
+            (ticket, tipo, costo, os.getpid(), ahora)
+        )
+    return ticket
+
+def liberar_admision(ticket):
+    """Marca el trabajo como terminado (su costo pasa a contar para el throughput)"""
+    if ticket is None:
+        return
+    try:
+        _conexion_estado().execute('UPDATE admision SET fin = ? WHERE id = ?', (time.time(), ticket))
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo liberar el ticket de admisión {ticket[:8]}: {e}")
+
+def respuesta_admision_rechazada(error):
+    """429 con Retry-After para un trabajo que no se pudo admitir"""
+    endpoint = request.url_rule.rule if request.url_rule is not None else request.path
+    metrica_contador('extractores_admision_rechazos_total', endpoint=endpoint)
+    logger.warning(f"Admisión rechazada en {endpoint}: {error} (Retry-After {error.retry_after}s)")
+    respuesta = jsonify({
+        'success': False,
+        'message': f'El servidor está procesando demasiados archivos. Intenta de nuevo en {error.retry_after} segundos.',
+        'retry_after': error.retry_after
+    })
+    respuesta.headers['Retry-After'] = str(error.retry_after)
+    return respuesta, 429
+
+def estado_admision():
+    """Trabajo en curso, capacidad y throughput reciente (compartido entre workers)"""
+    ahora = time.time()
+    conn = _conexion_estado()
+    ocupado = conn.execute(
+        'SELECT COUNT(*) AS trabajos, COALESCE(SUM(costo), 0) AS costo FROM admision WHERE fin IS NULL'
+    ).fetchone()
+    throughput = _throughput_admision(conn, ahora)
+    return {
+        'habilitada': ADMISION_HABILITADA,
+        'capacidad': ADMISION_CAPACIDAD,
+        'trabajos_en_curso': ocupado['trabajos'],
+        'costo_en_curso': ocupado['costo'],
+        'throughput_por_segundo': round(throughput, 3) if throughput else None,
+        'costos_motor': COSTOS_MOTOR
+    }
+
+@app.route('/admin/admision', methods=['GET'])
+def admin_admision():
+    """Estado del control de admisión"""
+    try:
+        return jsonify({'success': True, 'admision': estado_admision()}), 200
+    except Exception as e:
+        logger.error(f"Error consultando el control de admisión: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN CONTROL DE ADMISIÓN ====================
+
+# ==================== IDEMPOTENCIA ====================
+# Los clientes con red inestable reintentan el POST después de un timeout y arrancaban una segunda
+# extracción completa. Con el header Idempotency-Key, el primer request reserva la clave en la tabla
+# idempotencia del almacén compartido (la ven todos los workers) y al terminar guarda su respuesta.
+# Un reintento con la misma clave recibe esa respuesta (con ?async=1 es el 202 del job original),
+# espera a que termine si todavía está en curso, o recibe 422 si el archivo o los parámetros no
+# coinciden. Las respuestas 5xx y 429 no se guardan para que el cliente pueda reintentar: si el
+# original falla mientras un reintento lo espera, el reintento toma la clave y se ejecuta.
+# Se guardan también los headers que puso la vista (X-Rows, X-Cache, Retry-After...). Server-Timing
+# y X-Request-ID se agregan después de la vista, así que la respuesta repetida lleva los suyos.
+# La ventana por defecto es la vida de los archivos generados: después el downloadUrl ya no existe.
+IDEMPOTENCIA_VENTANA_SEGUNDOS = int(os.environ.get('IDEMPOTENCIA_VENTANA_SEGUNDOS', str(ARTEFACTOS_TTL_SEGUNDOS)))
+IDEMPOTENCIA_ESPERA_SEGUNDOS = float(os.environ.get('IDEMPOTENCIA_ESPERA_SEGUNDOS', '30'))
+IDEMPOTENCIA_INTERVALO_SEGUNDOS = 0.5
+
+_PATRON_CLAVE_IDEMPOTENCIA = re.compile(r'^[\x21-\x7e]{1,255}$')
+
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS idempotencia (
+        clave TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        huella TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        status_code INTEGER,
+        mimetype TEXT,
+        respuesta TEXT,
+        headers TEXT,
+        creado REAL NOT NULL,
+        expira REAL NOT NULL,
+        PRIMARY KEY (clave, endpoint)
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotencia_expira ON idempotencia (expira);
+''')
+
+def huella_request():
+    """Hash de lo que define el trabajo: ruta, query, campos del formulario y SHA-256 de cada archivo"""
+    sha = hashlib.sha256()
+    partes = [request.path, sorted(request.args.items(multi=True)), sorted(request.form.items(multi=True))]
+    for campo, archivo in sorted(request.files.items(multi=True), key=lambda item: (item[0], item[1].filename or '')):
+        contenido = archivo.stream.sha256 if isinstance(archivo.stream, ArchivoSubida) else ''
+        partes.append([campo, archivo.filename, contenido])
+    sha.update(json.dumps(partes, ensure_ascii=False).encode('utf-8'))
+    return sha.hexdigest()
 
+def _reservar_idempotencia(clave, endpoint, huella):
+    """Reserva la clave para este request. Devuelve None si quedó reservada o la fila existente"""
+    ahora = time.time()
+    with _TransaccionEstado() as conn:
+        conn.execute('DELETE FROM idempotencia WHERE expira < ?', (ahora,))
+        fila = conn.execute(
+            'SELECT * FROM idempotencia WHERE clave = ? AND endpoint = ?', (clave, endpoint)
+        ).fetchone()
+        # Una reserva de un worker que murió (o colgada) no bloquea la clave para siempre
+        abandonada = fila is not None and fila['estado'] == 'en_curso' and (
+            (fila['pid'] != os.getpid() and not _proceso_vivo(fila['pid']))
+            or fila['creado'] < ahora - JOBS_ABANDONO_SEGUNDOS
+        )
+        if fila is not None and not abandonada:
+            return dict(fila)
+        conn.execute(
+            '''INSERT OR REPLACE INTO idempotencia (clave, endpoint, huella, estado, pid, creado, expira)
+               VALUES (?, ?, ?, 'en_curso', ?, ?, ?)''',
+            (clave, endpoint, huella, os.getpid(), ahora, ahora + IDEMPOTENCIA_VENTANA_SEGUNDOS)
+        )
+    return None
+
+def _completar_idempotencia(clave, endpoint, respuesta):
+    """Guarda la respuesta para los reintentos, o libera la clave si no corresponde guardarla"""
+    conn = _conexion_estado()
+    if respuesta.status_code >= 500 or respuesta.status_code == 429 or respuesta.is_streamed:
+        conn.execute('DELETE FROM idempotencia WHERE clave = ? AND endpoint = ?', (clave, endpoint))
+        return
+    # Content-Type sale del mimetype y Content-Length lo recalcula la respuesta repetida
+    headers = [(nombre, valor) for nombre, valor in respuesta.headers.items()
+               if nombre.lower() not in ('content-type', 'content-length')]
+    conn.execute(
+        '''UPDATE idempotencia SET estado = 'completado', status_code = ?, mimetype = ?, respuesta = ?, headers = ?
+           WHERE clave = ? AND endpoint = ?''',
+        (respuesta.status_code, respuesta.mimetype, respuesta.get_data(as_text=True), json.dumps(headers),
+         clave, endpoint)
+    )
+
+def _liberar_idempotencia(clave, endpoint):
+    try:
+        _conexion_estado().execute('DELETE FROM idempotencia WHERE clave = ? AND endpoint = ?', (clave, endpoint))
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo liberar la clave de idempotencia {clave}: {e}")
+
+def _esperar_idempotencia(clave, endpoint):
+    """Espera a que termine el request original con la misma clave. Devuelve la fila completada,
+    None si la clave se liberó (el original falló) o la fila en curso si se agotó la espera"""
+    limite = time.monotonic() + IDEMPOTENCIA_ESPERA_SEGUNDOS
+    fila = None
+    while time.monotonic() < limite:
+        time.sleep(IDEMPOTENCIA_INTERVALO_SEGUNDOS)
+        fila = _conexion_estado().execute(
+            'SELECT * FROM idempotencia WHERE clave = ? AND endpoint = ?', (clave, endpoint)
+        ).fetchone()
+        if fila is None or fila['estado'] == 'completado':
+            return fila
+    return fila
+
+def idempotente(vista):
+    """Decorador para endpoints POST que aceptan el header Idempotency-Key"""
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = request.headers.get('Idempotency-Key')
+        if clave is None:
+            return vista(*args, **kwargs)
+        if not _PATRON_CLAVE_IDEMPOTENCIA.match(clave):
             return jsonify({
-                'success': True,
-                'message': 'Extracción completada exitosamente',
-                'filename': excel_filename,
-                'rows': rows,
-                'downloadUrl': f'{base_url}/download/{excel_filename}'
+                'success': False,
+                'message': 'Idempotency-Key inválida: hasta 255 caracteres ASCII visibles'
+            }), 400
+        
+        endpoint = request.url_rule.rule
+        huella = huella_request()
+        fila = _reservar_idempotencia(clave, endpoint, huella)
+        if fila is not None and fila['huella'] == huella and fila['estado'] == 'en_curso':
+            logger.info(f"Reintento con Idempotency-Key {clave} mientras el original sigue en curso, esperando")
+            fila = _esperar_idempotencia(clave, endpoint)
+            if fila is None:
+                # El original falló (5xx, 429 o una excepción) y liberó la clave: este reintento la toma
+                logger.info(f"Idempotency-Key {clave}: el original no guardó respuesta, se procesa el reintento")
+                fila = _reservar_idempotencia(clave, endpoint, huella)
+        
+        if fila is None:
+            metrica_contador('extractores_idempotencia_total', endpoint=endpoint, resultado='nueva')
+            try:
+                respuesta = app.make_response(vista(*args, **kwargs))
+            except Exception:
+                _liberar_idempotencia(clave, endpoint)
+                raise
+            _completar_idempotencia(clave, endpoint, respuesta)
+            return respuesta
+        
+        if fila['huella'] != huella:
+            metrica_contador('extractores_idempotencia_total', endpoint=endpoint, resultado='conflicto')
+            return jsonify({
+                'success': False,
+                'message': 'La Idempotency-Key ya se usó con otro archivo o parámetros'
+            }), 422
+        
+        if fila['estado'] == 'en_curso':
+            # Sigue en curso después de la espera, o el original falló y otro reintento ya tomó la clave
+            metrica_contador('extractores_idempotencia_total', endpoint=endpoint, resultado='en_curso')
+            respuesta = jsonify({
+                'success': False,
+                'message': 'La solicitud original todavía se está procesando. Intenta de nuevo en unos segundos.'
             })
+            respuesta.headers['Retry-After'] = str(max(1, round(IDEMPOTENCIA_ESPERA_SEGUNDOS)))
+            return respuesta, 409
+        
+        metrica_contador('extractores_idempotencia_total', endpoint=endpoint, resultado='repetida')
+        logger.info(f"Idempotency-Key {clave}: se devuelve la respuesta original ({fila['status_code']})")
+        respuesta = Response(fila['respuesta'], status=fila['status_code'], mimetype=fila['mimetype'],
+                             headers=json.loads(fila['headers'] or '[]'))
+        respuesta.headers['Idempotent-Replayed'] = 'true'
+        return respuesta
+    return envoltura
+
+# ==================== FIN IDEMPOTENCIA ====================
+
+# ==================== SUBIDAS REANUDABLES ====================
+# Los PDF escaneados que van a /pdf-to-ocr pesan 50-200 MB y se suben desde redes malas: si se corta
+# la conexión el multipart vuelve a empezar de cero. Protocolo por fragmentos:
+#   POST   /uploads                  {filename, size, sha256} -> upload_id
+#   PUT    /uploads/<id>             cuerpo = fragmento, header Upload-Offset = bytes ya recibidos
+#   GET    /uploads/<id>             offset actual (para retomar después de un corte)
+#   POST   /uploads/<id>/complete    verifica tamaño y SHA-256 del archivo ensamblado
+#   DELETE /uploads/<id>             cancela y borra
+# Los fragmentos se escriben en orden sobre un único archivo en UPLOADS_DIR y el estado va en la tabla
+# subidas del almacén compartido, así cada fragmento lo puede atender cualquier worker. Una vez
+# completada, /extract, /extract/detect y /pdf-to-ocr aceptan upload_id en lugar del archivo: se
+# entrega al pipeline como un archivo subido más y se enlaza (hard link) al destino sin copiarlo. La
+# subida sigue disponible hasta que expira, así un 429 o un error se reintenta sin volver a subirla.
+SUBIDA_REANUDABLE_MAX_MB = int(os.environ.get('SUBIDA_REANUDABLE_MAX_MB', '500'))
+# Tamaño de fragmento sugerido al cliente (cada PUT está limitado por UPLOAD_MAX_MB)
+SUBIDA_FRAGMENTO_MB = min(int(os.environ.get('SUBIDA_FRAGMENTO_MB', '8')), UPLOAD_MAX_MB)
+# Se cuenta desde el último fragmento recibido o el último uso
+SUBIDA_REANUDABLE_TTL_SEGUNDOS = int(os.environ.get('SUBIDA_REANUDABLE_TTL_SEGUNDOS', str(24 * 3600)))
+SUBIDAS_REANUDABLES_DIR = UPLOADS_DIR / 'reanudables'
+EXTENSIONES_REANUDABLES = ('.pdf',)
+TAMANO_BLOQUE_SUBIDA = 1024 * 1024
+
+_PATRON_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_PATRON_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS subidas (
+        id TEXT PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        tamano INTEGER NOT NULL,
+        sha256 TEXT,
+        recibido INTEGER NOT NULL DEFAULT 0,
+        estado TEXT NOT NULL,
+        creado REAL NOT NULL,
+        actualizado REAL NOT NULL,
+        expira REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_subidas_expira ON subidas (expira);
+''')
+
+class SubidaCompleta(ArchivoSubida):
+    """Subida reanudable ya ensamblada y verificada, con la interfaz de un archivo del multipart"""
+    
+    def __init__(self, ruta, nombre, tamano, sha256):
+        super().__init__(nombre)
+        self.ruta_temporal = Path(ruta)
+        self.bytes = tamano
+        self._sha256 = sha256
+        with open(ruta, 'rb') as archivo:
+            self.cabecera = archivo.read(TAMANO_CABECERA)
+    
+    @property
+    def sha256(self):
+        return self._sha256
+    
+    def guardar(self, destino):
+        # Hard link: el destino comparte los bytes y la subida sigue disponible para reintentos
+        try:
+            os.link(self.ruta_temporal, destino)
+        except OSError:
+            shutil.copyfile(self.ruta_temporal, destino)
+    
+    def close(self):
+        # El archivo ensamblado es de la subida, no del request: lo borra la expiración
+        pass
+
+def _ruta_subida(upload_id):
+    return SUBIDAS_REANUDABLES_DIR / f'{upload_id}.part'
+
+def _obtener_subida(upload_id):
+    if not _PATRON_UPLOAD_ID.match(upload_id or ''):
+        return None
+    fila = _conexion_estado().execute('SELECT * FROM subidas WHERE id = ?', (upload_id,)).fetchone()
+    if fila is None or fila['expira'] < time.time():
+        return None
+    return dict(fila)
+
+def _borrar_subida(upload_id):
+    _conexion_estado().execute('DELETE FROM subidas WHERE id = ?', (upload_id,))
+    _ruta_subida(upload_id).unlink(missing_ok=True)
+
+def _respuesta_subida(fila, status_code=200):
+    base_url = request.host_url.rstrip('/')
+    respuesta = jsonify({
+        'success': True,
+        'upload_id': fila['id'],
+        'filename': fila['nombre'],
+        'size': fila['tamano'],
+        'offset': fila['recibido'],
+        'status': fila['estado'],
+        'sha256': fila['sha256'],
+        'chunkSize': SUBIDA_FRAGMENTO_MB * 1024 * 1024,
+        'expiresIn': max(0, int(fila['expira'] - time.time())),
+        'uploadUrl': f'{base_url}/uploads/{fila["id"]}',
+        'completeUrl': f'{base_url}/uploads/{fila["id"]}/complete'
+    })
+    respuesta.status_code = status_code
+    respuesta.headers['Upload-Offset'] = str(fila['recibido'])
+    respuesta.headers['Upload-Length'] = str(fila['tamano'])
+    respuesta.headers['Cache-Control'] = 'no-store'
+    return respuesta
+
+def _respuesta_error_subida(mensaje, status_code, recibido):
+    """Error con el offset confirmado para que el cliente retome desde ahí"""
+    respuesta = jsonify({'success': False, 'message': mensaje, 'offset': recibido})
+    respuesta.status_code = status_code
+    respuesta.headers['Upload-Offset'] = str(recibido)
+    return respuesta
+
+def _subida_inexistente():
+    return jsonify({'success': False, 'message': 'La subida no existe o ya expiró'}), 404
+
+def archivo_de_request(campo):
+    """Archivo del campo del multipart o, si se manda upload_id, la subida reanudable completada
+    (None si no hay ninguno). Lanza ErrorSubida si el upload_id no sirve"""
+    if campo in request.files:
+        return request.files[campo]
+    upload_id = request.form.get('upload_id') or request.args.get('upload_id')
+    if not upload_id:
+        return None
+    fila = _obtener_subida(upload_id)
+    if fila is None or not _ruta_subida(upload_id).exists():
+        raise ErrorSubida('La subida no existe o ya expiró', 404)
+    if fila['estado'] != 'completa':
+        raise ErrorSubida(f'La subida no está completa ({fila["recibido"]} de {fila["tamano"]} bytes)', 409)
+    _conexion_estado().execute('UPDATE subidas SET expira = ? WHERE id = ?',
+                               (time.time() + SUBIDA_REANUDABLE_TTL_SEGUNDOS, upload_id))
+    stream = SubidaCompleta(_ruta_subida(upload_id), fila['nombre'], fila['tamano'], fila['sha256'])
+    return FileStorage(stream=stream, filename=fila['nombre'], name=campo, content_type='application/pdf')
+
+def purgar_subidas_reanudables(ahora=None):
+    """Borra las subidas expiradas (completas o a medias) y sus archivos. Devuelve cuántas borró"""
+    ahora = ahora or time.time()
+    with _TransaccionEstado() as conn:
+        vencidas = [fila['id'] for fila in conn.execute('SELECT id FROM subidas WHERE expira < ?', (ahora,))]
+        conn.execute('DELETE FROM subidas WHERE expira < ?', (ahora,))
+    for upload_id in vencidas:
+        _ruta_subida(upload_id).unlink(missing_ok=True)
+    if vencidas:
+        metrica_contador('extractores_subidas_reanudables_total', len(vencidas), evento='expirada')
+        logger.info(f"Subidas reanudables expiradas: {len(vencidas)}")
+    return len(vencidas)
+
+@app.route('/uploads', methods=['POST'])
+def iniciar_subida():
+    """Inicia una subida reanudable. Body JSON: filename, size (bytes) y sha256 (se puede mandar
+    recién al completar)"""
+    datos = request.get_json(silent=True) or {}
+    nombre = Path(str(datos.get('filename') or '')).name
+    sha256 = str(datos.get('sha256') or '').lower() or None
+    try:
+        tamano = int(datos.get('size'))
+    except (TypeError, ValueError):
+        tamano = 0
+    
+    if Path(nombre).suffix.lower() not in EXTENSIONES_REANUDABLES:
+        return jsonify({'success': False, 'message': 'Solo se aceptan archivos PDF'}), 400
+    if tamano <= 0:
+        return jsonify({'success': False, 'message': 'size debe ser el tamaño del archivo en bytes'}), 400
+    if tamano > SUBIDA_REANUDABLE_MAX_MB * 1024 * 1024:
+        return jsonify({
+            'success': False,
+            'message': f'El archivo supera el tamaño máximo permitido ({SUBIDA_REANUDABLE_MAX_MB} MB)'
+        }), 413
+    if sha256 is not None and not _PATRON_SHA256.match(sha256):
+        return jsonify({'success': False, 'message': 'sha256 debe ser el hash hexadecimal del archivo'}), 400
+    
+    SUBIDAS_REANUDABLES_DIR.mkdir(parents=True, exist_ok=True)
+    if shutil.disk_usage(SUBIDAS_REANUDABLES_DIR).free < 2 * tamano:
+        return jsonify({'success': False, 'message': 'No hay espacio para recibir el archivo'}), 507
+    
+    upload_id = uuid.uuid4().hex
+    _ruta_subida(upload_id).touch()
+    ahora = time.time()
+    _conexion_estado().execute(
+        '''INSERT INTO subidas (id, nombre, tamano, sha256, recibido, estado, creado, actualizado, expira)
+           VALUES (?, ?, ?, ?, 0, 'en_curso', ?, ?, ?)''',
+        (upload_id, nombre, tamano, sha256, ahora, ahora, ahora + SUBIDA_REANUDABLE_TTL_SEGUNDOS)
+    )
+    metrica_contador('extractores_subidas_reanudables_total', evento='iniciada')
+    logger.info(f"Subida reanudable {upload_id} iniciada: {nombre} ({tamano / 1024 / 1024:.1f} MB)")
+    return _respuesta_subida(_obtener_subida(upload_id), 201)
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def estado_subida(upload_id):
+    """Estado de una subida reanudable (offset desde el que hay que seguir)"""
+    fila = _obtener_subida(upload_id)
+    if fila is None:
+        return _subida_inexistente()
+    return _respuesta_subida(fila)
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def subir_fragmento(upload_id):
+    """Agrega el cuerpo del request como fragmento en el offset indicado por Upload-Offset (o ?offset=)"""
+    if _obtener_subida(upload_id) is None:
+        return _subida_inexistente()
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Falta el header Upload-Offset'}), 400
+    
+    with lock_entre_procesos(f'subida_{upload_id}', 0) as adquirido:
+        # Releer dentro del lock: el fragmento anterior pudo terminar recién
+        fila = _obtener_subida(upload_id)
+        if fila is None:
+            return _subida_inexistente()
+        if not adquirido and fcntl is not None:
+            return _respuesta_error_subida('Ya se está recibiendo otro fragmento de esta subida', 409,
+                                           fila['recibido'])
+        if fila['estado'] != 'en_curso':
+            return jsonify({'success': False, 'message': 'La subida ya se completó'}), 409
+        if offset != fila['recibido']:
+            return _respuesta_error_subida(f'El offset esperado es {fila["recibido"]}', 409, fila['recibido'])
+        
+        extension = Path(fila['nombre']).suffix.lower()
+        escritos = 0
+        error = None
+        cortado = False
+        with open(_ruta_subida(upload_id), 'r+b') as archivo:
+            # Lo que haya quedado después del último offset confirmado (un PUT que se cortó) se descarta
+            archivo.seek(offset)
+            archivo.truncate()
+            try:
+                while True:
+                    bloque = request.stream.read(TAMANO_BLOQUE_SUBIDA)
+                    if not bloque:
+                        break
+                    if offset + escritos + len(bloque) > fila['tamano']:
+                        error = ('El fragmento excede el tamaño declarado del archivo', 413)
+                        break
+                    if offset + escritos == 0 and cabecera_valida(bloque[:TAMANO_CABECERA], extension) is False:
+                        error = (f'El contenido no corresponde a un archivo {extension}', 400)
+                        break
+                    archivo.write(bloque)
+                    escritos += len(bloque)
+            except ClientDisconnected:
+                # Se conserva lo recibido hasta el corte: el cliente retoma desde el nuevo offset
+                cortado = True
+            if error is not None:
+                archivo.truncate(offset)
+                escritos = 0
+        
+        recibido = offset + escritos
+        ahora = time.time()
+        _conexion_estado().execute(
+            'UPDATE subidas SET recibido = ?, actualizado = ?, expira = ? WHERE id = ?',
+            (recibido, ahora, ahora + SUBIDA_REANUDABLE_TTL_SEGUNDOS, upload_id)
+        )
+    
+    if escritos:
+        metrica_contador('extractores_bytes_subidos_total', escritos, endpoint=request.url_rule.rule)
+    if error is not None:
+        metrica_contador('extractores_subidas_reanudables_total', evento='rechazada')
+        return _respuesta_error_subida(error[0], error[1], recibido)
+    if cortado:
+        metrica_contador('extractores_subidas_reanudables_total', evento='cortada')
+        logger.info(f"Subida {upload_id}: conexión cortada en el byte {recibido}")
+        return _respuesta_error_subida('El fragmento llegó incompleto', 400, recibido)
+    metrica_contador('extractores_subidas_reanudables_total', evento='fragmento')
+    fila['recibido'] = recibido
+    return _respuesta_subida(fila)
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def completar_subida(upload_id):
+    """Verifica que el archivo esté completo y que su SHA-256 coincida con el declarado"""
+    fila = _obtener_subida(upload_id)
+    if fila is None:
+        return _subida_inexistente()
+    if fila['estado'] == 'completa':
+        return _respuesta_subida(fila)
+    
+    datos = request.get_json(silent=True) or {}
+    esperado = str(datos.get('sha256') or fila['sha256'] or '').lower()
+    if not _PATRON_SHA256.match(esperado):
+        return jsonify({'success': False, 'message': 'Falta el sha256 del archivo para verificarlo'}), 400
+    
+    with lock_entre_procesos(f'subida_{upload_id}', 5) as adquirido:
+        fila = _obtener_subida(upload_id)
+        if fila is None:
+            return _subida_inexistente()
+        if not adquirido and fcntl is not None:
+            return _respuesta_error_subida('Todavía se está recibiendo un fragmento', 409, fila['recibido'])
+        if fila['estado'] == 'completa':
+            return _respuesta_subida(fila)
+        if fila['recibido'] != fila['tamano']:
+            return _respuesta_error_subida(f'Faltan {fila["tamano"] - fila["recibido"]} bytes', 409,
+                                           fila['recibido'])
+        
+        with medidor_request().etapa('verificacion'):
+            sha256 = calcular_sha256(_ruta_subida(upload_id))
+        if sha256 != esperado:
+            # No hay forma de saber qué fragmento llegó mal: se descarta la subida entera
+            _borrar_subida(upload_id)
+            metrica_contador('extractores_subidas_reanudables_total', evento='checksum_invalido')
+            logger.warning(f"Subida {upload_id}: el SHA-256 no coincide, se descarta")
+            return jsonify({
+                'success': False,
+                'message': 'El SHA-256 del archivo recibido no coincide; hay que volver a subirlo'
+            }), 422
+        
+        ahora = time.time()
+        _conexion_estado().execute(
+            '''UPDATE subidas SET estado = 'completa', sha256 = ?, actualizado = ?, expira = ? WHERE id = ?''',
+            (sha256, ahora, ahora + SUBIDA_REANUDABLE_TTL_SEGUNDOS, upload_id)
+        )
+    metrica_contador('extractores_subidas_reanudables_total', evento='completada')
+    logger.info(f"Subida reanudable {upload_id} completa ({fila['tamano'] / 1024 / 1024:.1f} MB)")
+    return _respuesta_subida(_obtener_subida(upload_id))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancelar_subida(upload_id):
+    """Cancela una subida reanudable y borra lo recibido"""
+    if _obtener_subida(upload_id) is None:
+        return _subida_inexistente()
+    _borrar_subida(upload_id)
+    metrica_contador('extractores_subidas_reanudables_total', evento='cancelada')
+    return jsonify({'success': True, 'message': 'Subida cancelada'}), 200
+
+# ==================== FIN SUBIDAS REANUDABLES ====================
+
+# ==================== EXTRACCIÓN ASÍNCRONA ====================
+# Jobs de extracción en segundo plano (en el almacén compartido, igual que los de vencimientos)
+JOB_TIPO_EXTRACCION = 'extraccion'
+
+COLUMNAS_EXCEL_VACIO = ['Fecha', 'Origen', 'Descripcion', 'Debito', 'Credito', 'Saldo', 'Movimiento']
+
+def get_extract_job(job_id):
+    """Obtiene el estado de un job de extracción"""
+    return obtener_job(job_id, tipo=JOB_TIPO_EXTRACCION)
+
+def update_extract_job(job_id, status, progress=0, message='', error=None, **campos):
+    """Actualiza el estado de un job de extracción"""
+    actualizar_job(job_id, status, progress, message, error, **campos)
+
+def contar_paginas_pdf(pdf_path):
+    """Cuenta las páginas de un PDF sin procesarlo (None si no se puede leer). Acepta ruta o bytes"""
+    en_memoria = isinstance(pdf_path, (bytes, bytearray))
+    try:
+        fitz = importar_midiendo('fitz')
+        doc = fitz.open(stream=pdf_path, filetype='pdf') if en_memoria else fitz.open(str(pdf_path))
+        with doc:
+            return len(doc)
+    except Exception:
+        pass
+    try:
+        pdfplumber = importar_midiendo('pdfplumber')
+        with pdfplumber.open(io.BytesIO(pdf_path) if en_memoria else str(pdf_path)) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        logger.warning(f"No se pudo contar las páginas de {'PDF en memoria' if en_memoria else pdf_path}: {e}")
+        return None
+
+def acepta_parametro(funcion, nombre):
+    """Indica si una función extractora acepta un parámetro opcional (ej: progress_callback)"""
+    try:
+        return nombre in inspect.signature(funcion).parameters
+    except (TypeError, ValueError):
+        return False
+
+def crear_excel_vacio(excel_path):
+    """Crea un Excel vacío con las columnas estándar de los extractores"""
+    df_vacio = pd.DataFrame(columns=COLUMNAS_EXCEL_VACIO)
+    df_vacio.to_excel(str(excel_path), index=False)
+
+def registrador_extractor(nombre_logger):
+    """Función log(mensaje, nivel='info', **campos) que se le pasa a los extractores que la aceptan"""
+    registrador = logging.getLogger(nombre_logger)
+    def log(mensaje, nivel='info', **campos):
+        registrador.log(logging.getLevelName(nivel.upper()), mensaje, extra={'campos': campos})
+    return log
+
+def ejecutar_extractor(banco_id, extractor_function, pdf_path, excel_path, progress_callback=None, medidor=None):
+    """Ejecuta la función extractora y devuelve el DataFrame resultante (vacío si falla).
+    Con excel_path=None no se genera Excel (el resultado se serializa en otro formato)"""
+    if excel_path is None:
+        if not BANCO_EXTRACTORS[banco_id].get('excel_requerido'):
+            return _llamar_extractor(banco_id, extractor_function, pdf_path, None, progress_callback, medidor)
+        descartable = TEMP_DIR / f'.{uuid.uuid4().hex}_descartable.xlsx'
+        try:
+            return _llamar_extractor(banco_id, extractor_function, pdf_path, descartable, progress_callback, medidor)
+        finally:
+            descartable.unlink(missing_ok=True)
+    
+    df = _llamar_extractor(banco_id, extractor_function, pdf_path, excel_path, progress_callback, medidor)
+    
+    # Verificar que se generó el archivo Excel
+    if not excel_path.exists():
+        logger.warning(f"El archivo Excel no se generó en: {excel_path}")
+        # Intentar crear un Excel vacío
+        try:
+            crear_excel_vacio(excel_path)
+            logger.info(f"Excel vacío creado como fallback")
+        except Exception as e:
+            logger.error(f"Error creando Excel vacío: {str(e)}")
+            raise RuntimeError('No se pudo generar el archivo Excel')
+    
+    return df
+
+def _llamar_extractor(banco_id, extractor_function, pdf_path, excel_path, progress_callback, medidor):
+    """Llama a la función extractora con los parámetros opcionales que acepte"""
+    logger.info(f"Extrayendo datos de {banco_id}...")
+    medidor = medidor or MedidorTiempos()
+    kwargs = {}
+    if progress_callback and acepta_parametro(extractor_function, 'progress_callback'):
+        kwargs['progress_callback'] = progress_callback
+    if acepta_parametro(extractor_function, 'medir_etapa'):
+        # Las etapas internas del extractor quedan como extractor.<nombre>
+        kwargs['medir_etapa'] = lambda nombre: medidor.etapa(f'extractor.{nombre}')
+    nombre_logger = f'extractores.{banco_id}'
+    if acepta_parametro(extractor_function, 'log'):
+        kwargs['log'] = registrador_extractor(nombre_logger)
+    
+    df = None
+    try:
+        # Llamar a la función extractora; lo que imprima va al log con el id de correlación
+        with medidor.etapa('extractor'), capturar_salida(nombre_logger):
+            result = extractor_function(str(pdf_path), str(excel_path) if excel_path else None, **kwargs)
+        
+        # Verificar el resultado
+        if result is None:
+            logger.warning(f"El extractor retornó None para {banco_id}")
+            df = pd.DataFrame()
+        elif isinstance(result, pd.DataFrame):
+            df = result
+        else:
+            logger.warning(f"El extractor retornó un tipo inesperado: {type(result)}")
+            df = pd.DataFrame()
+            
+    except MemoryError:
+        # El proceso del pool superó su techo de memoria: se informa y el proceso se reemplaza
+        raise
+    except Exception as extract_error:
+        logger.error(f"Error durante la extracción: {str(extract_error)}", exc_info=True)
+        # Crear un DataFrame vacío para evitar que el servidor falle completamente
+        df = pd.DataFrame()
+    
+    return df
+
+# ==================== DETECCIÓN DE BANCO ====================
+# Con banco=auto, /extract (y el lote) identifican el banco antes de extraer: elegir mal el banco
+# cuesta una corrida completa de Camelot que termina en "No se pudieron extraer datos del PDF".
+# Se leen con PyMuPDF solo las primeras DETECCION_PAGINAS páginas y se puntúan señales por banco:
+# metadatos del PDF (producer, creator, título), el encabezado de la primera página (donde está
+# el logo/nombre del banco), el código de entidad del CBU/CVU, frases del layout de sus
+# resúmenes y el texto general. El resultado se guarda por SHA-256 del PDF en el almacén compartido.
+DETECCION_PAGINAS = int(os.environ.get('DETECCION_PAGINAS', '2'))
+DETECCION_CONFIANZA_MINIMA = float(os.environ.get('DETECCION_CONFIANZA_MINIMA', '0.5'))
+DETECCION_CACHE_TTL_SEGUNDOS = int(os.environ.get('DETECCION_CACHE_TTL_SEGUNDOS', str(7 * 24 * 3600)))
+BANCO_AUTOMATICO = 'auto'
+
+# Puntaje por señal encontrada según dónde aparece
+PESOS_DETECCION = {
+    'metadatos': 3,
+    'encabezado': 3,
+    'cbu': 4,
+    'layout': 2,
+    'texto': 1,
+}
+# Puntaje a partir del cual una señal sin competencia da confianza plena
+DETECCION_PUNTAJE_PLENO = 6
+# Palabras que cuentan como máximo por banco y por región (un nombre repetido en cada renglón no suma)
+DETECCION_MAX_PALABRAS_REGION = 2
+
+# Texto en minúsculas y sin acentos. 'cbu' son prefijos del CBU/CVU (código de entidad del BCRA)
+FIRMAS_BANCOS = {
+    'mercado_pago': {'palabras': ['mercado pago', 'mercadopago', 'mercado libre'], 'cbu': ['0000003']},
+    'banco_galicia_mas': {
+        'palabras': ['banco galicia mas', 'galicia mas', 'hsbc'],
+        'cbu': ['150'],
+        'layout': [r'detalle de operaciones']
+    },
+    'banco_galicia': {'palabras': ['banco galicia', 'banco de galicia', 'galicia'], 'cbu': ['007']},
+    'banco_santander': {'palabras': ['santander', 'santander rio'], 'cbu': ['072']},
+    'banco_macro': {
+        'palabras': ['banco macro', 'macro'],
+        'cbu': ['285'],
+        'layout': [r'fecha\s+descripcion\s+.{0,40}debitos', r'total cobrado']
+    },
+    'banco_bbva': {'palabras': ['bbva', 'bbva frances', 'banco frances'], 'cbu': ['017']},
+    'banco_credicoop': {'palabras': ['credicoop', 'banco credicoop'], 'cbu': ['191']},
+    'banco_nacion': {'palabras': ['banco de la nacion', 'banco nacion', 'nacion argentina'], 'cbu': ['011']},
+    'banco_ciudad': {'palabras': ['banco ciudad', 'ciudad de buenos aires'], 'cbu': ['029']},
+    'banco_icbc': {'palabras': ['icbc'], 'cbu': ['015'], 'layout': [r'tot\.\s?imp\.\s?ley']},
+    'banco_supervielle': {'palabras': ['supervielle'], 'cbu': ['027']},
+    'banco_comafi': {
+        'palabras': ['comafi', 'banco comafi'],
+        'cbu': ['299'],
+        'layout': [r'fecha\s+conceptos\s+referencias\s+debitos\s+creditos\s+saldo']
+    },
+    'banco_jpmorgan': {'palabras': ['jpmorgan', 'jp morgan', 'j.p. morgan'], 'layout': [r'total db']},
+    'banco_bind': {
+        'palabras': ['bind', 'banco industrial'],
+        'cbu': ['322'],
+        'layout': [r'fecha\s+detalle\s+referencia\s+debitos\s+creditos\s+saldo']
+    },
+    'banco_cmf': {'palabras': ['banco cmf', 'cmf'], 'cbu': ['319']},
+    'banco_cabal': {
+        'palabras': ['cabal'],
+        'layout': [r'ventas correspondientes a (cabal debito|tarjeta de credito)']
+    },
+    'banco_del_sol': {'palabras': ['banco del sol'], 'cbu': ['310']},
+    'colppy': {'palabras': ['colppy']},
+}
+
+_PATRONES_PALABRAS = {
+    banco: [(palabra, re.compile(r'(?<!\w)' + re.escape(palabra) + r'(?!\w)')) for palabra in firma.get('palabras', [])]
+    for banco, firma in FIRMAS_BANCOS.items()
+}
+_PATRONES_LAYOUT = {
+    banco: [(patron, re.compile(patron)) for patron in firma.get('layout', [])]
+    for banco, firma in FIRMAS_BANCOS.items()
+}
+_PATRON_CBU = re.compile(r'(?<!\w)(?:cbu|cvu)(?!\w)\D{0,30}?((?:\d[ -]?){21}\d)')
+
+# Si cambian las firmas o los pesos, las detecciones guardadas dejan de valer
+VERSION_DETECCION = hashlib.sha256(
+    json.dumps([FIRMAS_BANCOS, PESOS_DETECCION, DETECCION_PAGINAS], sort_keys=True).encode('utf-8')
+).hexdigest()[:12]
+
+ESQUEMAS_ESTADO.append('''
+    CREATE TABLE IF NOT EXISTS deteccion_bancos (
+        pdf_sha256 TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        resultado TEXT NOT NULL,
+        creado REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_deteccion_creado ON deteccion_bancos (creado);
+''')
+
+def _normalizar_texto(texto):
+    """Minúsculas, sin acentos y con los espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'[ \t]+', ' ', texto.lower())
+
+def _muestra_pdf(fuente):
+    """Metadatos, encabezado de la primera página y texto de las primeras páginas (fuente: ruta o bytes)"""
+    en_memoria = isinstance(fuente, (bytes, bytearray))
+    try:
+        fitz = importar_midiendo('fitz')
+    except ImportError:
+        fitz = None
+    
+    if fitz is not None:
+        doc = fitz.open(stream=fuente, filetype='pdf') if en_memoria else fitz.open(str(fuente))
+        with doc:
+            metadatos = ' '.join(v for v in (doc.metadata or {}).values() if isinstance(v, str))
+            paginas = [doc[i] for i in range(min(DETECCION_PAGINAS, len(doc)))]
+            encabezado = ''
+            if paginas:
+                # El cuarto superior de la primera página: logo, nombre del banco y datos de la cuenta
+                r = paginas[0].rect
+                encabezado = paginas[0].get_text('text', clip=fitz.Rect(r.x0, r.y0, r.x1, r.y0 + r.height / 4))
+            texto = '\n'.join(pagina.get_text('text') for pagina in paginas)
+    else:
+        pdfplumber = importar_midiendo('pdfplumber')
+        with pdfplumber.open(io.BytesIO(fuente) if en_memoria else str(fuente)) as pdf:
+            metadatos = ' '.join(v for v in (pdf.metadata or {}).values() if isinstance(v, str))
+            paginas = pdf.pages[:DETECCION_PAGINAS]
+            encabezado = ''
+            if paginas:
+                primera = paginas[0]
+                encabezado = primera.crop((0, 0, primera.width, primera.height / 4)).extract_text() or ''
+            texto = '\n'.join(pagina.extract_text() or '' for pagina in paginas)
+    
+    return {
+        'metadatos': _normalizar_texto(metadatos),
+        'encabezado': _normalizar_texto(encabezado),
+        'texto': _normalizar_texto(texto)
+    }
+
+def _palabras_encontradas(texto):
+    """{banco: [palabras]} presentes en el texto. Una coincidencia que se superpone con una más larga
+    de otro banco no cuenta (ej: 'banco galicia' dentro de 'banco galicia mas')"""
+    coincidencias = []
+    for banco, patrones in _PATRONES_PALABRAS.items():
+        for palabra, patron in patrones:
+            for m in patron.finditer(texto):
+                coincidencias.append((m.start(), m.end(), banco, palabra))
+    
+    encontradas = {}
+    for inicio, fin, banco, palabra in coincidencias:
+        tapada = any(
+            otro != banco and otro_fin - otro_inicio > fin - inicio and otro_inicio < fin and inicio < otro_fin
+            for otro_inicio, otro_fin, otro, _ in coincidencias
+        )
+        if not tapada and palabra not in encontradas.setdefault(banco, []):
+            encontradas[banco].append(palabra)
+    return encontradas
+
+def puntuar_bancos(muestra):
+    """Puntaje y señales de cada banco con alguna coincidencia, de mayor a menor"""
+    puntajes = {}
+    
+    def sumar(banco, region, detalle):
+        entrada = puntajes.setdefault(banco, {'banco': banco, 'puntaje': 0, 'senales': []})
+        entrada['puntaje'] += PESOS_DETECCION[region]
+        entrada['senales'].append(f'{region}:{detalle}')
+    
+    for region in ('metadatos', 'encabezado', 'texto'):
+        for banco, palabras in _palabras_encontradas(muestra[region]).items():
+            for palabra in palabras[:DETECCION_MAX_PALABRAS_REGION]:
+                sumar(banco, region, palabra)
+    
+    for banco, patrones in _PATRONES_LAYOUT.items():
+        for patron, compilado in patrones:
+            if compilado.search(muestra['texto']):
+                sumar(banco, 'layout', patron)
+    
+    cbus = {re.sub(r'\D', '', m.group(1)) for m in _PATRON_CBU.finditer(muestra['texto'])}
+    for banco, firma in FIRMAS_BANCOS.items():
+        prefijos = [p for p in firma.get('cbu', []) if any(cbu.startswith(p) for cbu in cbus)]
+        if prefijos:
+            sumar(banco, 'cbu', prefijos[0])
+    
+    return sorted(puntajes.values(), key=lambda entrada: entrada['puntaje'], reverse=True)
+
+def _confianza(candidatos):
+    """0 a 1: crece con el puntaje del primero y baja si el segundo está cerca"""
+    if not candidatos:
+        return 0.0
+    mejor = candidatos[0]['puntaje']
+    segundo = candidatos[1]['puntaje'] if len(candidatos) > 1 else 0
+    fuerza = min(1.0, mejor / DETECCION_PUNTAJE_PLENO)
+    margen = (mejor - segundo) / mejor
+    return round(fuerza * (0.5 + 0.5 * margen), 2)
+
+def detectar_banco_detalle(fuente, pdf_sha256=None):
+    """Detecta el banco de un PDF (ruta o bytes). Devuelve {'banco', 'confianza', 'candidatos', 'cache'};
+    banco es None si no hay coincidencias o la confianza no llega a DETECCION_CONFIANZA_MINIMA"""
+    if pdf_sha256:
+        fila = _conexion_estado().execute(
+            'SELECT resultado FROM deteccion_bancos WHERE pdf_sha256 = ? AND version = ?',
+            (pdf_sha256, VERSION_DETECCION)
+        ).fetchone()
+        if fila is not None:
+            metrica_contador('extractores_deteccion_total', resultado='cache')
+            return {**json.loads(fila['resultado']), 'cache': True}
+    
+    try:
+        muestra = _muestra_pdf(fuente)
+    except Exception as e:
+        logger.warning(f"No se pudo leer el PDF para detectar el banco: {e}")
+        return {'banco': None, 'confianza': 0.0, 'candidatos': [], 'cache': False}
+    
+    candidatos = puntuar_bancos(muestra)[:3]
+    confianza = _confianza(candidatos)
+    banco = candidatos[0]['banco'] if candidatos and confianza >= DETECCION_CONFIANZA_MINIMA else None
+    # Solo se proponen bancos con extractor (las firmas pueden estar por delante del registro)
+    if banco not in BANCO_EXTRACTORS:
+        banco = None
+    resultado = {'banco': banco, 'confianza': confianza, 'candidatos': candidatos}
+    metrica_contador('extractores_deteccion_total', resultado='detectado' if banco else 'dudoso')
+    logger.info(f"Detección de banco: {banco or 'sin resultado'} (confianza {confianza}, "
+                f"candidatos {[c['banco'] for c in candidatos]})")
+    
+    if pdf_sha256:
+        ahora = time.time()
+        with _TransaccionEstado() as conn:
+            conn.execute('DELETE FROM deteccion_bancos WHERE creado < ?', (ahora - DETECCION_CACHE_TTL_SEGUNDOS,))
+            conn.execute(
+                'INSERT OR REPLACE INTO deteccion_bancos (pdf_sha256, version, resultado, creado) VALUES (?, ?, ?, ?)',
+                (pdf_sha256, VERSION_DETECCION, json.dumps(resultado), ahora)
+            )
+    return {**resultado, 'cache': False}
+
+def detectar_banco_subida(archivo):
+    """Detecta el banco de un archivo subido sin escribirlo en su destino (usa el sha256 ya calculado)"""
+    stream = archivo.stream
+    if isinstance(stream, ArchivoSubida):
+        return detectar_banco_detalle(stream.ruta_temporal or stream.contenido(), stream.sha256)
+    archivo.stream.seek(0)
+    contenido = archivo.stream.read()
+    archivo.stream.seek(0)
+    return detectar_banco_detalle(contenido, hashlib.sha256(contenido).hexdigest())
+
+def respuesta_deteccion_dudosa(deteccion):
+    """422 cuando banco=auto no alcanza la confianza mínima: se devuelven los candidatos para elegir"""
+    return jsonify({
+        'success': False,
+        'message': 'No se pudo identificar el banco del PDF con suficiente confianza. Elige el banco manualmente.',
+        'deteccion': deteccion
+    }), 422
+
+@app.route('/extract/detect', methods=['POST'])
+def extract_detect():
+    """Detecta el banco de un PDF sin extraerlo (para preseleccionarlo en el frontend)"""
+    try:
+        try:
+            pdf_file = archivo_de_request('pdf')
+            if pdf_file is None:
+                return jsonify({'success': False, 'message': 'No se recibió ningún archivo PDF'}), 400
+            validar_subida(pdf_file, '.pdf')
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        
+        with medidor_request().etapa('deteccion'):
+            deteccion = detectar_banco_subida(pdf_file)
+        return jsonify({'success': deteccion['banco'] is not None, 'deteccion': deteccion}), 200
+    except Exception as e:
+        logger.error(f"Error detectando el banco: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== FIN DETECCIÓN DE BANCO ====================
+
+# ==================== FORMATOS DE SALIDA ====================
+# /extract?format=json|csv|parquet|xlsx. El Excel lo escribe cada extractor con openpyxl (a veces dos
+# veces la misma hoja) y suele ser la etapa más lenta; para los otros formatos no se genera: el
+# DataFrame que devuelve el extractor se serializa directo. json va en la respuesta, csv y parquet
+# quedan para descargar como el Excel.
+FORMATOS_SALIDA = ('xlsx', 'json', 'csv', 'parquet')
+FORMATO_SALIDA_DEFECTO = 'xlsx'
+
+MIMETYPES_DESCARGA = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.zip': 'application/zip',
+    '.csv': 'text/csv; charset=utf-8',
+    '.parquet': 'application/vnd.apache.parquet',
+}
+
+class ErrorFormato(Exception):
+    """Formato de salida no soportado o no disponible en este servidor"""
+
+def formato_salida():
+    """Formato pedido en ?format= (xlsx si no se indica)"""
+    formato = request.args.get('format', FORMATO_SALIDA_DEFECTO).strip().lower()
+    if formato not in FORMATOS_SALIDA:
+        raise ErrorFormato(f'Formato no soportado: {formato}. Opciones: {", ".join(FORMATOS_SALIDA)}')
+    if formato == 'parquet' and not any(importlib.util.find_spec(m) for m in ('pyarrow', 'fastparquet')):
+        raise ErrorFormato('El formato parquet no está disponible en este servidor (falta pyarrow)')
+    return formato
+
+def serializar_resultado(df, formato, destino):
+    """Escribe el DataFrame en destino (ruta o buffer binario) como csv o parquet"""
+    if formato == 'csv':
+        # utf-8-sig para que Excel reconozca los acentos al abrir el CSV
+        df.to_csv(destino, index=False, encoding='utf-8-sig')
+    elif formato == 'parquet':
+        # Las columnas object pueden mezclar tipos (ej: montos y textos): se guardan como texto
+        mixtas = [c for c in df.columns if df[c].dtype == object]
+        df.astype({c: 'string' for c in mixtas}).to_parquet(destino, index=False)
+    else:
+        raise ValueError(f'Formato sin archivo: {formato}')
+
+def entrega_directa():
+    """?download=1: el resultado va en el cuerpo de la respuesta en lugar de un downloadUrl"""
+    return request.args.get('download', '').lower() in ('1', 'true', 'yes')
+
+def respuesta_archivo_resultado(df, formato, filename, excel_path=None, medidor=None):
+    """Responde con el resultado serializado en un buffer en memoria (el Excel se lee del archivo
+    de trabajo que escribió el extractor)"""
+    medidor = medidor or MedidorTiempos()
+    logger.info(f"Extracción completada: {len(df)} filas extraídas, entregadas como {formato}")
+    buffer = io.BytesIO()
+    with medidor.etapa('serializacion'):
+        if formato == 'xlsx':
+            buffer.write(Path(excel_path).read_bytes())
+        else:
+            serializar_resultado(df, formato, buffer)
+    buffer.seek(0)
+    respuesta = send_file(
+        buffer,
+        mimetype=MIMETYPES_DESCARGA[f'.{formato}'],
+        as_attachment=True,
+        download_name=Path(filename).with_suffix(f'.{formato}').name
+    )
+    respuesta.headers['X-Rows'] = str(len(df))
+    return respuesta
+
+def filas_json(df):
+    """Filas del DataFrame listas para jsonify (NaN -> null, fechas en ISO 8601)"""
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False))
+
+def respuesta_extraccion(banco_id, df, excel_filename, base_url, desde_cache=False, medidor=None,
+                         formato=FORMATO_SALIDA_DEFECTO):
+    """Arma la respuesta JSON de una extracción terminada. Devuelve (payload, status_code)"""
+    # Obtener información del resultado
+    rows = len(df) if df is not None and hasattr(df, '__len__') and not df.empty else 0
+    logger.info(f"Extracción completada: {rows} filas extraídas")
+    medidor = medidor or MedidorTiempos()
+    
+    # Si no se extrajeron datos, informar al usuario
+    if rows == 0:
+        logger.warning(f"No se extrajeron datos del PDF de {banco_id}")
+        return {
+            'success': False,
+            'message': 'No se pudieron extraer datos del PDF. Verifica que el formato sea correcto.',
+            'timings': medidor.como_dict()
+        }, 200
+    
+    payload = {
+        'success': True,
+        'message': 'Extracción completada exitosamente',
+        'format': formato,
+        'rows': rows,
+        'cache': desde_cache
+    }
+    if formato == 'json':
+        with medidor.etapa('serializacion'):
+            payload['data'] = filas_json(df)
+    else:
+        filename = excel_filename
+        if formato != 'xlsx':
+            filename = Path(excel_filename).with_suffix(f'.{formato}').name
+            with medidor.etapa('serializacion'):
+                serializar_resultado(df, formato, TEMP_DIR / filename)
+        payload['filename'], payload['downloadUrl'] = publicar_resultado(TEMP_DIR / filename, base_url, medidor=medidor)
+    
+    payload['timings'] = medidor.como_dict()
+    logger.info(f"Tiempos de {banco_id}: {medidor.server_timing()}")
+    return payload, 200
+
+def ejecutar_extraccion_job(job_id, banco_id, pdf_path, excel_path, excel_filename, base_url,
+                            pdf_sha256=None, total_paginas=None, ticket_admision=None,
+                            formato=FORMATO_SALIDA_DEFECTO):
+    """Ejecuta una extracción en segundo plano y va reportando el progreso por página"""
+    medidor = MedidorTiempos()
+    try:
+        if total_paginas is None:
+            total_paginas = contar_paginas_pdf(pdf_path)
+        update_extract_job(
+            job_id, 'processing', 5,
+            f'Procesando PDF ({total_paginas} páginas)...' if total_paginas else 'Procesando PDF...',
+            paginas_total=total_paginas,
+            paginas_procesadas=0
+        )
+        
+        def progress_callback(pagina, total):
+            total = total or total_paginas or pagina
+            progreso = 5 + int(85 * min(pagina, total) / total)
+            update_extract_job(
+                job_id, 'processing', progreso,
+                f'Página {pagina} de {total} procesada',
+                paginas_total=total,
+                paginas_procesadas=pagina
+            )
+        
+        df, desde_cache = extraer_con_cache(banco_id, pdf_path, excel_path, progress_callback, pdf_sha256, medidor,
+                                            total_paginas)
+        
+        update_extract_job(job_id, 'processing', 95, 'Finalizando...')
+        payload, status_code = respuesta_extraccion(banco_id, df, excel_filename, base_url, desde_cache, medidor,
+                                                    formato)
+        update_extract_job(
+            job_id, 'completed', 100, payload['message'],
+            paginas_procesadas=total_paginas,
+            resultado=payload,
+            resultado_status=status_code
+        )
+    except ErrorExtraccion as e:
+        logger.error(f"Error en job de extracción {job_id}: {e.mensaje}")
+        update_extract_job(job_id, 'error', 0, e.mensaje, e.tipo)
+    except Exception as e:
+        logger.error(f"Error en job de extracción {job_id}: {str(e)}", exc_info=True)
+        update_extract_job(job_id, 'error', 0, f'Error al procesar el PDF: {str(e)}', str(e))
+    finally:
+        liberar_admision(ticket_admision)
+        # Limpiar el PDF temporal
+        if pdf_path.exists():
+            try:
+                pdf_path.unlink()
+            except Exception as e:
+                logger.warning(f"Error al eliminar PDF temporal: {e}")
+
+def iniciar_extraccion_async(banco_id, pdf_path, excel_path, excel_filename, base_url,
+                             pdf_sha256=None, total_paginas=None, ticket_admision=None,
+                             formato=FORMATO_SALIDA_DEFECTO):
+    """Crea un job de extracción y lo lanza en un thread. Devuelve el job_id"""
+    job, _ = crear_job(JOB_TIPO_EXTRACCION, banco=banco_id, paginas_total=total_paginas, paginas_procesadas=0)
+    job_id = job['id']
+    
+    logger.info(f"Iniciando extracción asíncrona de {banco_id} con job_id: {job_id}")
+    iniciar_thread(ejecutar_extraccion_job, job_id, banco_id, pdf_path, excel_path, excel_filename, base_url,
+                   pdf_sha256, total_paginas, ticket_admision, formato)
+    return job_id
+
+def es_modo_async():
+    """Indica si el request pidió procesamiento asíncrono (?async=1)"""
+    valor = request.args.get('async') or request.form.get('async') or ''
+    return valor.lower() in ('1', 'true', 'yes', 'si')
+
+@app.route('/extract', methods=['POST'])
+@idempotente
+def extract():
+    """Endpoint principal para extraer datos (con ?async=1 devuelve un job_id inmediatamente).
+    ?format=json|csv|parquet|xlsx elige el formato del resultado (xlsx por defecto) y
+    ?download=1 devuelve el archivo en la respuesta en lugar de un downloadUrl"""
+    try:
+        try:
+            formato = formato_salida()
+        except ErrorFormato as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        # Validar que se recibió el archivo (o el upload_id de una subida reanudable) y el banco
+        try:
+            pdf_file = archivo_de_request('pdf')
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        if pdf_file is None:
+            return jsonify({'success': False, 'message': 'No se recibió ningún archivo PDF'}), 400
+        
+        if 'banco' not in request.form:
+            return jsonify({'success': False, 'message': 'No se especificó el banco'}), 400
+        
+        banco_id = request.form['banco']
+        
+        # Validar que el banco existe (banco=auto lo detecta a partir del PDF)
+        if banco_id not in BANCO_EXTRACTORS and banco_id != BANCO_AUTOMATICO:
+            return jsonify({'success': False, 'message': f'Banco no soportado: {banco_id}'}), 400
+        
+        medidor = medidor_request()
+        
+        # Validar firma y cantidad de páginas antes de escribir el PDF en su destino
+        try:
+            with medidor.etapa('validacion'):
+                total_paginas = validar_subida(pdf_file, '.pdf')
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        
+        deteccion = None
+        if banco_id == BANCO_AUTOMATICO:
+            with medidor.etapa('deteccion'):
+                deteccion = detectar_banco_subida(pdf_file)
+            if deteccion['banco'] is None:
+                return respuesta_deteccion_dudosa(deteccion)
+            banco_id = deteccion['banco']
+        
+        # Guardar el PDF temporalmente
+        pdf_filename = f"{banco_id}_{pdf_file.filename}"
+        # Limpiar nombre de archivo (remover caracteres problemáticos)
+        pdf_filename = pdf_filename.replace(' ', '_').replace('/', '_').replace('\\', '_')
+        # Prefijo único del request: dos uploads con el mismo nombre no deben pisarse el PDF ni los
+        # resultados (Excel, CSV, Parquet) mientras se procesan o se descargan.
+        # El PDF es un archivo de trabajo: va a tmpfs si hay lugar. Una subida reanudable ya está en
+        # disco y se enlaza en TEMP_DIR sin copiarla
+        prefijo = uuid.uuid4().hex
+        tamano_pdf = pdf_file.stream.bytes if isinstance(pdf_file.stream, ArchivoSubida) else 0
+        directorio_pdf = TEMP_DIR if isinstance(pdf_file.stream, SubidaCompleta) else directorio_trabajo(tamano_pdf)
+        pdf_path = directorio_pdf / f"{prefijo}_{pdf_filename}"
+        
+        # Asegurar que el directorio existe
+        TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        
+        # Guardar archivo (el hash ya se calculó mientras se subía)
+        with medidor.etapa('guardado_pdf'):
+            pdf_sha256 = guardar_subida(pdf_file, pdf_path)
+        logger.info(f"PDF guardado temporalmente en: {pdf_path}")
+        
+        # Generar nombre del archivo Excel de salida (en otros formatos solo se usa el nombre).
+        # CSV y Parquet toman el mismo nombre con otra extensión, así que heredan el prefijo
+        nombre_resultado = f"{Path(pdf_filename).stem}_extraido.xlsx"
+        excel_filename = f"{prefijo}_{nombre_resultado}"
+        excel_path = TEMP_DIR / excel_filename if formato == 'xlsx' else None
+        # Si el Excel se devuelve en la respuesta no hace falta dejarlo para descargar: es de trabajo
+        directo = entrega_directa() and not es_modo_async() and formato != 'json'
+        if directo and excel_path is not None:
+            excel_path = directorio_trabajo(tamano_pdf) / excel_filename
+        
+        # En modo asíncrono el thread del job se encarga de borrar el PDF y liberar la admisión
+        pdf_delegado = False
+        ticket_admision = None
+        
+        try:
+            base_url = request.host_url.rstrip('/')
+            
+            # Si el servidor ya tiene demasiado trabajo en curso se rechaza con 429
+            try:
+                ticket_admision = admitir_trabajo('extraccion', costo_extraccion(banco_id, total_paginas, pdf_sha256))
+            except ErrorAdmision as e:
+                return respuesta_admision_rechazada(e)
+            
+            if es_modo_async():
+                job_id = iniciar_extraccion_async(banco_id, pdf_path, excel_path, excel_filename, base_url,
+                                                  pdf_sha256, total_paginas, ticket_admision, formato)
+                pdf_delegado = True
+                respuesta = {
+                    'success': True,
+                    'job_id': job_id,
+                    'message': 'Extracción iniciada en segundo plano',
+                    'statusUrl': f'{base_url}/extract/status/{job_id}',
+                    'resultUrl': f'{base_url}/extract/result/{job_id}',
+                    'eventsUrl': f'{base_url}/jobs/{job_id}/events'
+                }
+                if deteccion is not None:
+                    respuesta['deteccion'] = deteccion
+                return jsonify(respuesta), 202
+            
+            # Ejecutar la extracción en el pool de procesos (o devolverla de la caché)
+            try:
+                df, desde_cache = extraer_con_cache(banco_id, pdf_path, excel_path, pdf_sha256=pdf_sha256,
+                                                    medidor=medidor, total_paginas=total_paginas)
+            except ErrorExtraccion as e:
+                return jsonify({
+                    'success': False,
+                    'message': e.mensaje
+                }), e.status_code
+            
+            # Con ?download=1 el resultado se serializa en memoria y va en el cuerpo de la respuesta
+            if directo and df is not None and not df.empty:
+                return respuesta_archivo_resultado(df, formato, nombre_resultado, excel_path, medidor)
+            payload, status_code = respuesta_extraccion(banco_id, df, excel_filename, base_url, desde_cache, medidor,
+                                                        formato)
+            if deteccion is not None:
+                payload['deteccion'] = deteccion
+            return jsonify(payload), status_code
             
         except Exception as e:
             logger.error(f"Error durante la extracción: {str(e)}", exc_info=True)
@@ -1695,157 +5223,884 @@ def extract():
             }), 500
         
         finally:
+            if not pdf_delegado:
+                liberar_admision(ticket_admision)
+            if directo and excel_path is not None:
+                excel_path.unlink(missing_ok=True)
             # Limpiar el PDF temporal
-            if pdf_path.exists():
+            if not pdf_delegado and pdf_path.exists():
                 try:
                     pdf_path.unlink()
                 except Exception as e:
-                    print(f"Error al eliminar PDF temporal: {e}")
+                    logger.warning(f"Error al eliminar PDF temporal: {e}")
+    
+    except Exception as e:
+        logger.error(f"Error general: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'message': f'Error del servidor: {str(e)}'
+        }), 500
+
+@app.route('/extract/status/<job_id>', methods=['GET'])
+def extract_status(job_id):
+    """Consulta el estado y progreso de un job de extracción"""
+    try:
+        job = get_extract_job(job_id)
+        
+        if not job:
+            logger.warning(f"Job de extracción {job_id} no encontrado")
+            return jsonify({
+                'success': False,
+                'message': f'Job no encontrado: {job_id}'
+            }), 404
+        
+        # El resultado completo se consulta en /extract/result/<job_id>
+        job.pop('resultado', None)
+        job.pop('resultado_status', None)
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error consultando estado de job de extracción: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'message': f'Error al consultar estado: {str(e)}'
+        }), 500
+
+@app.route('/extract/result/<job_id>', methods=['GET'])
+def extract_result(job_id):
+    """Devuelve el resultado de un job de extracción terminado"""
+    try:
+        job = get_extract_job(job_id)
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'message': f'Job no encontrado: {job_id}'
+            }), 404
+        
+        if job.get('status') == 'error':
+            return jsonify({
+                'success': False,
+                'message': job.get('message') or 'Error al procesar el PDF',
+                'error': job.get('error')
+            }), 500
+        
+        if job.get('status') != 'completed':
+            # Todavía en proceso: 202 para que el cliente siga consultando
+            return jsonify({
+                'success': False,
+                'status': job.get('status'),
+                'progress': job.get('progress'),
+                'message': 'La extracción todavía está en proceso'
+            }), 202
+        
+        return jsonify(job.get('resultado') or {}), job.get('resultado_status') or 200
+        
+    except Exception as e:
+        logger.error(f"Error obteniendo resultado de job de extracción: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'message': f'Error al obtener resultado: {str(e)}'
+        }), 500
+
+# ==================== FIN EXTRACCIÓN ASÍNCRONA ====================
+
+# ==================== EXTRACCIÓN POR LOTES ====================
+# Varios PDFs (o un ZIP) en un solo request, procesados en paralelo en el pool de
+# procesos. El resultado es un ZIP con un Excel por resumen más un consolidado.
+JOB_TIPO_LOTE = 'lote'
+LOTE_MAX_ARCHIVOS = int(os.environ.get('LOTE_MAX_ARCHIVOS', '100'))
+# Tope de lo que puede ocupar un ZIP descomprimido (cada PDF además respeta UPLOAD_MAX_MB)
+LOTE_DESCOMPRIMIDO_MAX_MB = int(os.environ.get('LOTE_DESCOMPRIMIDO_MAX_MB', str(UPLOAD_MAX_MB * 10)))
+
+# Palabras clave del encabezado para detectar el banco cuando no se indica
+def _nombre_seguro(nombre):
+    """Limpia un nombre de archivo (sin rutas ni caracteres problemáticos)"""
+    nombre = Path(nombre.replace('\\', '/')).name
+    return nombre.replace(' ', '_')
+
+def _bancos_por_archivo():
+    """Lee el banco de cada archivo del form: 'bancos' (JSON nombre->banco o lista) y 'banco' por defecto"""
+    banco_defecto = request.form.get('banco') or 'auto'
+    bancos = request.form.get('bancos')
+    if not bancos:
+        return banco_defecto, {}, []
+    bancos = json.loads(bancos)
+    if isinstance(bancos, dict):
+        return banco_defecto, {_nombre_seguro(k): v for k, v in bancos.items()}, []
+    return banco_defecto, {}, list(bancos)
+
+def _pdfs_del_zip(zf):
+    """Miembros PDF del ZIP como [(nombre, info)], verificando los tamaños declarados antes de
+    descomprimir nada. zipfile no entrega más bytes que los que declara file_size"""
+    miembros = []
+    total = 0
+    for info in zf.infolist():
+        nombre = _nombre_seguro(info.filename)
+        if info.is_dir() or not nombre.lower().endswith('.pdf') or nombre.startswith('.'):
+            continue
+        if info.file_size > UPLOAD_MAX_MB * 1024 * 1024:
+            raise ErrorSubida(f'{nombre}: supera el tamaño máximo permitido ({UPLOAD_MAX_MB} MB)', 413)
+        total += info.file_size
+        miembros.append((nombre, info))
+    
+    if total > LOTE_DESCOMPRIMIDO_MAX_MB * 1024 * 1024:
+        raise ErrorSubida(f'El ZIP descomprimido ocupa {total / 1024 / 1024:.0f} MB; '
+                          f'el máximo es {LOTE_DESCOMPRIMIDO_MAX_MB} MB', 413)
+    return miembros
+
+def _validar_pdf_lote(archivo, nombre):
+    """Misma validación que /extract (firma, que abra y páginas), con el nombre en el mensaje.
+    Devuelve la cantidad de páginas"""
+    try:
+        return validar_subida(archivo, '.pdf')
+    except ErrorSubida as e:
+        raise ErrorSubida(f'{nombre}: {e.mensaje}', e.status_code)
+
+def guardar_archivos_lote(lote_dir):
+    """Guarda en lote_dir los PDFs del request (ZIP o lista de archivos). Devuelve [(nombre, ruta, paginas)].
+    Lanza ErrorSubida (sin guardar nada más) si el lote o alguno de sus PDFs no es válido"""
+    archivos = []
+    subidos = [f for f in request.files.getlist('pdfs') + request.files.getlist('pdf') if f.filename]
+    
+    if 'zip' in request.files:
+        zip_file = request.files['zip']
+        validar_subida(zip_file, '.zip')
+        zip_path = lote_dir / 'entrada.zip'
+        guardar_subida(zip_file, zip_path)
+        with zipfile.ZipFile(zip_path) as zf:
+            miembros = _pdfs_del_zip(zf)
+            if len(miembros) + len(subidos) > LOTE_MAX_ARCHIVOS:
+                raise ErrorSubida(f'El lote tiene {len(miembros) + len(subidos)} archivos; '
+                                  f'el máximo es {LOTE_MAX_ARCHIVOS}')
+            for nombre, info in miembros:
+                # Cada PDF pasa por el mismo camino que una subida: sha256, firma y spill a disco
+                stream = ArchivoSubida(nombre)
+                try:
+                    with zf.open(info) as origen:
+                        shutil.copyfileobj(origen, stream)
+                    paginas = _validar_pdf_lote(FileStorage(stream=stream, filename=nombre), nombre)
+                    destino = lote_dir / f'{len(archivos):03d}_{nombre}'
+                    stream.guardar(destino)
+                finally:
+                    stream.close()
+                archivos.append((nombre, destino, paginas))
+        zip_path.unlink()
+    elif len(subidos) > LOTE_MAX_ARCHIVOS:
+        raise ErrorSubida(f'El lote tiene {len(subidos)} archivos; el máximo es {LOTE_MAX_ARCHIVOS}')
+    
+    for pdf_file in subidos:
+        nombre = _nombre_seguro(pdf_file.filename)
+        paginas = _validar_pdf_lote(pdf_file, nombre)
+        destino = lote_dir / f'{len(archivos):03d}_{nombre}'
+        guardar_subida(pdf_file, destino)
+        archivos.append((nombre, destino, paginas))
+    
+    return archivos
+
+def _procesar_archivo_lote(archivo, lote_dir):
+    """Procesa un archivo del lote: detecta el banco si hace falta y ejecuta el extractor"""
+    medidor = MedidorTiempos()
+    pdf_sha256 = None
+    if archivo['banco'] == BANCO_AUTOMATICO:
+        with medidor.etapa('deteccion'):
+            pdf_sha256 = calcular_sha256(archivo['ruta'])
+            deteccion = detectar_banco_detalle(archivo['ruta'], pdf_sha256)
+        archivo['confianza_deteccion'] = deteccion['confianza']
+        if not deteccion['banco']:
+            raise ErrorExtraccion('No se pudo detectar el banco del PDF con suficiente confianza', 'deteccion', 400)
+        archivo['banco'] = deteccion['banco']
+    
+    if archivo['banco'] not in BANCO_EXTRACTORS:
+        raise ErrorExtraccion(f"Banco no soportado: {archivo['banco']}", 'banco', 400)
+    
+    excel_path = lote_dir / (Path(archivo['ruta']).stem + '_extraido.xlsx')
+    df, _ = extraer_con_cache(archivo['banco'], archivo['ruta'], excel_path, pdf_sha256=pdf_sha256, medidor=medidor,
+                              total_paginas=archivo.get('paginas'))
+    archivo['timings'] = medidor.como_dict()
+    return df, excel_path
+
+def crear_paquete_lote(job_id, lote_dir, archivos, resultados):
+    """Arma el ZIP del lote con un Excel por resumen y un consolidado. Devuelve la ruta del ZIP"""
+    # Libro consolidado con todos los movimientos y un resumen por archivo
+    consolidado_path = lote_dir / 'consolidado.xlsx'
+    dfs = []
+    for archivo in archivos:
+        df = resultados.get(archivo['indice'])
+        if df is not None and not df.empty:
+            df = df.copy()
+            df.insert(0, 'Banco', archivo['banco'])
+            df.insert(0, 'Archivo', archivo['nombre'])
+            dfs.append(df)
+    
+    resumen = pd.DataFrame([{
+        'Archivo': a['nombre'],
+        'Banco': a['banco'],
+        'Estado': a['status'],
+        'Filas': a.get('filas', 0),
+        'Mensaje': a.get('mensaje', '')
+    } for a in archivos])
+    
+    with pd.ExcelWriter(consolidado_path, engine='openpyxl') as writer:
+        resumen.to_excel(writer, sheet_name='Resumen', index=False)
+        if dfs:
+            pd.concat(dfs, ignore_index=True).to_excel(writer, sheet_name='Movimientos Consolidados', index=False)
+    
+    zip_filename = f'lote_{job_id[:8]}_{int(time.time())}.zip'
+    zip_path = TEMP_DIR / zip_filename
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(consolidado_path, 'consolidado.xlsx')
+        for archivo in archivos:
+            if archivo.get('excel'):
+                zf.write(lote_dir / archivo['excel'], f"{Path(archivo['nombre']).stem}_extraido.xlsx")
+    return zip_path
+
+def ejecutar_lote_job(job_id, lote_dir, archivos, base_url):
+    """Procesa todos los archivos del lote en paralelo y publica el estado de cada uno"""
+    estado_lock = threading.Lock()
+    resultados = {}
+    terminados = [0]
+    
+    def publicar(status='processing', message=None, progreso=None, **campos):
+        with estado_lock:
+            if progreso is None:
+                progreso = int(95 * terminados[0] / len(archivos))
+            copia = [{k: v for k, v in a.items() if k != 'ruta'} for a in archivos]
+            actualizar_job(
+                job_id, status, progreso,
+                message or f'{terminados[0]} de {len(archivos)} archivos procesados',
+                archivos=copia, **campos
+            )
+    
+    def procesar(archivo):
+        with estado_lock:
+            archivo['status'] = 'processing'
+        publicar()
+        try:
+            df, excel_path = _procesar_archivo_lote(archivo, lote_dir)
+            filas = 0 if df is None or df.empty else len(df)
+            with estado_lock:
+                resultados[archivo['indice']] = df
+                archivo['filas'] = filas
+                archivo['excel'] = excel_path.name if excel_path.exists() else None
+                archivo['status'] = 'completed' if filas else 'empty'
+                archivo['mensaje'] = 'Extracción completada' if filas else 'No se pudieron extraer datos del PDF'
+        except ErrorExtraccion as e:
+            with estado_lock:
+                archivo['status'] = 'error'
+                archivo['mensaje'] = e.mensaje
+        except Exception as e:
+            logger.error(f"Error procesando {archivo['nombre']} del lote {job_id}: {str(e)}", exc_info=True)
+            with estado_lock:
+                archivo['status'] = 'error'
+                archivo['mensaje'] = f'Error al procesar el PDF: {str(e)}'
+        finally:
+            with estado_lock:
+                terminados[0] += 1
+            publicar()
+    
+    try:
+        publicar()
+        # Un thread por archivo en vuelo; el pool de procesos reparte el trabajo entre los núcleos
+        hilos = max(1, min(len(archivos), EXTRACTOR_POOL_SIZE if EXTRACTOR_POOL_HABILITADO else 1))
+        with ThreadPoolExecutor(max_workers=hilos) as executor:
+            # Cada archivo corre con una copia del contexto para conservar el id de correlación del lote
+            futuros = [executor.submit(contextvars.copy_context().run, procesar, a) for a in archivos]
+            for futuro in futuros:
+                futuro.result()
+        
+        publicar(message='Armando paquete de resultados...')
+        zip_path = crear_paquete_lote(job_id, lote_dir, archivos, resultados)
+        exitosos = sum(1 for a in archivos if a['status'] == 'completed')
+        zip_filename, download_url = publicar_resultado(zip_path, base_url)
+        publicar(
+            'completed',
+            f'Lote completado: {exitosos} de {len(archivos)} archivos con datos',
+            progreso=100,
+            filename=zip_filename,
+            downloadUrl=download_url
+        )
+    except Exception as e:
+        logger.error(f"Error en lote {job_id}: {str(e)}", exc_info=True)
+        actualizar_job(job_id, 'error', 0, f'Error al procesar el lote: {str(e)}', str(e))
+    finally:
+        shutil.rmtree(lote_dir, ignore_errors=True)
+
+def _stream_estado_lote(job_id):
+    """Genera una línea JSON por cada cambio de estado de los archivos del lote (NDJSON)"""
+    enviados = {}
+    while True:
+        job = obtener_job(job_id, tipo=JOB_TIPO_LOTE)
+        if job is None:
+            yield json.dumps({'evento': 'error', 'message': 'Job no encontrado'}) + '\n'
+            return
+        for archivo in job.get('archivos', []):
+            clave = (archivo['status'], archivo.get('filas'))
+            if enviados.get(archivo['indice']) != clave:
+                enviados[archivo['indice']] = clave
+                yield json.dumps({'evento': 'archivo', **archivo}, default=str) + '\n'
+        if job['status'] in JOB_ESTADOS_FINALES:
+            yield json.dumps({
+                'evento': 'fin',
+                'status': job['status'],
+                'message': job['message'],
+                'filename': job.get('filename'),
+                'downloadUrl': job.get('downloadUrl')
+            }) + '\n'
+            return
+        time.sleep(0.5)
+
+@app.route('/extract/batch', methods=['POST'])
+@idempotente
+def extract_batch():
+    """Extrae varios PDFs (ZIP o lista 'pdfs') en paralelo. Con ?stream=1 devuelve el estado de cada archivo en NDJSON"""
+    lote_dir = None
+    try:
+        if 'zip' not in request.files and not request.files.getlist('pdfs') and not request.files.getlist('pdf'):
+            return jsonify({'success': False, 'message': 'No se recibió ningún ZIP ni archivos PDF'}), 400
+        
+        try:
+            banco_defecto, bancos_por_nombre, bancos_por_indice = _bancos_por_archivo()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'El campo "bancos" debe ser JSON válido'}), 400
+        
+        lote_dir = TEMP_DIR / f'lote_{uuid.uuid4().hex}'
+        lote_dir.mkdir(parents=True, exist_ok=True)
+        
+        try:
+            guardados = guardar_archivos_lote(lote_dir)
+        except zipfile.BadZipFile:
+            shutil.rmtree(lote_dir, ignore_errors=True)
+            return jsonify({'success': False, 'message': 'El archivo ZIP no es válido'}), 400
+        except ErrorSubida as e:
+            shutil.rmtree(lote_dir, ignore_errors=True)
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        
+        if not guardados:
+            shutil.rmtree(lote_dir, ignore_errors=True)
+            return jsonify({'success': False, 'message': 'No se encontraron archivos PDF en el lote'}), 400
+        
+        archivos = []
+        for indice, (nombre, ruta, paginas) in enumerate(guardados):
+            if indice < len(bancos_por_indice) and bancos_por_indice[indice]:
+                banco = bancos_por_indice[indice]
+            else:
+                banco = bancos_por_nombre.get(nombre, banco_defecto)
+            archivos.append({
+                'indice': indice,
+                'nombre': nombre,
+                'banco': banco,
+                'ruta': str(ruta),
+                'paginas': paginas,
+                'status': 'pending',
+                'filas': 0
+            })
+        
+        job, _ = crear_job(
+            JOB_TIPO_LOTE,
+            total_archivos=len(archivos),
+            archivos=[{k: v for k, v in a.items() if k != 'ruta'} for a in archivos]
+        )
+        job_id = job['id']
+        base_url = request.host_url.rstrip('/')
+        
+        logger.info(f"Iniciando lote {job_id} con {len(archivos)} archivos")
+        iniciar_thread(ejecutar_lote_job, job_id, lote_dir, archivos, base_url)
+        
+        if request.args.get('stream', '').lower() in ('1', 'true'):
+            return Response(_stream_estado_lote(job_id), mimetype='application/x-ndjson', headers={'X-Job-Id': job_id})
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'total_archivos': len(archivos),
+            'message': 'Lote iniciado en segundo plano',
+            'statusUrl': f'{base_url}/extract/batch/status/{job_id}',
+            'eventsUrl': f'{base_url}/jobs/{job_id}/events'
+        }), 202
     
     except Exception as e:
-        print(f"Error general: {str(e)}")
+        logger.error(f"Error iniciando lote de extracción: {str(e)}", exc_info=True)
+        if lote_dir is not None:
+            shutil.rmtree(lote_dir, ignore_errors=True)
         return jsonify({
             'success': False,
             'message': f'Error del servidor: {str(e)}'
         }), 500
 
+@app.route('/extract/batch/status/<job_id>', methods=['GET'])
+def extract_batch_status(job_id):
+    """Consulta el estado de un lote (con el detalle por archivo y el link al ZIP cuando termina)"""
+    try:
+        job = obtener_job(job_id, tipo=JOB_TIPO_LOTE)
+        if not job:
+            return jsonify({
+                'success': False,
+                'message': f'Job no encontrado: {job_id}'
+            }), 404
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 200
+    except Exception as e:
+        logger.error(f"Error consultando estado de lote: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'message': f'Error al consultar estado: {str(e)}'
+        }), 500
+
+# ==================== FIN EXTRACCIÓN POR LOTES ====================
+
+# ==================== EVENTOS DE JOBS (SSE) ====================
+# /jobs/<id>/events mantiene una conexión Server-Sent Events por job en lugar de consultar el
+# estado cada segundo. Los cambios que hace este worker despiertan el stream al instante
+# (actualizar_job avisa por _avisos_jobs); los de otros workers se ven al releer el almacén cada
+# JOBS_EVENTOS_INTERVALO_SEGUNDOS. Cada stream ocupa un thread de gunicorn: hay un cupo por worker
+# (JOBS_EVENTOS_MAX_CONEXIONES, repartido junto con el de I/O saliente) y una duración máxima corta,
+# después de la cual el EventSource del navegador reconecta solo mandando Last-Event-ID. El id de
+# cada evento es el updated_at del job, así que al reconectar no se repiten stage/progress si el
+# job no cambió mientras tanto.
+# Eventos: stage (cambio de status), progress (progreso o mensaje), complete y failed (estado final,
+# con el job completo). Después de complete/failed el cliente debe cerrar el EventSource.
+JOBS_EVENTOS_INTERVALO_SEGUNDOS = float(os.environ.get('JOBS_EVENTOS_INTERVALO_SEGUNDOS', '1'))
+JOBS_EVENTOS_MAX_SEGUNDOS = int(os.environ.get('JOBS_EVENTOS_MAX_SEGUNDOS', '60'))
+JOBS_EVENTOS_KEEPALIVE_SEGUNDOS = 15
+
+_cupo_eventos = threading.BoundedSemaphore(JOBS_EVENTOS_MAX_CONEXIONES)
+
+def _evento_sse(evento, datos, id_evento=None):
+    prefijo = f'id: {id_evento}\n' if id_evento else ''
+    return f'{prefijo}event: {evento}\ndata: {json.dumps(datos, default=str)}\n\n'
+
+def _progreso_job(job):
+    """Datos del evento progress: el job sin el resultado final"""
+    return {k: v for k, v in job.items() if k not in ('resultado', 'resultado_status')}
+
+def _stream_eventos_job(job_id, ultimo_id=None):
+    """Genera los eventos SSE de un job hasta que termina o se cumple JOBS_EVENTOS_MAX_SEGUNDOS.
+    ultimo_id es el Last-Event-ID de una reconexión: si el job sigue igual no se reenvía su estado"""
+    anterior = None
+    limite = time.monotonic() + JOBS_EVENTOS_MAX_SEGUNDOS
+    ultimo_envio = time.monotonic()
+    yield f'retry: {int(JOBS_EVENTOS_INTERVALO_SEGUNDOS * 2000)}\n\n'
+    
+    while True:
+        job = obtener_job(job_id)
+        if job is None:
+            yield _evento_sse('failed', {'id': job_id, 'message': 'El job ya no existe'})
+            return
+        
+        if anterior is None and ultimo_id and job['updated_at'] == ultimo_id and job['status'] not in JOB_ESTADOS_FINALES:
+            anterior = job
+        if anterior is None or job['status'] != anterior['status']:
+            yield _evento_sse('stage', {'id': job_id, 'status': job['status'], 'message': job['message']}, job['updated_at'])
+            ultimo_envio = time.monotonic()
+        if job['status'] in JOB_ESTADOS_FINALES:
+            yield _evento_sse('complete' if job['status'] == 'completed' else 'failed', job, job['updated_at'])
+            return
+        if anterior is None or (job['progress'], job['message']) != (anterior['progress'], anterior['message']):
+            yield _evento_sse('progress', _progreso_job(job), job['updated_at'])
+            ultimo_envio = time.monotonic()
+        anterior = job
+        
+        if time.monotonic() >= limite:
+            return
+        if time.monotonic() - ultimo_envio >= JOBS_EVENTOS_KEEPALIVE_SEGUNDOS:
+            yield ': keepalive\n\n'
+            ultimo_envio = time.monotonic()
+        with _avisos_jobs:
+            _avisos_jobs.wait(JOBS_EVENTOS_INTERVALO_SEGUNDOS)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream SSE con el progreso de un job (vencimientos, extracción, lote u OCR)"""
+    if obtener_job(job_id) is None:
+        return jsonify({'success': False, 'message': f'Job no encontrado: {job_id}'}), 404
+    
+    if not _cupo_eventos.acquire(blocking=False):
+        # El cliente puede seguir consultando el estado por polling
+        respuesta = jsonify({
+            'success': False,
+            'message': 'Demasiadas conexiones de eventos abiertas, usa la consulta de estado',
+            'statusUrl': f"{request.host_url.rstrip('/')}/jobs/{job_id}"
+        })
+        respuesta.headers['Retry-After'] = str(JOBS_EVENTOS_KEEPALIVE_SEGUNDOS)
+        return respuesta, 503
+    
+    respuesta = Response(_stream_eventos_job(job_id, request.headers.get('Last-Event-ID')), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    respuesta.call_on_close(_cupo_eventos.release)
+    return respuesta
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Estado de cualquier job por id (alternativa por polling a /jobs/<id>/events)"""
+    job = obtener_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': f'Job no encontrado: {job_id}'}), 404
+    return jsonify({'success': True, 'job': job}), 200
+
+# ==================== FIN EVENTOS DE JOBS (SSE) ====================
+
+# Jobs de OCR en segundo plano (?async=1), con el mismo seguimiento que las extracciones
+JOB_TIPO_OCR = 'ocr'
+
+def convertir_pdf_a_ocr(pdf_path, output_path, base_url):
+    """Aplica OCR al PDF con el extractor de OCR y publica el resultado. Devuelve (filename, downloadUrl).
+    Lanza RuntimeError si no se generó el archivo"""
+    if str(EXTRACTORES_DIR) not in sys.path:
+        sys.path.insert(0, str(EXTRACTORES_DIR))
+    from extractor_pdf_ocr import extraer_texto_pdf_ocr
+    
+    logger.info(f"Convirtiendo PDF a OCR: {Path(pdf_path).name}...")
+    extraer_texto_pdf_ocr(str(pdf_path), str(output_path))
+    if not output_path.exists():
+        raise RuntimeError('No se pudo generar el archivo PDF con OCR')
+    return publicar_resultado(output_path, base_url, 'download-pdf', 'application/pdf')
+
+def ejecutar_ocr_job(job_id, pdf_path, output_path, base_url, ticket_admision=None):
+    """Ejecuta la conversión OCR en segundo plano y deja el resultado en el job"""
+    try:
+        actualizar_job(job_id, 'processing', 10, 'Aplicando OCR al PDF...')
+        filename, download_url = convertir_pdf_a_ocr(pdf_path, output_path, base_url)
+        resultado = {
+            'success': True,
+            'message': 'Conversión OCR completada exitosamente',
+            'filename': filename,
+            'downloadUrl': download_url
+        }
+        actualizar_job(job_id, 'completed', 100, resultado['message'], resultado=resultado,
+                       filename=filename, downloadUrl=resultado['downloadUrl'])
+    except Exception as e:
+        logger.error(f"Error en job de OCR {job_id}: {str(e)}", exc_info=True)
+        actualizar_job(job_id, 'error', 0, f'Error al procesar el PDF: {str(e)}', str(e))
+    finally:
+        liberar_admision(ticket_admision)
+        if pdf_path.exists():
+            try:
+                pdf_path.unlink()
+            except Exception as e:
+                logger.warning(f"Error al eliminar PDF temporal: {e}")
+
 @app.route('/pdf-to-ocr', methods=['POST'])
+@idempotente
 def pdf_to_ocr():
-    """Endpoint para convertir PDF escaneado a PDF con OCR"""
+    """Endpoint para convertir PDF escaneado a PDF con OCR (con ?async=1 devuelve un job_id inmediatamente)"""
     try:
-        # Validar que se recibió el archivo
-        if 'pdf' not in request.files:
-            return jsonify({'success': False, 'message': 'No se recibió ningún archivo PDF'}), 400
-        
-        pdf_file = request.files['pdf']
+        # Validar que se recibió el archivo (o el upload_id de una subida reanudable)
+        try:
+            pdf_file = archivo_de_request('pdf')
+            if pdf_file is None:
+                return jsonify({'success': False, 'message': 'No se recibió ningún archivo PDF'}), 400
+            total_paginas = validar_subida(pdf_file, '.pdf')
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
         
         # Guardar el PDF temporalmente
-        pdf_filename = f"ocr_input_{pdf_file.filename}"
+        nombre_pdf = pdf_file.filename
         # Limpiar nombre de archivo (remover caracteres problemáticos)
-        pdf_filename = pdf_filename.replace(' ', '_').replace('/', '_').replace('\\', '_')
-        pdf_path = TEMP_DIR / pdf_filename
+        nombre_pdf = nombre_pdf.replace(' ', '_').replace('/', '_').replace('\\', '_')
+        # Prefijo único: dos conversiones del mismo archivo no deben pisarse la entrada ni el resultado
+        prefijo = uuid.uuid4().hex
+        pdf_path = TEMP_DIR / f"ocr_input_{prefijo}_{nombre_pdf}"
         
         # Asegurar que el directorio existe
         TEMP_DIR.mkdir(parents=True, exist_ok=True)
         
         # Guardar archivo
-        pdf_file.save(str(pdf_path))
+        guardar_subida(pdf_file, pdf_path)
         logger.info(f"PDF guardado temporalmente en: {pdf_path}")
         
         # Generar nombre del archivo PDF de salida
-        output_filename = pdf_filename.replace('ocr_input_', 'ocr_output_').replace('.pdf', '_OCR.pdf')
-        output_path = TEMP_DIR / output_filename
+        output_path = TEMP_DIR / f"ocr_output_{prefijo}_{Path(nombre_pdf).stem}_OCR.pdf"
+        base_url = request.host_url.rstrip('/')
+        
+        # En modo asíncrono el thread del job se encarga de borrar el PDF y liberar la admisión
+        pdf_delegado = False
+        ticket_admision = None
         
         try:
-            # Cargar el módulo extractor de OCR
-            import sys
-            sys.path.insert(0, str(EXTRACTORES_DIR))
-            from extractor_pdf_ocr import extraer_texto_pdf_ocr
-            
-            # Ejecutar la conversión OCR
-            print(f"Convirtiendo PDF a OCR: {pdf_filename}...")
-            success = extraer_texto_pdf_ocr(str(pdf_path), str(output_path))
+            try:
+                ticket_admision = admitir_trabajo('ocr', max(1, total_paginas or 1) * COSTOS_MOTOR['ocr'])
+            except ErrorAdmision as e:
+                return respuesta_admision_rechazada(e)
             
-            # Verificar que se generó el archivo
-            if not output_path.exists():
+            if es_modo_async():
+                job, _ = crear_job(JOB_TIPO_OCR, archivo=pdf_file.filename)
+                job_id = job['id']
+                iniciar_thread(ejecutar_ocr_job, job_id, pdf_path, output_path, base_url, ticket_admision)
+                pdf_delegado = True
                 return jsonify({
-                    'success': False,
-                    'message': 'No se pudo generar el archivo PDF con OCR'
-                }), 500
+                    'success': True,
+                    'job_id': job_id,
+                    'message': 'Conversión OCR iniciada en segundo plano',
+                    'statusUrl': f'{base_url}/jobs/{job_id}',
+                    'eventsUrl': f'{base_url}/jobs/{job_id}/events'
+                }), 202
+            
+            output_filename, download_url = convertir_pdf_a_ocr(pdf_path, output_path, base_url)
             
-            base_url = request.host_url.rstrip('/')
-
             return jsonify({
                 'success': True,
                 'message': 'Conversión OCR completada exitosamente',
                 'filename': output_filename,
-                'downloadUrl': f'{base_url}/download-pdf/{output_filename}'
+                'downloadUrl': download_url
             })
+        
+        except RuntimeError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 500
             
         except Exception as e:
-            print(f"Error durante la conversión OCR: {str(e)}")
+            logger.error(f"Error durante la conversión OCR: {str(e)}", exc_info=True)
             return jsonify({
                 'success': False,
                 'message': f'Error al procesar el PDF: {str(e)}'
             }), 500
         
         finally:
+            if not pdf_delegado:
+                liberar_admision(ticket_admision)
             # Limpiar el PDF temporal de entrada
-            if pdf_path.exists():
+            if not pdf_delegado and pdf_path.exists():
                 try:
                     pdf_path.unlink()
                 except Exception as e:
-                    print(f"Error al eliminar PDF temporal: {e}")
+                    logger.warning(f"Error al eliminar PDF temporal: {e}")
     
     except Exception as e:
-        print(f"Error general: {str(e)}")
+        logger.error(f"Error general: {str(e)}", exc_info=True)
         return jsonify({
             'success': False,
             'message': f'Error del servidor: {str(e)}'
         }), 500
 
-@app.route('/download/<filename>', methods=['GET'])
-def download(filename):
-    """Endpoint para descargar archivos Excel generados"""
-    try:
-        file_path = TEMP_DIR / filename
-        
-        if not file_path.exists():
+# ==================== ALMACENAMIENTO DE RESULTADOS ====================
+# Los archivos generados (Excel, CSV, Parquet, PDFs con OCR, ZIPs de lotes, comparaciones) quedaban
+# solo en el TEMP_DIR del contenedor que los creó: se perdían en cada deploy y con varias réplicas
+# detrás de un balanceador el /download podía caer en otra. Cada resultado se publica en un almacén:
+#   local -> se queda en TEMP_DIR y se descarga por /download (comportamiento de siempre)
+#   s3    -> se sube a un bucket S3 compatible (AWS, MinIO, R2) y el downloadUrl es una URL
+#            prefirmada: los bytes los entrega el bucket y ningún worker de Python los transmite
+# En S3 cada objeto va bajo un id propio (S3_PREFIJO<uuid>/<nombre>): los nombres locales se repiten
+# entre réplicas y deploys, y un resultado nunca debe pisar a otro. Ese "<uuid>/<nombre>" es el
+# filename que se devuelve al cliente.
+# Las credenciales se toman de las variables estándar de AWS (AWS_ACCESS_KEY_ID, ...). Los objetos
+# no se borran desde acá: el vencimiento lo hace una regla de lifecycle del bucket sobre S3_PREFIJO.
+ALMACENAMIENTO = os.environ.get('ALMACENAMIENTO', 'local').lower()
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIJO = os.environ.get('S3_PREFIJO', 'resultados/')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+# Endpoint con el que se firman las URLs si el cliente no llega al interno (ej: MinIO en la red de Docker)
+S3_ENDPOINT_PUBLICO = os.environ.get('S3_ENDPOINT_PUBLICO') or S3_ENDPOINT_URL
+S3_REGION = os.environ.get('S3_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+S3_URL_FIRMADA_SEGUNDOS = int(os.environ.get('S3_URL_FIRMADA_SEGUNDOS', str(ARTEFACTOS_TTL_SEGUNDOS)))
+
+class AlmacenLocal:
+    """Los resultados quedan en TEMP_DIR (los borra la limpieza automática)"""
+    nombre = 'local'
+    
+    def publicar(self, ruta, mimetype):
+        registrar_artefacto(ruta)
+        return ruta.name
+    
+    def url_descarga(self, nombre, base_url, ruta_descarga):
+        return f'{base_url}/{ruta_descarga}/{nombre}'
+    
+    def verificar(self):
+        if not os.access(TEMP_DIR, os.W_OK):
+            raise OSError(f'No se puede escribir en {TEMP_DIR}')
+    
+    def descargar(self, nombre, mimetype):
+        file_path = TEMP_DIR / nombre
+        if not artefacto_publicado(nombre) or not file_path.is_file():
             return jsonify({'success': False, 'message': 'Archivo no encontrado'}), 404
-        
-        return send_file(
-            str(file_path),
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
+        return servir_archivo(file_path, mimetype, nombre)
+
+class AlmacenS3:
+    """Los resultados se suben a un bucket y se descargan con URLs prefirmadas"""
+    nombre = 's3'
+    
+    def __init__(self):
+        self._clientes = {}  # (pid, endpoint) -> cliente de boto3
+        self._lock = threading.Lock()
+    
+    def _cliente(self, endpoint=S3_ENDPOINT_URL):
+        # Los clientes de boto3 son thread-safe pero no sobreviven a un fork: uno por proceso
+        clave = (os.getpid(), endpoint)
+        with self._lock:
+            if clave not in self._clientes:
+                boto3 = importar_midiendo('boto3')
+                config = importar_midiendo('botocore.config').Config(
+                    signature_version='s3v4',
+                    retries={'max_attempts': 3, 'mode': 'standard'},
+                    # MinIO y la mayoría de los compatibles no resuelven buckets como subdominio
+                    s3={'addressing_style': 'path' if endpoint else 'auto'}
+                )
+                self._clientes[clave] = boto3.client('s3', endpoint_url=endpoint, region_name=S3_REGION,
+                                                     config=config)
+            return self._clientes[clave]
+    
+    def _clave(self, nombre):
+        return f'{S3_PREFIJO}{nombre}'
+    
+    def publicar(self, ruta, mimetype):
+        nombre = f'{uuid.uuid4().hex}/{ruta.name}'
+        self._cliente().upload_file(str(ruta), S3_BUCKET, self._clave(nombre), ExtraArgs={'ContentType': mimetype})
+        # Ya está en el bucket: la copia local solo ocuparía disco
+        ruta.unlink(missing_ok=True)
+        return nombre
+    
+    def url_descarga(self, nombre, base_url, ruta_descarga):
+        return self._cliente(S3_ENDPOINT_PUBLICO).generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': S3_BUCKET,
+                'Key': self._clave(nombre),
+                'ResponseContentDisposition': f"attachment; filename*=UTF-8''{quote(Path(nombre).name)}"
+            },
+            ExpiresIn=S3_URL_FIRMADA_SEGUNDOS
         )
     
+    def verificar(self):
+        self._cliente().head_bucket(Bucket=S3_BUCKET)
+    
+    def descargar(self, nombre, mimetype):
+        # Links viejos a /download/<archivo>: se redirige a una URL prefirmada nueva
+        return redirect(self.url_descarga(nombre, None, None), 302)
+
+def _crear_almacen():
+    if ALMACENAMIENTO == 's3':
+        if not S3_BUCKET:
+            logger.error("ALMACENAMIENTO=s3 sin S3_BUCKET: los resultados quedan en TEMP_DIR")
+        elif importlib.util.find_spec('boto3') is None:
+            logger.error("ALMACENAMIENTO=s3 requiere boto3: los resultados quedan en TEMP_DIR")
+        else:
+            logger.info(f"Resultados en s3://{S3_BUCKET}/{S3_PREFIJO} ({S3_ENDPOINT_URL or 'AWS'})")
+            return AlmacenS3()
+    elif ALMACENAMIENTO != 'local':
+        logger.error(f"ALMACENAMIENTO desconocido: {ALMACENAMIENTO}, se usa local")
+    return AlmacenLocal()
+
+almacen = _crear_almacen()
+
+def publicar_resultado(ruta, base_url, ruta_descarga='download', mimetype=None, medidor=None):
+    """Publica un archivo generado en el almacén. Devuelve (filename, downloadUrl), donde filename es
+    el nombre con el que quedó publicado (el que acepta /download)"""
+    ruta = Path(ruta)
+    mimetype = mimetype or MIMETYPES_DESCARGA.get(ruta.suffix.lower(), 'application/octet-stream')
+    with (medidor or MedidorTiempos()).etapa('publicacion'):
+        nombre = almacen.publicar(ruta, mimetype)
+    return nombre, almacen.url_descarga(nombre, base_url, ruta_descarga)
+
+# ==================== FIN ALMACENAMIENTO DE RESULTADOS ====================
+
+# ==================== DESCARGAS ====================
+# ETag a partir del hash del contenido (If-None-Match -> 304) y soporte de Range para reanudar
+# descargas. Con DESCARGAS_OFFLOAD el archivo lo entrega el proxy delante de gunicorn y el worker
+# queda libre enseguida:
+#   x-sendfile -> header X-Sendfile con la ruta absoluta (Apache mod_xsendfile, lighttpd)
+#   x-accel    -> header X-Accel-Redirect con DESCARGAS_ACCEL_PREFIX + nombre (location internal de nginx
+#                 con alias a TEMP_DIR)
+DESCARGAS_OFFLOAD = os.environ.get('DESCARGAS_OFFLOAD', '').lower()
+DESCARGAS_ACCEL_PREFIX = os.environ.get('DESCARGAS_ACCEL_PREFIX', '/temp-interno/')
+DESCARGAS_MAX_ETAGS = 1024
+
+_etags_descargas = {}  # ruta -> (mtime_ns, tamaño, etag)
+_etags_descargas_lock = threading.Lock()
+
+def etag_archivo(ruta):
+    """ETag fuerte del archivo (sha256 del contenido), recalculado solo si cambia mtime o tamaño"""
+    st = os.stat(ruta)
+    clave = str(ruta)
+    with _etags_descargas_lock:
+        guardado = _etags_descargas.get(clave)
+    if guardado is not None and guardado[:2] == (st.st_mtime_ns, st.st_size):
+        return guardado[2]
+    
+    etag = calcular_sha256(ruta)[:32]
+    with _etags_descargas_lock:
+        if len(_etags_descargas) >= DESCARGAS_MAX_ETAGS:
+            _etags_descargas.pop(next(iter(_etags_descargas)))
+        _etags_descargas[clave] = (st.st_mtime_ns, st.st_size, etag)
+    return etag
+
+def servir_archivo(file_path, mimetype, download_name):
+    """Responde la descarga de un archivo de TEMP_DIR con ETag, Range y offload opcional al proxy"""
+    etag = etag_archivo(file_path)
+    tocar_artefacto(file_path)
+    
+    if DESCARGAS_OFFLOAD in ('x-sendfile', 'x-accel'):
+        respuesta = Response(status=200, mimetype=mimetype)
+        if DESCARGAS_OFFLOAD == 'x-accel':
+            respuesta.headers['X-Accel-Redirect'] = DESCARGAS_ACCEL_PREFIX.rstrip('/') + '/' + quote(file_path.name)
+        else:
+            respuesta.headers['X-Sendfile'] = str(file_path.resolve())
+        respuesta.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        respuesta.set_etag(etag)
+        # Si el cliente ya tiene esta versión se contesta 304 acá; los Range los resuelve el proxy
+        return respuesta.make_conditional(request)
+    
+    # send_file resuelve If-None-Match y Range (206) por su cuenta
+    return send_file(
+        str(file_path),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        etag=etag,
+        conditional=True
+    )
+
+@app.route('/download/<path:filename>', methods=['GET'])
+def download(filename):
+    """Endpoint para descargar archivos generados (Excel, CSV, Parquet o el ZIP de un lote)"""
+    try:
+        mimetype = MIMETYPES_DESCARGA.get(Path(filename).suffix.lower(), MIMETYPES_DESCARGA['.xlsx'])
+        return almacen.descargar(filename, mimetype)
+    
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/download-pdf/<filename>', methods=['GET'])
+@app.route('/download-pdf/<path:filename>', methods=['GET'])
 def download_pdf(filename):
     """Endpoint para descargar archivos PDF generados"""
     try:
-        file_path = TEMP_DIR / filename
-        
-        if not file_path.exists():
-            return jsonify({'success': False, 'message': 'Archivo no encontrado'}), 404
-        
-        return send_file(
-            str(file_path),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=filename
-        )
+        return almacen.descargar(filename, 'application/pdf')
     
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# ==================== FIN DESCARGAS ====================
+
 @app.route('/cleanup', methods=['POST'])
 def cleanup():
-    """Limpia archivos temporales antiguos"""
+    """Fuerza una pasada de la limpieza automática (TTL + cuota) sobre TEMP_DIR"""
     try:
-        import time
-        cleaned = 0
-        now = time.time()
-        
-        for file in TEMP_DIR.glob('*'):
-            if file.is_file():
-                # Eliminar archivos más antiguos de 1 hora
-                if now - file.stat().st_mtime > 3600:
-                    file.unlink()
-                    cleaned += 1
+        liberados = ejecutar_limpieza(espera_lock=30)
+        if liberados is None:
+            return jsonify({
+                'success': False,
+                'message': 'Hay otra limpieza en curso, intenta de nuevo en unos segundos'
+            }), 409
         
         return jsonify({
             'success': True,
-            'message': f'Se limpiaron {cleaned} archivos'
+            'message': f"Se limpiaron {liberados['archivos']} archivos",
+            'bytes_liberados': liberados['bytes']
         })
     
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/google/oauth/token', methods=['POST'])
+@ruta_io
 def exchange_google_token():
     """Intercambia código de autorización por token de acceso"""
     try:
@@ -1908,7 +6163,7 @@ def exchange_google_token():
         logger.info(f"Client Secret (primeros 10 caracteres): {client_secret[:10]}..." if client_secret else "Client Secret: NO CONFIGURADO")
         
         # Intercambiar código por token
-        token_response = requests.post('https://oauth2.googleapis.com/token', data={
+        token_response = post_http('https://oauth2.googleapis.com/token', data={
             'code': code,
             'client_id': client_id,
             'client_secret': client_secret,
@@ -1972,11 +6227,15 @@ def exchange_google_token():
         
         return jsonify(token_data), 200
         
+    except requests.exceptions.Timeout as e:
+        logger.error(f"Timeout en exchange_google_token: {str(e)}")
+        return jsonify({'error': 'timeout', 'message': str(e)}), 504
     except Exception as e:
         logger.error(f"Error en exchange_google_token: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/google/oauth/refresh', methods=['POST'])
+@ruta_io
 def refresh_google_token():
     """Refresca un token de acceso usando refresh token"""
     try:
@@ -2020,7 +6279,7 @@ def refresh_google_token():
         logger.info(f"Client Secret (primeros 10 caracteres): {client_secret[:10]}..." if client_secret else "Client Secret: NO CONFIGURADO")
         logger.info(f"Client Secret (últimos 5 caracteres): ...{client_secret[-5:]}" if client_secret and len(client_secret) > 5 else "Client Secret: NO CONFIGURADO")
         
-        token_response = requests.post('https://oauth2.googleapis.com/token', data={
+        token_response = post_http('https://oauth2.googleapis.com/token', data={
             'client_id': client_id,
             'client_secret': client_secret,
             'refresh_token': refresh_token,
@@ -2071,6 +6330,9 @@ def refresh_google_token():
         
         return jsonify(token_data), 200
         
+    except requests.exceptions.Timeout as e:
+        logger.error(f"Timeout en refresh_google_token: {str(e)}")
+        return jsonify({'error': 'timeout', 'message': str(e)}), 504
     except Exception as e:
         logger.error(f"Error en refresh_google_token: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -2150,20 +6412,34 @@ def consilador_comparar():
                 'message': 'Ambos archivos deben ser Excel (.xlsx o .xls)'
             }), 400
         
-        # Crear directorio temporal para la comparación
-        import time
-        comparacion_dir = TEMP_DIR / f'consilador_{int(time.time())}'
+        try:
+            validar_subida(archivo1, ext1)
+            validar_subida(archivo2, ext2)
+        except ErrorSubida as e:
+            return jsonify({'success': False, 'message': e.mensaje}), e.status_code
+        
+        # Crear directorio temporal para la comparación (único: dos comparaciones en el mismo segundo
+        # no deben compartirlo, la limpieza de una borraría los archivos de la otra)
+        comparacion_dir = TEMP_DIR / f'consilador_{uuid.uuid4().hex}'
         comparacion_dir.mkdir(parents=True, exist_ok=True)
         
         # Guardar los archivos temporalmente
         archivo1_path = comparacion_dir / f'archivo1{ext1}'
         archivo2_path = comparacion_dir / f'archivo2{ext2}'
         
-        archivo1.save(str(archivo1_path))
-        archivo2.save(str(archivo2_path))
+        guardar_subida(archivo1, archivo1_path)
+        guardar_subida(archivo2, archivo2_path)
         
         logger.info(f"Archivos guardados en: {comparacion_dir}")
         
+        # El costo de la comparación se estima por MB de Excel
+        megabytes = (archivo1_path.stat().st_size + archivo2_path.stat().st_size) / (1024 * 1024)
+        try:
+            ticket_admision = admitir_trabajo('consilador', max(1, round(megabytes)) * COSTOS_MOTOR['excel'])
+        except ErrorAdmision as e:
+            shutil.rmtree(comparacion_dir, ignore_errors=True)
+            return respuesta_admision_rechazada(e)
+        
         try:
             # Importar el módulo de comparación
             consilador_dir = Path(__file__).parent / 'Consilador'
@@ -2211,20 +6487,22 @@ def consilador_comparar():
                     }), 500
                 
                 # Generar nombre único para el archivo de resultado
-                resultado_filename = f'resultado_comparacion_{int(time.time())}.xlsx'
+                resultado_filename = f'resultado_comparacion_{uuid.uuid4().hex}.xlsx'
                 resultado_final = TEMP_DIR / resultado_filename
                 
                 # Mover el resultado al directorio temporal principal
-                import shutil
                 shutil.move(str(resultado_path), str(resultado_final))
                 
                 base_url = request.host_url.rstrip('/')
                 
+                resultado_filename, download_url = publicar_resultado(resultado_final, base_url,
+                                                                      medidor=medidor_request())
+                
                 return jsonify({
                     'success': True,
                     'message': 'Comparación completada exitosamente',
                     'filename': resultado_filename,
-                    'downloadUrl': f'{base_url}/download/{resultado_filename}'
+                    'downloadUrl': download_url
                 })
                 
             finally:
@@ -2232,7 +6510,6 @@ def consilador_comparar():
                 os.chdir(original_cwd)
                 # Limpiar archivos temporales del directorio de comparación
                 try:
-                    import shutil
                     if comparacion_dir.exists():
                         shutil.rmtree(comparacion_dir, ignore_errors=True)
                         logger.info(f"Directorio temporal limpiado: {comparacion_dir}")
@@ -2246,6 +6523,9 @@ def consilador_comparar():
                 'message': f'Error al procesar los archivos: {str(e)}'
             }), 500
         
+        finally:
+            liberar_admision(ticket_admision)
+        
     except Exception as e:
         logger.error(f"Error general en consilador_comparar: {str(e)}", exc_info=True)
         return jsonify({
@@ -2253,6 +6533,288 @@ def consilador_comparar():
             'message': f'Error del servidor: {str(e)}'
         }), 500
 
+# ==================== ARRANQUE ====================
+# Con gunicorn --preload el módulo se importa una sola vez en el master y los workers se crean con
+# fork. Si además PRECARGA_LIBRERIAS=1, el master importa las librerías pesadas y registra los
+# módulos extractores antes del fork: los workers las heredan ya cargadas y comparten esa memoria
+# copy-on-write. Los procesos del pool no salen del worker sino de su forkserver, que importa este
+# módulo (y con él esta misma precarga) antes de crearlos. Nada de lo que se hace acá abre
+# conexiones ni arranca threads: eso lo hace cada proceso la primera vez que lo necesita.
+PRECARGA_LIBRERIAS = os.environ.get('PRECARGA_LIBRERIAS', 'false').lower() in ('1', 'true', 'yes', 'si')
+
+TIEMPOS_ARRANQUE = {}
+
+def precargar_extractores():
+    """Registra todos los módulos extractores en el proceso actual (los que fallen se ignoran)"""
+    for extractor_info in BANCO_EXTRACTORS.values():
+        try:
+            obtener_modulo_extractor(extractor_info['script'])
+        except Exception as e:
+            logger.warning(f"No se pudo precargar {extractor_info['script']}: {e}")
+
+def precargar_para_fork():
+    """Deja cargado todo lo pesado antes de que gunicorn cree los workers"""
+    inicio = time.perf_counter()
+    precargar_librerias_pesadas()
+    precargar_extractores()
+    # Lo cargado hasta acá no se libera nunca: se saca del GC para que sus pasadas no toquen
+    # esos objetos y no se copien las páginas compartidas en cada worker
+    gc.collect()
+    gc.freeze()
+    TIEMPOS_ARRANQUE['precarga_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+
+def reporte_arranque():
+    """Tiempos de arranque de este proceso y qué librerías pesadas tiene cargadas"""
+    with extractores_lock:
+        extractores = len(extractores_cargados)
+    return {
+        'pid': os.getpid(),
+        'precarga': PRECARGA_LIBRERIAS,
+        **TIEMPOS_ARRANQUE,
+        'importaciones_ms': dict(TIEMPOS_IMPORTACION),
+        'librerias_cargadas': {nombre: nombre in sys.modules for nombre in LIBRERIAS_PESADAS},
+        'extractores_cargados': extractores
+    }
+
+@app.route('/admin/arranque', methods=['GET'])
+def admin_arranque():
+    """Cuánto tardó en cargar el servidor y cuánto costó cada importación pesada en este proceso"""
+    return jsonify({'success': True, 'arranque': reporte_arranque()}), 200
+
+if PRECARGA_LIBRERIAS:
+    logger.info("Precargando librerías pesadas y extractores (PRECARGA_LIBRERIAS=1)...")
+    precargar_para_fork()
+
+TIEMPOS_ARRANQUE['modulo_ms'] = round((time.perf_counter() - _inicio_arranque) * 1000, 1)
+logger.info(f"Servidor cargado en {TIEMPOS_ARRANQUE['modulo_ms']:.0f} ms"
+            + (f" (precarga: {TIEMPOS_ARRANQUE['precarga_ms']:.0f} ms)" if PRECARGA_LIBRERIAS else ''))
+for nombre, ms in sorted(TIEMPOS_IMPORTACION.items(), key=lambda item: -item[1]):
+    logger.info(f"  importación {nombre}: {ms:.0f} ms")
+
+# ==================== FIN ARRANQUE ====================
+
+# ==================== DISPONIBILIDAD (READINESS) ====================
+# /health solo dice que el proceso responde. /ready dice si conviene mandarle trabajo pesado a esta
+# instancia y responde 503 (con Retry-After) si:
+#   - el worker todavía no está caliente: el primer /ready arranca el calentamiento en segundo plano.
+#     Con el pool habilitado los extractores corren en sus procesos, así que se crea el pool (los
+#     procesos salen del forkserver con las librerías ya importadas) y se espera a que respondan; el
+#     worker no importa nada pesado. Sin pool, el worker carga las librerías y los extractores (salvo
+#     que ya los haya heredado del master con PRECARGA_LIBRERIAS)
+#   - falta una dependencia requerida (Tesseract, Ghostscript, el almacén de resultados)
+#   - TEMP_DIR tiene menos de LISTO_TEMP_LIBRE_MIN_MB libres
+#   - el trabajo admitido supera LISTO_OCUPACION_MAX de la capacidad, o el pool de este worker ya
+#     tiene una tanda completa de extracciones esperando
+#   - el p95 reciente de los trabajos supera LISTO_P95_MAX_SEGUNDOS (0 = solo se informa)
+# Las verificaciones de dependencias lanzan procesos o llamadas de red: se cachean por proceso.
+LISTO_DEPENDENCIAS_REQUERIDAS = [
+    nombre.strip() for nombre in os.environ.get('LISTO_DEPENDENCIAS_REQUERIDAS', 'tesseract,ghostscript').split(',')
+    if nombre.strip()
+]
+LISTO_TEMP_LIBRE_MIN_MB = int(os.environ.get('LISTO_TEMP_LIBRE_MIN_MB', '512'))
+LISTO_OCUPACION_MAX = float(os.environ.get('LISTO_OCUPACION_MAX', '0.9'))
+LISTO_P95_MAX_SEGUNDOS = float(os.environ.get('LISTO_P95_MAX_SEGUNDOS', '0'))
+LISTO_CACHE_SEGUNDOS = int(os.environ.get('LISTO_CACHE_SEGUNDOS', '60'))
+LISTO_RETRY_SEGUNDOS = 15
+
+# Ejecutables posibles por dependencia (los de Windows son para desarrollo local)
+BINARIOS_DEPENDENCIAS = {
+    'tesseract': ['tesseract', r'C:\Program Files\Tesseract-OCR\tesseract.exe',
+                  r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe'],
+    'ghostscript': ['gs', 'gswin64c', 'gswin32c'],
+}
+
+_verificaciones = {}  # dependencia -> (pid, instante, resultado)
+_verificaciones_lock = threading.Lock()
+_calentamiento = {'pid': None, 'inicio': None, 'fin': None, 'procesos_listos': None}
+# Cuánto espera el calentamiento a que los procesos del pool terminen de arrancar
+LISTO_CALENTAMIENTO_POOL_SEGUNDOS = 120
+_calentamiento_lock = threading.Lock()
+
+def _verificar_binario(candidatos):
+    """Ruta y versión del primer ejecutable que responde a --version"""
+    for candidato in candidatos:
+        ruta = shutil.which(candidato) or (candidato if os.path.isfile(candidato) else None)
+        if ruta is None:
+            continue
+        try:
+            salida = subprocess.run([ruta, '--version'], capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError) as e:
+            return {'ok': False, 'ruta': ruta, 'error': str(e)}
+        version = (salida.stdout or salida.stderr).strip().splitlines()
+        return {'ok': salida.returncode == 0, 'ruta': ruta, 'version': version[0] if version else None}
+    return {'ok': False, 'error': 'No encontrado en el PATH'}
+
+def _verificar_almacen():
+    try:
+        almacen.verificar()
+        return {'ok': True, 'tipo': almacen.nombre}
+    except Exception as e:
+        return {'ok': False, 'tipo': almacen.nombre, 'error': str(e)}
+
+def verificar_dependencia(nombre):
+    """Resultado de la verificación de una dependencia, cacheado LISTO_CACHE_SEGUNDOS por proceso"""
+    ahora = time.monotonic()
+    with _verificaciones_lock:
+        guardado = _verificaciones.get(nombre)
+    if guardado is not None and guardado[0] == os.getpid() and ahora - guardado[1] < LISTO_CACHE_SEGUNDOS:
+        return guardado[2]
+    resultado = _verificar_almacen() if nombre == 'almacen' else _verificar_binario(BINARIOS_DEPENDENCIAS[nombre])
+    with _verificaciones_lock:
+        _verificaciones[nombre] = (os.getpid(), ahora, resultado)
+    return resultado
+
+def _calentar_worker():
+    if EXTRACTOR_POOL_HABILITADO:
+        # Un proceso del pool contesta el estado recién después de importar las librerías pesadas
+        try:
+            procesos = obtener_pool_extraccion().estado_registros(timeout=LISTO_CALENTAMIENTO_POOL_SEGUNDOS)
+        except Exception as e:
+            logger.error(f"No se pudo iniciar el pool de extracción: {e}", exc_info=True)
+            procesos = []
+        listos = sum(1 for proceso in procesos if proceso.get('modulos') is not None)
+        if not listos:
+            # Sin ningún proceso listo el próximo /ready vuelve a intentar
+            logger.warning("Ningún proceso del pool respondió durante el calentamiento")
+            with _calentamiento_lock:
+                _calentamiento['pid'] = None
+            return
+        _calentamiento['procesos_listos'] = listos
+    else:
+        # Las dos precargas ignoran lo que no pueden cargar: el worker queda listo igual
+        precargar_librerias_pesadas()
+        precargar_extractores()
+    _calentamiento['fin'] = time.time()
+    logger.info(f"Worker calentado en {_calentamiento['fin'] - _calentamiento['inicio']:.1f} s")
+
+def estado_calentamiento():
+    """Si este worker ya puede extraer sin cargar nada pesado. Si no, arranca el calentamiento en segundo plano"""
+    listo = not EXTRACTOR_POOL_HABILITADO and 'precarga_ms' in TIEMPOS_ARRANQUE
+    if not listo:
+        with _calentamiento_lock:
+            if _calentamiento['pid'] != os.getpid():
+                _calentamiento.update({'pid': os.getpid(), 'inicio': time.time(), 'fin': None, 'procesos_listos': None})
+                iniciar_thread(_calentar_worker, name='calentamiento')
+        listo = _calentamiento['fin'] is not None and _calentamiento['pid'] == os.getpid()
+    with extractores_lock:
+        cargados = len(extractores_cargados)
+    estado = {
+        'listo': listo,
+        'precarga': PRECARGA_LIBRERIAS,
+        'extractores_cargados': cargados,
+        'extractores_total': len({info['script'] for info in BANCO_EXTRACTORS.values()}),
+        'librerias_cargadas': sorted(nombre for nombre in LIBRERIAS_PESADAS if nombre in sys.modules)
+    }
+    if EXTRACTOR_POOL_HABILITADO:
+        # Los extractores se cargan en los procesos del pool (ver /admin/extractores)
+        estado['pool'] = {'procesos': EXTRACTOR_POOL_SIZE, 'procesos_listos': _calentamiento['procesos_listos']}
+    return estado
+
+def _percentil(valores, percentil):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(percentil * (len(ordenados) - 1))))]
+
+def latencia_reciente():
+    """p50/p95 de la duración de los trabajos admitidos que terminaron en la ventana de admisión"""
+    filas = _conexion_estado().execute(
+        'SELECT tipo, fin - inicio AS segundos FROM admision WHERE fin IS NOT NULL AND fin >= ?',
+        (time.time() - ADMISION_VENTANA_SEGUNDOS,)
+    ).fetchall()
+    por_tipo = {}
+    for fila in filas:
+        por_tipo.setdefault(fila['tipo'], []).append(fila['segundos'])
+    todos = [fila['segundos'] for fila in filas]
+    redondear = lambda valor: round(valor, 3) if valor is not None else None
+    return {
+        'ventana_segundos': ADMISION_VENTANA_SEGUNDOS,
+        'trabajos': len(todos),
+        'p50_segundos': redondear(_percentil(todos, 0.5)),
+        'p95_segundos': redondear(_percentil(todos, 0.95)),
+        'p95_por_tipo': {tipo: redondear(_percentil(valores, 0.95)) for tipo, valores in por_tipo.items()}
+    }
+
+def estado_disponibilidad():
+    """Arma el reporte de /ready. Devuelve (listo, reporte)"""
+    motivos = []
+    
+    calentamiento = estado_calentamiento()
+    if not calentamiento['listo']:
+        if EXTRACTOR_POOL_HABILITADO:
+            motivos.append('El pool de extracción de este worker todavía está arrancando')
+        else:
+            motivos.append('El worker todavía está cargando librerías y extractores')
+    
+    dependencias = {nombre: verificar_dependencia(nombre) for nombre in BINARIOS_DEPENDENCIAS}
+    dependencias['almacen'] = verificar_dependencia('almacen')
+    for nombre in LISTO_DEPENDENCIAS_REQUERIDAS + ['almacen']:
+        if nombre in dependencias and not dependencias[nombre]['ok']:
+            motivos.append(f'Dependencia no disponible: {nombre}')
+    
+    libre = shutil.disk_usage(TEMP_DIR).free
+    temp = {'libre_bytes': libre, 'minimo_bytes': LISTO_TEMP_LIBRE_MIN_MB * 1024 * 1024}
+    if libre < temp['minimo_bytes']:
+        motivos.append(f'Quedan {libre / 1024 / 1024:.0f} MB libres en TEMP_DIR')
+    
+    admision = estado_admision()
+    ocupacion = admision['costo_en_curso'] / ADMISION_CAPACIDAD if ADMISION_CAPACIDAD else 0
+    if ADMISION_HABILITADA and ocupacion >= LISTO_OCUPACION_MAX:
+        motivos.append(f'Capacidad ocupada al {ocupacion:.0%}')
+    
+    jobs = {status: 0 for status in JOB_ESTADOS_ACTIVOS}
+    for fila in _conexion_estado().execute(
+        'SELECT status, COUNT(*) AS cantidad FROM jobs WHERE status IN (?, ?) GROUP BY status', JOB_ESTADOS_ACTIVOS
+    ):
+        jobs[fila['status']] = fila['cantidad']
+    
+    pool = None
+    if EXTRACTOR_POOL_HABILITADO and _pool_extraccion is not None and _pool_extraccion_pid == os.getpid():
+        pool = _pool_extraccion.estado()
+        if pool['esperando'] >= pool['procesos']:
+            motivos.append(f"{pool['esperando']} extracciones esperando un proceso libre en este worker")
+    
+    latencia = latencia_reciente()
+    if LISTO_P95_MAX_SEGUNDOS and (latencia['p95_segundos'] or 0) > LISTO_P95_MAX_SEGUNDOS:
+        motivos.append(f"p95 reciente de {latencia['p95_segundos']:.0f} s")
+    
+    return not motivos, {
+        'pid': os.getpid(),
+        'motivos': motivos,
+        'calentamiento': calentamiento,
+        'dependencias': dependencias,
+        'temp': temp,
+        'capacidad': {
+            'ocupacion': round(ocupacion, 3),
+            'ocupacion_max': LISTO_OCUPACION_MAX,
+            'costo_en_curso': admision['costo_en_curso'],
+            'capacidad': ADMISION_CAPACIDAD,
+            'trabajos_en_curso': admision['trabajos_en_curso'],
+            'jobs_activos': jobs['processing'],
+            'jobs_en_cola': jobs['pending'],
+            'pool': {'procesos': pool['procesos'], 'en_uso': pool['en_uso'], 'esperando': pool['esperando']} if pool else None
+        },
+        'latencia': latencia
+    }
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness para el balanceador: 200 si la instancia puede tomar trabajo pesado, 503 si no"""
+    try:
+        listo, reporte = estado_disponibilidad()
+    except Exception as e:
+        logger.error(f"Error evaluando la disponibilidad: {str(e)}", exc_info=True)
+        listo, reporte = False, {'motivos': [f'Error evaluando la disponibilidad: {e}']}
+    
+    respuesta = jsonify({'status': 'ready' if listo else 'unavailable', **reporte})
+    respuesta.status_code = 200 if listo else 503
+    respuesta.headers['Cache-Control'] = 'no-store'
+    if not listo:
+        respuesta.headers['Retry-After'] = str(LISTO_RETRY_SEGUNDOS)
+    return respuesta
+
+# ==================== FIN DISPONIBILIDAD (READINESS) ====================
+
 if __name__ == '__main__':
     # NOTA: Este bloque SOLO se ejecuta cuando se corre directamente con python server.py
     # Railway/Gunicorn NO ejecuta este bloque, importa la app directamente
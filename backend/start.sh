@@ -5,11 +5,22 @@ echo "Iniciando servidor..."
 
 cd /app
 
+# Cantidad de workers de gunicorn; el pool de extracción reparte los núcleos entre ellos
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
+# Threads por worker; la app reparte sus cupos (I/O saliente, streams de eventos) con este mismo valor
+export GUNICORN_THREADS=${GUNICORN_THREADS:-8}
+# Las librerías pesadas se importan una vez en el master (--preload) y los workers las heredan
+export PRECARGA_LIBRERIAS=${PRECARGA_LIBRERIAS:-1}
+
 # Usa gunicorn apuntando al módulo y variable 'app'
+# Workers con threads: los requests esperan al pool de procesos sin bloquear al resto
+# Sin --access-logfile: la app escribe un registro JSON por request, con muestreo por ruta
 exec /opt/venv/bin/gunicorn server:app \
   --bind 0.0.0.0:${PORT:-8080} \
   --timeout 300 \
-  --workers 2 \
+  --workers ${WEB_CONCURRENCY} \
+  --worker-class gthread \
+  --threads ${GUNICORN_THREADS} \
+  --preload \
   --log-level info \
-  --access-logfile - \
   --error-logfile -
\ No newline at end of file
@@ -66,6 +66,36 @@ test_endpoint "GET" "/" "Endpoint Raíz"
 test_endpoint "GET" "/health" "Health Check"
 test_endpoint "GET" "/extractors" "Lista de Extractores"
 
+# Dos extracciones idénticas a la vez, una con ?download=1: la segunda espera a la primera y su
+# Excel tiene que quedar descargable aunque la primera ya haya borrado el suyo
+# Uso: PDF_PRUEBA=/ruta/al/resumen.pdf BANCO_PRUEBA=banco_galicia ./test_endpoints.sh
+if [ -n "$PDF_PRUEBA" ]; then
+    BANCO_PRUEBA="${BANCO_PRUEBA:-banco_galicia}"
+    echo -e "${BLUE}Testing: Extracciones idénticas simultáneas${NC}"
+    tmp_dir=$(mktemp -d)
+    curl -s -o "$tmp_dir/directo.xlsx" -w "%{http_code}" -X POST "$BASE_URL/extract?download=1" \
+        -F "pdf=@$PDF_PRUEBA" -F "banco=$BANCO_PRUEBA" > "$tmp_dir/directo.code" &
+    curl -s -w "\n%{http_code}" -X POST "$BASE_URL/extract" \
+        -F "pdf=@$PDF_PRUEBA" -F "banco=$BANCO_PRUEBA" > "$tmp_dir/url.txt" &
+    wait
+
+    directo_code=$(cat "$tmp_dir/directo.code")
+    url_code=$(tail -n1 "$tmp_dir/url.txt")
+    download_url=$(head -n-1 "$tmp_dir/url.txt" | python3 -c "import sys, json; print(json.load(sys.stdin).get('downloadUrl', ''))")
+    descarga_code=$(curl -s -o /dev/null -w "%{http_code}" "$download_url")
+
+    if [ "$directo_code" == "200" ] && [ "$url_code" == "200" ] && [ "$descarga_code" == "200" ]; then
+        echo -e "${GREEN}✓ download=1: $directo_code, downloadUrl: $url_code, descarga: $descarga_code${NC}"
+    else
+        echo -e "${RED}✗ download=1: $directo_code, downloadUrl: $url_code, descarga: $descarga_code${NC}"
+        head -n-1 "$tmp_dir/url.txt"
+        rm -rf "$tmp_dir"
+        exit 1
+    fi
+    rm -rf "$tmp_dir"
+    echo ""
+fi
+
 echo "================================"
 echo -e "${GREEN}Tests completados${NC}"
 echo "================================"